@@ -0,0 +1,84 @@
+import os
+import sys
+import zlib
+
+import pytest
+from PyPDF2 import PdfReader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watermark_config import WatermarkSettings
+from watermark_fonts import available_fonts, resolve_font, register_font
+
+
+@pytest.fixture
+def settings():
+    # 用搜索路径里能找到的第一种字体；一种都没有时跳过需要盖章的测试
+    fonts = available_fonts()
+    if not fonts:
+        pytest.skip("没有可用的水印字体")
+    font_name, font_path = resolve_font(fonts[0])
+    register_font(font_name, font_path)   # 直接调用 add_watermark 的测试不经过 run_batch 注册
+    return WatermarkSettings(text="CONFIDENTIAL", font_name=font_name, font_path=font_path)
+
+
+def make_pdf(path, pages=1, rotate=0, size=(595.27, 841.89)):
+    # 用 reportlab 生成每页写着 "page N" 的测试 PDF；rotate 为 /Rotate
+    # size 为转正后的显示尺寸：rotate 为 90/270 时 reportlab 会交换 MediaBox 的宽高
+    from reportlab.pdfgen import canvas
+    can = canvas.Canvas(path, pagesize=size)
+    for n in range(1, pages + 1):
+        can.setPageRotation(rotate)
+        can.drawString(72, 72, f"page {n}")
+        can.showPage()
+    can.save()
+    return path
+
+
+def make_inputs(folder, count=2):
+    # folder 下的 doc0.pdf、doc1.pdf……，第 i 个文件有 i + 1 页
+    os.makedirs(folder, exist_ok=True)
+    return [make_pdf(os.path.join(folder, f"doc{i}.pdf"), pages=i + 1) for i in range(count)]
+
+
+def check_output(path, pages, overlay='/WmOverlay0'):
+    # 输出页数正确、原有文字还在；overlay 为水印 XObject 的资源名（merge 方式传 None）
+    reader = PdfReader(path)
+    assert len(reader.pages) == pages
+    for n, page in enumerate(reader.pages, 1):
+        assert f"page {n}" in page.extract_text()
+        if overlay is not None:
+            assert overlay in page['/Resources']['/XObject']
+    return reader
+
+
+def make_xref_stream_pdf(path, pages=2):
+    # 手写一个用交叉引用流（PDF 1.5+，没有 trailer 字典）的 PDF
+    count = 4 + 2 * pages   # 交叉引用流自身的对象号
+    kids = ' '.join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for i in range(pages):
+        objects[4 + 2 * i] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                              f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>").encode()
+        data = f"BT /F1 12 Tf 72 72 Td (page {i + 1}) Tj ET".encode()
+        objects[5 + 2 * i] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(data), data)
+    out = bytearray(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (num, objects[num])
+    xref_pos = len(out)
+    offsets[count] = xref_pos
+    rows = b"\x00\x00\x00\x00\x00\xff\xff"
+    rows += b''.join(b"\x01" + offsets[num].to_bytes(4, 'big') + b"\x00\x00" for num in range(1, count + 1))
+    data = zlib.compress(rows)
+    out += (b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Filter /FlateDecode /Length %d >>\n"
+            b"stream\n" % (count, count + 1, len(data))) + data + b"\nendstream\nendobj\n"
+    out += b"startxref\n%d\n%%%%EOF\n" % xref_pos
+    with open(path, 'wb') as f:
+        f.write(out)
+    return path
@@ -0,0 +1,35 @@
+import argparse
+
+import pytest
+
+from watermark_config import add_settings_arguments, settings_from_args
+
+
+def _parse(settings, *argv):
+    parser = argparse.ArgumentParser()
+    add_settings_arguments(parser)
+    return settings_from_args(parser.parse_args(['--text', 'x', '--font-path', settings.font_path, *argv]))
+
+
+@pytest.mark.parametrize('argv', [
+    ['--alpha', '101'], ['--alpha', '-1'], ['--h-count', '0'], ['--tile', '--h-count', '0'],
+    ['--v-count', '101', '--tile'], ['--text-size', '5'], ['--logo-size', '201'], ['--angle', '91'],
+    ['--angle', 'x'], ['--flatten-quality', '0'],
+])
+def test_out_of_range_arguments_are_rejected(settings, argv, capsys):
+    with pytest.raises(SystemExit):
+        _parse(settings, *argv)
+    assert '应' in capsys.readouterr().err
+
+
+def test_grid_count_limit_depends_on_tile(settings):
+    # 网格逐个绘制，上限比平铺低；要等 --tile 也解析完才能判断
+    with pytest.raises(SystemExit, match='网格'):
+        _parse(settings, '--h-count', '11')
+    parsed = _parse(settings, '--h-count', '11', '--v-count', '100', '--tile')
+    assert (parsed.h_count, parsed.v_count, parsed.tile) == (11, 100, True)
+
+
+def test_arguments_within_range(settings):
+    parsed = _parse(settings, '--alpha', '100', '--angle', '-90', '--text-size', '200', '--h-count', '10')
+    assert parsed.alpha == 1 and parsed.angle == -90 and parsed.text_size_pct == 200 and parsed.h_count == 10
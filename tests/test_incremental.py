@@ -0,0 +1,77 @@
+import re
+from dataclasses import replace
+
+import pytest
+from PyPDF2 import PdfReader
+
+from conftest import make_pdf, make_xref_stream_pdf
+from watermark_engine import add_watermark
+
+
+def _startxref(data):
+    return int(re.findall(rb'startxref\s+(\d+)', data)[-1])
+
+
+def _appended_xref(data):
+    # 解析末尾追加的 xref 表：返回 ({对象号: (偏移, 代号)}, trailer 文本)
+    pos = _startxref(data)
+    assert data[pos:pos + 4] == b'xref'
+    table, trailer = data[pos + 4:].split(b'trailer', 1)
+    lines = table.split()
+    entries = {}
+    i = 0
+    while i < len(lines):
+        start, count = int(lines[i]), int(lines[i + 1])
+        i += 2
+        for num in range(start, start + count):
+            offset, gen, kind = int(lines[i]), int(lines[i + 1]), lines[i + 2]
+            i += 3
+            if kind == b'n':
+                entries[num] = (offset, gen)
+    return entries, trailer
+
+
+@pytest.mark.parametrize('make', [make_pdf, make_xref_stream_pdf], ids=['classic', 'xref-stream'])
+def test_incremental_appends_xref_with_prev(tmp_path, settings, make):
+    inp = make(str(tmp_path / 'in.pdf'), pages=3)
+    out = str(tmp_path / 'out.pdf')
+    with open(inp, 'rb') as f:
+        original = f.read()
+    assert add_watermark(inp, out, replace(settings, incremental=True, pages='2-')) == 3
+    with open(out, 'rb') as f:
+        data = f.read()
+
+    # 原文件字节原样保留，新 xref 的 /Prev 指向原来的 xref
+    assert data.startswith(original)
+    entries, trailer = _appended_xref(data)
+    assert re.search(rb'/Prev %d\b' % _startxref(original), trailer)
+    size = int(re.search(rb'/Size (\d+)', trailer).group(1))
+    assert b'/Root' in trailer and max(entries) < size
+    # 每个 xref 条目都指向追加部分里对应的 "num gen obj"
+    for num, (offset, gen) in entries.items():
+        assert offset >= len(original)
+        assert data[offset:].startswith(b'%d %d obj' % (num, gen))
+
+    original_reader = PdfReader(inp)
+    reader = PdfReader(out, strict=True)
+    assert len(reader.pages) == 3
+    # 只改动了选中的两页，第 1 页的页面对象没有重新写出
+    page_nums = [page.indirect_reference.idnum for page in original_reader.pages]
+    assert page_nums[0] not in entries and set(page_nums[1:]) <= set(entries)
+    for n, page in enumerate(reader.pages, 1):
+        assert f"page {n}" in page.extract_text()
+        xobjects = page['/Resources'].get('/XObject', {})
+        assert ('/WmOverlay0' in xobjects) == (n > 1)
+        # 原有字体资源仍在
+        assert page['/Resources']['/Font'].keys() == original_reader.pages[n - 1]['/Resources']['/Font'].keys()
+    form = reader.pages[1]['/Resources']['/XObject']['/WmOverlay0']
+    assert form['/Subtype'] == '/Form' and '/Font' in form['/Resources']
+    # 再次增量盖章时在第二次追加的 xref 里继续链接到上一次的
+    again = str(tmp_path / 'again.pdf')
+    add_watermark(out, again, replace(settings, incremental=True))
+    with open(again, 'rb') as f:
+        twice = f.read()
+    assert re.search(rb'/Prev %d\b' % _startxref(data), _appended_xref(twice)[1])
+    reader = PdfReader(again, strict=True)
+    assert len(reader.pages) == 3
+    assert '/WmOverlay0_0' in reader.pages[1]['/Resources']['/XObject']
@@ -0,0 +1,101 @@
+import os
+import threading
+
+from conftest import make_pdf, make_inputs, check_output
+from watermark_config import PdfTree
+from watermark_engine import run_batch, resume_batch, output_path
+from watermark_jobs import BatchJob, JOURNAL_NAME, pending_job
+
+
+def _cancel_after(count):
+    # 完成 count 个文件后置位取消，模拟中途停下的批处理
+    cancel = threading.Event()
+
+    def on_progress(done):
+        if done >= count:
+            cancel.set()
+    return cancel, on_progress
+
+
+def test_resume_after_partial_run(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 3)
+    out_dir = str(tmp_path / 'out')
+    cancel, on_progress = _cancel_after(1)
+    result = run_batch(pdfs, out_dir, settings, on_progress=on_progress, cancel=cancel, io_threads=0)
+    assert result.cancelled and not result.failures
+    assert BatchJob.exists(out_dir)
+    assert pending_job(out_dir) == (1, 3)
+    first = output_path(pdfs[0], out_dir)
+    assert os.path.exists(first)
+    assert not any(os.path.exists(output_path(inp, out_dir)) for inp in pdfs[1:])
+    stamp = os.stat(first).st_mtime_ns
+
+    # 崩溃时日志末尾可能只写了半行
+    with open(os.path.join(out_dir, JOURNAL_NAME), 'a', encoding='utf-8') as f:
+        f.write('{"file": ')
+    assert BatchJob.load(out_dir).pending() == pdfs[1:]
+
+    progress = []
+    result = resume_batch(out_dir, on_progress=progress.append, io_threads=0)
+    assert not result.cancelled and not result.failures
+    assert progress[0] == 1 and progress[-1] == 3
+    assert not BatchJob.exists(out_dir)
+    assert os.stat(first).st_mtime_ns == stamp
+    for i, inp in enumerate(pdfs):
+        check_output(output_path(inp, out_dir), i + 1)
+
+
+def test_resume_rescans_unfinished_folder(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 3)
+    os.mkdir(tmp_path / 'in' / 'sub')
+    nested = make_pdf(str(tmp_path / 'in' / 'sub' / 'nested.pdf'), pages=2)
+    out_dir = str(tmp_path / 'out')
+    cancel, on_progress = _cancel_after(1)
+    result = run_batch(PdfTree([str(tmp_path / 'in')]), out_dir, settings,
+                       on_progress=on_progress, cancel=cancel, io_threads=0)
+    assert result.cancelled
+    job = BatchJob.load(out_dir)
+    assert job.source() is not None and len(job.pdf_list) < 4
+
+    result = resume_batch(out_dir, io_threads=0)
+    assert not result.cancelled and not result.failures
+    assert not BatchJob.exists(out_dir)
+    for i, inp in enumerate(pdfs):
+        check_output(output_path(inp, out_dir), i + 1)
+    check_output(output_path(nested, out_dir, 'sub'), 2)
+
+
+def test_resume_retries_failed_files(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 3)
+    with open(pdfs[0], 'wb') as f:
+        f.write(b'not a pdf' * 100)
+    out_dir = str(tmp_path / 'out')
+    cancel, on_progress = _cancel_after(2)
+    # 不预检：坏文件在盖章时出错，记为普通失败
+    result = run_batch(pdfs, out_dir, settings, on_progress=on_progress, cancel=cancel, io_threads=0,
+                       preflight=None)
+    assert result.cancelled and [name for name, _ in result.failures] == ['doc0.pdf']
+    assert BatchJob.load(out_dir).pending() == [pdfs[0], pdfs[2]]
+
+    make_pdf(pdfs[0])
+    result = resume_batch(out_dir, io_threads=0)
+    assert not result.cancelled and not result.failures
+    assert not BatchJob.exists(out_dir)
+    for i, inp in enumerate(pdfs):
+        check_output(output_path(inp, out_dir), 1 if i == 0 else i + 1)
+
+
+def test_resume_skips_quarantined_files(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 3)
+    with open(pdfs[0], 'wb') as f:
+        f.write(b'not a pdf' * 100)
+    out_dir = str(tmp_path / 'out')
+    cancel, on_progress = _cancel_after(2)
+    result = run_batch(pdfs, out_dir, settings, on_progress=on_progress, cancel=cancel, io_threads=0)
+    assert result.cancelled and result.quarantined == 1
+    assert BatchJob.load(out_dir).pending() == [pdfs[2]]
+
+    result = resume_batch(out_dir, io_threads=0)
+    assert not result.cancelled and not result.quarantined
+    assert not os.path.exists(output_path(pdfs[0], out_dir))
+    check_output(output_path(pdfs[2], out_dir), 3)
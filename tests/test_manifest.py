@@ -0,0 +1,57 @@
+import os
+from dataclasses import replace
+
+from conftest import make_pdf, make_inputs, check_output
+from watermark_engine import run_batch, output_path
+from watermark_manifest import Manifest
+
+
+def test_unchanged_inputs_are_skipped(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 2)
+    out_dir = str(tmp_path / 'out')
+    result = run_batch(pdfs, out_dir, settings)
+    assert not result.failures and result.skipped == 0
+    outputs = [output_path(inp, out_dir) for inp in pdfs]
+    for i, out in enumerate(outputs):
+        check_output(out, i + 1)
+    assert len(Manifest(out_dir).entries) == len(pdfs)
+    stamps = [os.stat(out).st_mtime_ns for out in outputs]
+
+    # 内容没变、只是 mtime 变了也不重做
+    os.utime(pdfs[0], ns=(0, 0))
+    result = run_batch(pdfs, out_dir, settings)
+    assert not result.failures and result.skipped == len(pdfs)
+    assert [os.stat(out).st_mtime_ns for out in outputs] == stamps
+
+
+def test_changed_settings_invalidate(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 2)
+    out_dir = str(tmp_path / 'out')
+    run_batch(pdfs, out_dir, settings)
+    fingerprint = next(iter(Manifest(out_dir).entries.values()))['settings']
+
+    result = run_batch(pdfs, out_dir, replace(settings, text="DRAFT"))
+    assert not result.failures and result.skipped == 0
+    assert all(e['settings'] != fingerprint for e in Manifest(out_dir).entries.values())
+
+
+def test_changed_input_is_redone(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 2)
+    out_dir = str(tmp_path / 'out')
+    run_batch(pdfs, out_dir, settings)
+
+    make_pdf(pdfs[0], pages=3)
+    result = run_batch(pdfs, out_dir, settings)
+    assert not result.failures and result.skipped == 1
+    check_output(output_path(pdfs[0], out_dir), 3)
+
+
+def test_missing_output_is_redone(tmp_path, settings):
+    pdfs = make_inputs(tmp_path / 'in', 2)
+    out_dir = str(tmp_path / 'out')
+    run_batch(pdfs, out_dir, settings)
+
+    os.remove(output_path(pdfs[1], out_dir))
+    result = run_batch(pdfs, out_dir, settings)
+    assert not result.failures and result.skipped == 1
+    check_output(output_path(pdfs[1], out_dir), 2)
@@ -0,0 +1,68 @@
+from dataclasses import replace
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from conftest import make_pdf, check_output
+from watermark_engine import add_watermark
+from watermark_preflight import set_passwords
+
+
+def _make_rc4_pdf(path, pages=2):
+    # 用户密码 u、所有者密码 o 的 RC4-128 加密 PDF
+    plain = make_pdf(path + '.plain', pages=pages)
+    writer = PdfWriter()
+    for page in PdfReader(plain).pages:
+        writer.add_page(page)
+    writer.encrypt('u', 'o', use_128bit=True)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+@pytest.fixture
+def passwords():
+    set_passwords(['u'])
+    yield
+    set_passwords(())
+
+
+@pytest.mark.parametrize('mode', [{}, {'incremental': True}, {'streaming': True}],
+                         ids=['default', 'incremental', 'streaming'])
+def test_encrypted_input_is_reencrypted(tmp_path, settings, passwords, mode):
+    inp = _make_rc4_pdf(str(tmp_path / 'in.pdf'))
+    out = str(tmp_path / 'out.pdf')
+    assert add_watermark(inp, out, replace(settings, **mode)) == 2
+    reader = PdfReader(out)
+    assert reader.is_encrypted
+    assert reader.decrypt('wrong') == 0
+    assert reader.decrypt('u') != 0
+    for n, page in enumerate(reader.pages, 1):
+        assert f"page {n}" in page.extract_text()
+        assert '/WmOverlay0' in page['/Resources']['/XObject']
+
+
+def test_page_selection(tmp_path, settings):
+    inp = make_pdf(str(tmp_path / 'in.pdf'), pages=4)
+    out = str(tmp_path / 'out.pdf')
+    assert add_watermark(inp, out, replace(settings, pages='2,4')) == 4
+    reader = check_output(out, 4, overlay=None)
+    stamped = ['/XObject' in page['/Resources'] and '/WmOverlay0' in page['/Resources']['/XObject']
+               for page in reader.pages]
+    assert stamped == [False, True, False, True]
+
+
+def test_flatten_replaces_page_content_with_image(tmp_path, settings):
+    pytest.importorskip('pymupdf')
+    inp = make_pdf(str(tmp_path / 'in.pdf'), pages=2)
+    out = str(tmp_path / 'out.pdf')
+    assert add_watermark(inp, out, replace(settings, flatten=True, pages='1')) == 2
+    reader = PdfReader(out)
+    first, second = reader.pages
+    # 选中的页只剩一张整页图片，没有可提取的文字或水印 XObject
+    assert list(first['/Resources']['/XObject']) == ['/Im0']
+    assert first['/Resources']['/XObject']['/Im0']['/Subtype'] == '/Image'
+    assert '/Font' not in first['/Resources']
+    assert first.extract_text().strip() == ''
+    # 未选中的页原样保留
+    assert "page 2" in second.extract_text()
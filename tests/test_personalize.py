@@ -0,0 +1,39 @@
+from dataclasses import replace
+
+import pytest
+from PyPDF2.generic import ArrayObject, IndirectObject
+
+from conftest import make_pdf, check_output
+from watermark_personalize import personalize
+
+ROWS = [{'name': 'alice'}, {'name': 'bob'}]
+
+
+@pytest.mark.parametrize('mode', ['xobject', 'merge'])
+def test_personalized_copies(tmp_path, settings, mode):
+    source = make_pdf(str(tmp_path / 'src.pdf'), pages=2)
+    out_dir = str(tmp_path / 'out')
+    result = personalize(source, ROWS, out_dir, replace(settings, text="For {name} {page}/{pages}", stamp_mode=mode),
+                         name_template='{name}.pdf')
+    assert not result.failures and not result.cancelled
+
+    fitz = pytest.importorskip('fitz')
+    for row in ROWS:
+        path = f"{out_dir}/{row['name']}.pdf"
+        reader = check_output(path, 2, None)
+        others = [r['name'] for r in ROWS if r is not row]
+        for n, page in enumerate(reader.pages, 1):
+            text = page.extract_text()
+            # 每份副本只有自己的文字，前一份副本的文字层没有留在源页面上
+            assert f"For {row['name']} {n}/2" in text
+            assert not any(name in text for name in others)
+            # 内容流是间接对象（或间接对象数组），不是直接写在页面字典里的流
+            assert isinstance(page.raw_get('/Contents'), (IndirectObject, ArrayObject))
+            assert '/F1' in page['/Resources']['/Font']
+            overlays = [n for n in page['/Resources'].get('/XObject', {}) if n.startswith('/WmOverlay')]
+            assert len(overlays) == (1 if mode == 'xobject' else 0)   # 没有 Logo：只有文字层
+        fitz.TOOLS.mupdf_warnings()
+        with fitz.open(path) as doc:
+            assert doc.page_count == 2 and not doc.is_repaired
+            assert [f"For {row['name']} {n}/2" in page.get_text() for n, page in enumerate(doc, 1)] == [True, True]
+        assert fitz.TOOLS.mupdf_warnings() == ''
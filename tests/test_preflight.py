@@ -0,0 +1,57 @@
+import os
+import json
+
+from conftest import make_pdf, make_inputs, check_output
+from watermark_config import PdfTree, QUARANTINE_DIR, QUARANTINE_NAME
+from watermark_engine import Prefetched, run_batch, output_path, _largest_first
+from watermark_preflight import Preflight
+
+
+def test_bad_files_are_quarantined(tmp_path, settings):
+    src = tmp_path / 'in'
+    good = make_inputs(src, 1)[0]
+    os.mkdir(src / 'sub')
+    junk = src / 'sub' / 'junk.pdf'
+    junk.write_bytes(b'not a pdf' * 100)
+    empty = src / 'empty.pdf'
+    empty.write_bytes(b'')
+    out_dir = str(tmp_path / 'out')
+
+    result = run_batch(PdfTree([str(src)]), out_dir, settings)
+    assert result.quarantined == 2 and len(result.failures) == 2
+    check_output(output_path(good, out_dir), 1)
+    # 隔离文件夹保持子目录结构，输入文件原样留在原处
+    quarantined = os.path.join(out_dir, QUARANTINE_DIR)
+    assert open(os.path.join(quarantined, 'sub', 'junk.pdf'), 'rb').read() == junk.read_bytes()
+    assert os.path.exists(os.path.join(quarantined, 'empty.pdf'))
+    assert junk.exists() and empty.exists()
+    with open(os.path.join(out_dir, QUARANTINE_NAME), encoding='utf-8') as f:
+        entries = {e['file']: e for e in map(json.loads, f)}
+    assert entries[str(junk)]['status'] == 'damaged'
+    assert entries[str(junk)]['quarantined'] == os.path.join(quarantined, 'sub', 'junk.pdf')
+    assert not os.path.exists(output_path(str(junk), out_dir, 'sub'))
+
+
+def _item(name, pages, size):
+    preflight = None if pages is None else Preflight('ok', pages, size, False, True, '')
+    return Prefetched(name, name, size, None, None, False, None, preflight)
+
+
+def test_largest_first_within_window():
+    items = [_item('a', 1, 900), _item('b', 50, 100), _item('c', 5, 100), _item('d', 80, 100), _item('e', 2, 100)]
+    order = [item.inp for item in _largest_first(iter(items), 3)]
+    # 窗口内按页数从多到少；窗口外的文件还没读到，不会提前
+    assert order == ['b', 'd', 'c', 'e', 'a']
+    # 没有预检时按文件大小
+    items = [_item('a', None, 10), _item('b', None, 30), _item('c', None, 20)]
+    assert [item.inp for item in _largest_first(iter(items), 4)] == ['b', 'c', 'a']
+
+
+def test_pool_batch_with_preflight_order(tmp_path, settings):
+    pages = {inp: i + 1 for i, inp in enumerate(make_inputs(tmp_path / 'in', 4))}
+    pages[make_pdf(str(tmp_path / 'in' / 'big.pdf'), pages=40)] = 40
+    out_dir = str(tmp_path / 'out')
+    result = run_batch(list(pages), out_dir, settings, workers=2)
+    assert not result.failures and not result.cancelled
+    for inp, count in pages.items():
+        check_output(output_path(inp, out_dir), count)
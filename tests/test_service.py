@@ -0,0 +1,57 @@
+import asyncio
+import urllib.request
+from urllib.error import HTTPError as URLHTTPError
+
+import pytest
+
+from conftest import make_pdf, check_output
+from watermark_service import WatermarkService, HTTPError
+
+
+@pytest.mark.parametrize('query', [
+    'angle=500', 'angle=x', 'alpha=101', 'h_count=0', 'h_count=11', 'v_count=101&tile=1', 'text_size=5',
+    'logo_size=201', 'color=xyz', 'text_pos=middle', 'pages=0', 'stamp_mode=copy', 'unknown=1',
+])
+def test_invalid_parameters_are_rejected(settings, query):
+    with pytest.raises(HTTPError) as info:
+        WatermarkService(settings)._request_settings(f"/watermark?{query}")
+    assert info.value.status == 400
+
+
+def test_parameters_within_range(settings):
+    settings = WatermarkService(settings)._request_settings(
+        "/watermark?angle=-90&alpha=100&h_count=50&v_count=100&tile=1&text_size=10&color=%23ff0000")
+    assert settings.angle == -90 and settings.alpha == 1 and settings.tile
+    assert (settings.h_count, settings.v_count, settings.text_size_pct) == (50, 100, 10)
+    assert settings.text_color == (1, 0, 0)
+
+
+def test_watermark_request(tmp_path, settings):
+    data = open(make_pdf(str(tmp_path / 'in.pdf'), pages=2), 'rb').read()
+
+    def post(url):
+        request = urllib.request.Request(url, data=data, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.read()
+        except URLHTTPError as e:
+            return e.code, e.read()
+
+    async def run():
+        service = WatermarkService(settings)
+        host, port = await service.start('127.0.0.1', 0)
+        try:
+            loop = asyncio.get_running_loop()
+            base = f"http://{host}:{port}/watermark"
+            return (await loop.run_in_executor(None, post, f"{base}?text=Draft&pages=2"),
+                    await loop.run_in_executor(None, post, f"{base}?angle=500"))
+        finally:
+            await service.close()
+
+    (status, body), (bad_status, _) = asyncio.run(run())
+    assert status == 200 and bad_status == 400
+    out = tmp_path / 'out.pdf'
+    out.write_bytes(body)
+    reader = check_output(str(out), 2, None)
+    assert '/XObject' not in reader.pages[0]['/Resources']
+    assert '/WmOverlay0' in reader.pages[1]['/Resources']['/XObject']
@@ -0,0 +1,66 @@
+from dataclasses import replace
+
+import pytest
+from PyPDF2 import PdfReader
+
+from conftest import make_pdf
+from watermark_engine import add_watermark, page_geometry, _reading_transform
+
+
+def _tile_settings(settings, **kw):
+    return replace(settings, tile=True, h_count=3, v_count=2, **kw)
+
+
+def _pattern_checks(pattern, content, geometry):
+    matrix, w, h = _reading_transform(geometry)
+    left, bottom, width, height, _ = geometry
+    assert pattern['/PatternType'] == 1 and pattern['/PaintType'] == 1
+    # 间距按阅读方向：横向页面（/Rotate 90/270）的宽高互换
+    assert float(pattern['/XStep']) == pytest.approx(w / 3, abs=1e-3)
+    assert float(pattern['/YStep']) == pytest.approx(h / 2, abs=1e-3)
+    # 图案矩阵 = 平移到第一个单元中心，再按 /Rotate 转正
+    a, b, c, d, e, f = (float(v) for v in pattern['/Matrix'])
+    assert (a, b, c, d) == pytest.approx(matrix[:4])
+    cx, cy = w / 6, h / 4
+    assert (e, f) == pytest.approx((cx * matrix[0] + cy * matrix[2] + matrix[4],
+                                    cx * matrix[1] + cy * matrix[3] + matrix[5]))
+    assert b'Tj' in pattern.get_data()
+    # 图案铺满整个可见区域，单元本身不再作为 XObject 调用（merge 方式下内容流经过重新序列化，按记号比较）
+    tokens = content.split()
+    i = tokens.index(b'/WmTile')
+    assert tokens[i - 2:i] == [b'/Pattern', b'cs'] and tokens[i + 1] == b'scn'
+    assert [float(v) for v in tokens[i + 2:i + 6]] == pytest.approx([left, bottom, width, height])
+    assert tokens[i + 6:i + 8] == [b're', b'f'] and b'Do' not in tokens
+
+
+@pytest.mark.parametrize('rotate', [0, 90, 180, 270])
+def test_tile_pattern_on_rotated_pages(tmp_path, settings, rotate):
+    inp = make_pdf(str(tmp_path / 'in.pdf'), pages=2, rotate=rotate)
+    out = str(tmp_path / 'out.pdf')
+    assert add_watermark(inp, out, _tile_settings(settings)) == 2
+
+    reader = PdfReader(out)
+    assert len(reader.pages) == 2
+    forms = set()
+    for n, page in enumerate(reader.pages, 1):
+        assert page.get('/Rotate', 0) == rotate
+        assert f"page {n}" in page.extract_text()
+        assert '/F1' in page['/Resources']['/Font']
+        form = page['/Resources']['/XObject']['/WmOverlay0']
+        forms.add(form.indirect_reference.idnum)
+        resources = form['/Resources']
+        assert not any(name.startswith('/FormXob.WmTile') for name in resources.get('/XObject', {}))
+        _pattern_checks(resources['/Pattern']['/WmTile'], form.get_data(), page_geometry(page))
+    # 同一几何的页面共用一个水印 XObject
+    assert len(forms) == 1
+
+
+def test_tile_pattern_merge_mode(tmp_path, settings):
+    inp = make_pdf(str(tmp_path / 'in.pdf'), rotate=90, size=(842, 595))
+    out = str(tmp_path / 'out.pdf')
+    add_watermark(inp, out, _tile_settings(settings, stamp_mode='merge'))
+
+    page = PdfReader(out).pages[0]
+    assert "page 1" in page.extract_text()
+    _pattern_checks(page['/Resources']['/Pattern']['/WmTile'], page.get_contents().get_data(),
+                    page_geometry(page))
@@ -0,0 +1,141 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+
+import pytest
+
+from conftest import make_pdf, check_output
+from watermark_engine import output_path
+from watermark_watch import FolderWatcher, watch
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.02)
+
+
+def test_file_still_being_written_is_not_ready(tmp_path):
+    path = make_pdf(str(tmp_path / 'a.pdf'))
+    watcher = FolderWatcher([str(tmp_path)], queue.Queue(), settle=1.0, use_events=False)
+    # 第一次看到、以及大小/修改时间不变但还没满 settle 秒时都不算写完
+    assert not watcher._ready(path, 100.0)
+    assert not watcher._ready(path, 100.5)
+    # 写入方还在追加：重新计时
+    with open(path, 'ab') as f:
+        f.write(b'%more')
+    assert not watcher._ready(path, 100.9)
+    assert not watcher._ready(path, 101.5)
+    assert watcher._ready(path, 102.0)
+    # 同一版本只入队一次
+    assert not watcher._ready(path, 105.0)
+
+
+def test_growing_file_is_queued_once_after_it_settles(tmp_path):
+    ready = queue.Queue()
+    watcher = FolderWatcher([str(tmp_path)], ready, settle=0.3, poll=0.02, use_events=False)
+    watcher.start()
+    try:
+        path = str(tmp_path / 'a.pdf')
+        with open(path, 'wb') as f:
+            for _ in range(8):
+                f.write(b'%PDF-1.4\n')
+                f.flush()
+                time.sleep(0.1)
+                assert ready.empty()
+        assert ready.get(timeout=5) == path
+        time.sleep(0.5)
+        assert ready.empty()
+    finally:
+        watcher.stop()
+
+
+def test_full_queue_blocks_the_watcher(tmp_path):
+    paths = [make_pdf(str(tmp_path / f"doc{i}.pdf")) for i in range(3)]
+    ready = queue.Queue(maxsize=1)
+    watcher = FolderWatcher([str(tmp_path)], ready, settle=0, poll=0.02, use_events=False)
+    watcher.start()
+    try:
+        # 队列只放得下一个：第二个文件卡在 put 上，第三个还没轮到检查
+        _wait_for(lambda: len(watcher.queued) == 2)
+        time.sleep(0.3)
+        assert ready.qsize() == 1 and len(watcher.queued) == 2
+        assert [ready.get(timeout=5) for _ in paths] == paths
+    finally:
+        # 阻塞在满队列上时也能停下
+        ready.put(paths[0])
+        started = time.monotonic()
+        watcher.stop()
+        assert time.monotonic() - started < 2
+
+
+def test_processed_files_are_skipped_after_restart(tmp_path, settings):
+    src = tmp_path / 'in'
+    src.mkdir()
+    pdfs = [make_pdf(str(src / f"doc{i}.pdf"), pages=i + 1) for i in range(2)]
+    out_dir = str(tmp_path / 'out')
+
+    def run(seconds):
+        stop = threading.Event()
+        done = []
+        timer = threading.Timer(seconds, stop.set)
+        timer.start()
+        watch([str(src)], out_dir, settings, settle=0.1, poll=0.05, stop=stop,
+              on_done=lambda inp, e, _: done.append((inp, e)), use_events=False)
+        timer.cancel()
+        return done
+
+    done = run(3)
+    assert sorted(done) == [(inp, None) for inp in pdfs]
+    for i, inp in enumerate(pdfs):
+        check_output(output_path(inp, out_dir), i + 1)
+    stamps = [os.stat(output_path(inp, out_dir)).st_mtime_ns for inp in pdfs]
+    # 重启监视：内容和设置都没变的文件不再处理
+    assert run(1.5) == []
+    assert [os.stat(output_path(inp, out_dir)).st_mtime_ns for inp in pdfs] == stamps
+
+
+def test_stop_waits_for_files_in_flight(tmp_path, settings):
+    src = tmp_path / 'in'
+    src.mkdir()
+    small = make_pdf(str(src / 'a.pdf'))
+    large = make_pdf(str(src / 'b.pdf'), pages=300)
+    out_dir = str(tmp_path / 'out')
+    stop = threading.Event()
+    done = []
+
+    def on_done(inp, e, seconds):
+        # 第一个文件完成就停止接收新文件；进行中的大文件照常处理完
+        done.append((inp, e))
+        stop.set()
+
+    watch([str(src)], out_dir, settings, workers=2, settle=0.1, poll=0.05, stop=stop,
+          on_done=on_done, use_events=False)
+    assert done == [(small, None), (large, None)]
+    check_output(output_path(small, out_dir), 1)
+    check_output(output_path(large, out_dir), 300)
+
+
+def test_interrupt_cancels_files_in_flight(tmp_path, settings):
+    src = tmp_path / 'in'
+    src.mkdir()
+    small = make_pdf(str(src / 'a.pdf'))
+    large = make_pdf(str(src / 'b.pdf'), pages=1500)
+    out_dir = str(tmp_path / 'out')
+    cancel = multiprocessing.Event()
+    done = []
+
+    def on_done(inp, e, seconds):
+        # 第一个文件完成时模拟 Ctrl+C，此时大文件还在另一个进程里处理
+        done.append(inp)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        watch([str(src)], out_dir, settings, workers=2, settle=0.1, poll=0.05, cancel=cancel,
+              on_done=on_done, use_events=False)
+    assert done == [small] and cancel.is_set()
+    check_output(output_path(small, out_dir), 1)
+    assert not os.path.exists(output_path(large, out_dir))
@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import subprocess
+import importlib.util
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, A3, letter, landscape
+from reportlab.lib.utils import ImageReader
+
+from watermark_engine import WatermarkSettings, run_batch, memory_usage_mb
+from watermark_fonts import FONT_OPTIONS, resolve_font
+
+# 合成语料的生成方式变化时加一，旧的缓存语料会重新生成
+CORPUS_VERSION = 1
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), 'pdf_watermark_bench')
+
+# 语料：名称 -> (文件数, 每个文件页数)；--quick 时文件数和页数各取约 1/10
+CORPORA = {
+    'small': (200, 2),      # 大量小文件：进程启动、解析开销为主
+    'huge':  (2, 3000),     # 少量超长文件：逐页盖章和写出为主
+    'mixed': (20, 20),      # A4 / Letter / A3 / 横向 / 旋转页面混排：水印模板缓存
+    'scans': (5, 20),       # 整页图片的扫描件：大内容流、大文件复制
+}
+OVERLAYS = ['text', 'logo']
+# 网格密度；带 t 后缀的为平铺模式（输出大小应与密度无关）
+GRIDS = ['1x1', '3x3', '10x10', '10x10t', '50x50t']
+
+# 冷启动用例（--startup）：名称 -> 在全新解释器里执行的代码
+# interpreter 为空解释器的基准，其余用例减去它就是本项目自身的启动开销
+STARTUP_CASES = {
+    'interpreter': "pass",
+    'engine_import': "import watermark_engine",
+    'engine_help': (
+        "import runpy\n"
+        "sys.argv = ['watermark_engine.py', '--help']\n"
+        "try:\n"
+        "    runpy.run_path('watermark_engine.py', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass"
+    ),
+    'gui_window': (
+        "spec = importlib.util.spec_from_file_location('gui', '拖曳版PDF.py')\n"
+        "gui = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(gui)\n"
+        "app = gui.QApplication([])\n"
+        "window = gui.PDFWatermarkerApp()\n"
+        "window.show()\n"
+        "app.processEvents()\n"
+        "window.close()"
+    ),
+}
+# 启动后检查这些重依赖是否已被加载，防止懒加载被无意中破坏
+HEAVY_MODULES = ('PyPDF2', 'reportlab', 'PIL', 'PyQt5', 'pymupdf')
+STARTUP_PROBE = '''import sys, time, json, importlib.util, contextlib, io
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+{body}
+print(json.dumps({{'startup_s': time.perf_counter() - start,
+                  'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def _text_page(c, rng, page_no):
+    c.setFont('Helvetica', 11)
+    width, height = c._pagesize
+    y = height - 72
+    c.drawString(72, y, f"Synthetic page {page_no}")
+    while y > 90:
+        y -= 14
+        c.drawString(72, y, ' '.join(
+            ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9)))
+            for _ in range(12)
+        ))
+
+
+def _scan_image(rng):
+    # 带噪点的灰度“扫描页”：随机字节 JPEG 压缩后接近真实扫描件的体积
+    img = Image.frombytes('L', (850, 1100), bytes(rng.getrandbits(8) for _ in range(850 * 1100)))
+    return img.point(lambda v: 200 + v // 5)
+
+
+def _write_pdf(path, kind, pages, rng):
+    sizes = [A4, letter, A3, landscape(A4)]
+    c = canvas.Canvas(path, pagesize=A4, invariant=1)
+    for page_no in range(pages):
+        if kind == 'mixed':
+            c.setPageSize(sizes[page_no % len(sizes)])
+            if page_no % 5 == 4:
+                c.setPageRotation(90)
+        if kind == 'scans':
+            width, height = c._pagesize
+            c.drawImage(ImageReader(_scan_image(rng)), 0, 0, width, height)
+        else:
+            _text_page(c, rng, page_no)
+        c.showPage()
+    c.save()
+
+
+def generate_corpus(name, corpus_dir, quick=False):
+    # 按固定随机种子生成，同一版本、同一规模下每次得到相同的文件；已生成过的直接复用
+    files, pages = CORPORA[name]
+    if quick:
+        files, pages = max(1, files // 10), max(1, pages // 10)
+    folder = os.path.join(corpus_dir, f"{name}_v{CORPUS_VERSION}_{files}x{pages}")
+    marker = os.path.join(folder, '.complete')
+    paths = [os.path.join(folder, f"{name}_{i:04d}.pdf") for i in range(files)]
+    if os.path.exists(marker):
+        return paths
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    for i, path in enumerate(paths):
+        _write_pdf(path, name, pages, random.Random(f"{name}-{i}"))
+    open(marker, 'w').close()
+    return paths
+
+
+def generate_logo(corpus_dir):
+    path = os.path.join(corpus_dir, f"logo_v{CORPUS_VERSION}.png")
+    if not os.path.exists(path):
+        os.makedirs(corpus_dir, exist_ok=True)
+        img = Image.new('RGBA', (600, 600), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        for r in range(300, 0, -6):
+            draw.ellipse((300 - r, 300 - r, 300 + r, 300 + r), fill=(30, 90, 200, 255 - r * 255 // 300))
+        img.save(path)
+    return path
+
+
+def peak_rss_mb():
+    # 本进程与已退出子进程（进程池）中最大的峰值常驻内存，单位 MB；Windows 上只统计本进程
+    peak = memory_usage_mb()[1]
+    if sys.platform == 'win32' or peak is None:
+        return peak
+    import resource
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return max(peak, children / (1 << 20) if sys.platform == 'darwin' else children / 1024)
+
+
+def _run_case(queue, files, out_dir, settings, workers):
+    # 在独立进程里跑一次批处理，峰值内存不受前面用例影响
+    try:
+        start = time.perf_counter()
+        result = run_batch(files, out_dir, settings, workers=workers, force=True)
+        wall = time.perf_counter() - start
+        output_bytes = sum(
+            os.path.getsize(os.path.join(out_dir, f))
+            for f in os.listdir(out_dir) if f.startswith('wm_')
+        )
+        queue.put({'wall_s': wall, 'peak_rss_mb': peak_rss_mb(), 'output_bytes': output_bytes,
+                   'failures': len(result.failures)})
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+
+def run_case(files, settings, workers, repeat, work_dir):
+    # 重复 repeat 次：耗时取最小值，内存取最大值
+    ctx = multiprocessing.get_context('spawn')
+    best = None
+    for _ in range(repeat):
+        out_dir = os.path.join(work_dir, 'out')
+        shutil.rmtree(out_dir, ignore_errors=True)
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_case, args=(queue, files, out_dir, settings, workers))
+        proc.start()
+        sample = queue.get()
+        proc.join()
+        if 'error' in sample:
+            return sample
+        if best is None:
+            best = sample
+        else:
+            best['wall_s'] = min(best['wall_s'], sample['wall_s'])
+            if sample['peak_rss_mb'] is not None:
+                best['peak_rss_mb'] = max(best['peak_rss_mb'] or 0, sample['peak_rss_mb'])
+    return best
+
+
+def run_startup(name, repeat):
+    # 每次都起一个新进程：wall_s 含解释器启动，startup_s 只算用例代码本身；都取最小值
+    if name == 'gui_window' and importlib.util.find_spec('PyQt5') is None:
+        return {'error': 'PyQt5 未安装'}
+    body = '\n'.join('    ' + line for line in STARTUP_CASES[name].splitlines())
+    code = STARTUP_PROBE.format(body=body, heavy=HEAVY_MODULES)
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+        sample['wall_s'] = wall
+        if best is None:
+            best = sample
+        else:
+            best['wall_s'] = min(best['wall_s'], wall)
+            best['startup_s'] = min(best['startup_s'], sample['startup_s'])
+    return best
+
+
+def environment(args):
+    import PyPDF2
+    import reportlab
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pypdf2': PyPDF2.__version__,
+        'reportlab': reportlab.Version,
+        'workers': args.workers,
+        'repeat': args.repeat,
+        'quick': args.quick,
+        'corpus_version': CORPUS_VERSION,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # 与基线逐项对比，返回超出容差的用例列表（耗时、内存、输出大小任一变差都算）
+    regressions = []
+    for key in ('workers', 'quick', 'corpus_version', 'cpu_count'):
+        if results['environment'].get(key) != baseline['environment'].get(key):
+            print(f"注意：{key} 与基线不同（{baseline['environment'].get(key)} -> {results['environment'].get(key)}），"
+                  f"结果不能直接比较", file=sys.stderr)
+    print(f"\n{'用例':<28}{'耗时 s':>10}{'基线':>10}{'变化':>9}{'内存 MB':>10}{'变化':>9}{'大小':>9}")
+    for case, cur in results['cases'].items():
+        base = baseline['cases'].get(case)
+        if base is None or 'error' in cur or 'error' in base:
+            continue
+        deltas = {}
+        for key in ('wall_s', 'peak_rss_mb', 'output_bytes'):
+            if cur.get(key) is not None and base.get(key):
+                deltas[key] = cur[key] / base[key] - 1
+        print(f"{case:<28}{cur['wall_s']:>10.3f}{base['wall_s']:>10.3f}{deltas.get('wall_s', 0):>+9.1%}"
+              f"{cur['peak_rss_mb'] or 0:>10.1f}{deltas.get('peak_rss_mb', 0):>+9.1%}"
+              f"{deltas.get('output_bytes', 0):>+9.1%}")
+        if any(delta > tolerance for delta in deltas.values()):
+            regressions.append(case)
+    for case, cur in results.get('startup', {}).items():
+        base = baseline.get('startup', {}).get(case)
+        if base is None or 'error' in cur or 'error' in base or not base['wall_s']:
+            continue
+        delta = cur['wall_s'] / base['wall_s'] - 1
+        print(f"{'startup/' + case:<28}{cur['wall_s']:>10.3f}{base['wall_s']:>10.3f}{delta:>+9.1%}")
+        if delta > tolerance:
+            regressions.append(f"startup/{case}")
+    return regressions
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="水印性能基准：生成合成 PDF 语料，按语料 × 水印 × 网格密度计时")
+    parser.add_argument('--corpus', default=','.join(CORPORA), help=f"语料，逗号分隔（{'/'.join(CORPORA)}）")
+    parser.add_argument('--overlay', default=','.join(OVERLAYS), help="水印类型：text（纯文字）/logo（文字+Logo）")
+    parser.add_argument('--grid', default=','.join(GRIDS), help="网格密度，如 1x1,3x3,10x10；加 t 后缀为平铺，如 50x50t")
+    parser.add_argument('--quick', action='store_true', help="缩小语料规模，适合快速自查")
+    parser.add_argument('--repeat', type=int, default=3, help="每个用例重复次数（耗时取最小值）")
+    parser.add_argument('--startup', action='store_true',
+                        help="同时测量冷启动：引擎导入、--help、界面出现窗口（配合 --corpus '' 只测启动）")
+    parser.add_argument('-j', '--workers', type=int, default=1, help="并行进程数")
+    parser.add_argument('--font', default='Arial', help=f"字体（{'/'.join(FONT_OPTIONS)}）；配合 --font-path 时作为注册名")
+    parser.add_argument('--font-path', default='', help="TrueType 字体文件路径（默认按字体搜索路径查找 --font）")
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR, help="合成语料缓存目录")
+    parser.add_argument('--output', default='benchmark_results.json', help="结果 JSON 路径")
+    parser.add_argument('--baseline', help="基线结果 JSON（之前某次的 --output），用于对比")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="相对基线允许的变差比例")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if not args.font_path and args.font in FONT_OPTIONS:
+        try:
+            args.font, args.font_path = resolve_font(args.font)
+        except FileNotFoundError as e:
+            print(e, file=sys.stderr)
+            return 1
+    if not os.path.exists(args.font_path):
+        print(f"找不到字体文件 {args.font_path}，请用 --font-path 指定", file=sys.stderr)
+        return 1
+    corpora = [name for name in args.corpus.split(',') if name]
+    overlays = [name for name in args.overlay.split(',') if name]
+    grids = [grid for grid in args.grid.split(',') if grid]
+    unknown = [name for name in corpora if name not in CORPORA] + [name for name in overlays if name not in OVERLAYS]
+    if unknown:
+        print(f"未知的语料/水印类型: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    logo = generate_logo(args.corpus_dir)
+    results = {'environment': environment(args), 'cases': {}}
+    if args.startup:
+        results['startup'] = {}
+        for name in STARTUP_CASES:
+            sample = run_startup(name, max(args.repeat, 5))
+            results['startup'][name] = sample
+            if 'error' in sample:
+                print(f"{'startup/' + name:<28}失败: {sample['error']}")
+            else:
+                print(f"{'startup/' + name:<28}{sample['wall_s']:>8.3f}s  代码 {sample['startup_s']:.3f}s  "
+                      f"已加载 {', '.join(sample['loaded']) or '-'}")
+    work_dir = tempfile.mkdtemp(prefix='pdf_watermark_bench_')
+    try:
+        for corpus in corpora:
+            files = generate_corpus(corpus, args.corpus_dir, args.quick)
+            input_bytes = sum(os.path.getsize(f) for f in files)
+            for overlay in overlays:
+                for grid in grids:
+                    case = f"{corpus}/{overlay}/{grid}"
+                    h, v = (int(n) for n in grid.rstrip('t').split('x'))
+                    settings = WatermarkSettings(
+                        text="CONFIDENTIAL", font_name=args.font, font_path=args.font_path,
+                        logo_path=logo if overlay == 'logo' else '', h_count=h, v_count=v,
+                        tile=grid.endswith('t'),
+                    )
+                    sample = run_case(files, settings, args.workers, args.repeat, work_dir)
+                    sample.update(files=len(files), input_bytes=input_bytes)
+                    results['cases'][case] = sample
+                    if 'error' in sample:
+                        print(f"{case:<28}失败: {sample['error']}")
+                    else:
+                        rss = '-' if sample['peak_rss_mb'] is None else f"{sample['peak_rss_mb']:.1f}MB"
+                        print(f"{case:<28}{sample['wall_s']:>8.3f}s  峰值 {rss:>9}  "
+                              f"输出 {sample['output_bytes'] / (1 << 20):.2f}MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} 个用例超出容差 {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        print(f"\n所有用例都在基线容差 {args.tolerance:.0%} 以内")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
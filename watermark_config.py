@@ -0,0 +1,319 @@
+import os
+import re
+import argparse
+import importlib.util
+from dataclasses import dataclass
+
+from watermark_fonts import FONT_OPTIONS, resolve_font, add_font_dirs
+
+# 水印设置、常量和命令行参数：引擎、界面、监视/服务/个性化入口共用
+# 这里只依赖标准库，界面和命令行启动时不用先加载 PyPDF2 / reportlab / PIL
+
+# 水印位置（与界面下拉框一致），命令行另外接受英文别名
+POSITIONS = ["中心", "左上", "右上", "左下", "右下"]
+POSITION_ALIASES = {
+    "center": "中心", "top-left": "左上", "top-right": "右上",
+    "bottom-left": "左下", "bottom-right": "右下",
+}
+
+# 盖章方式：xobject = 每个输出文件只嵌入一份 Form XObject，各页仅追加一条 Do 调用；
+#           merge   = 旧方式，PyPDF2 merge_page 把水印内容流复制进每一页
+STAMP_MODES = ["xobject", "merge"]
+
+# 栅格化（--flatten）后页面图像的编码：jpeg = DCT 有损压缩，体积小；flate = 无损压缩，文字边缘清晰但文件大
+FLATTEN_FORMATS = ["jpeg", "flate"]
+
+# 每行/每列水印数量上限：网格逐个绘制，数量多了输出变大；平铺只画一个图案单元，可以更密
+GRID_MAX_COUNT = 10
+TILE_MAX_COUNT = 100
+# 文字/Logo 大小百分比、旋转角度的范围（与界面控件一致）
+SIZE_PCT_RANGE = (10, 200)
+ANGLE_RANGE = (-90, 90)
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.expanduser('~'), 'Desktop', 'pdf_watermark_output')
+# 输出目录里的隔离清单和隔离文件夹：预检判定无法处理的文件（加密缺密码/损坏/超限）
+QUARANTINE_NAME = 'quarantine.jsonl'
+QUARANTINE_DIR = 'quarantine'
+
+# A4 纵向尺寸 (pt)，与 reportlab.lib.pagesizes.A4 相同
+A4 = (595.2755905511812, 841.8897637795277)
+
+# 页面选择里可用的纸张名 -> 纵向尺寸 (pt)；按任一方向匹配，允许 PAPER_TOLERANCE 的误差
+PAPER_SIZES = {
+    'a3': (841.8897637795277, 1190.5511811023623),
+    'a4': A4,
+    'a5': (419.5275590551181, 595.2755905511812),
+    'letter': (612.0, 792.0),
+    'legal': (612.0, 1008.0),
+}
+PAPER_TOLERANCE = 2
+
+@dataclass(frozen=True)
+class WatermarkSettings:
+    # 只含纯 Python 值：可哈希（作缓存键），也可直接 pickle 给子进程
+    text: str
+    font_name: str
+    font_path: str = ''
+    logo_path: str = ''
+    alpha: float = 0.2           # 0–1
+    h_count: int = 1
+    v_count: int = 1
+    text_pos: str = '中心'
+    logo_pos: str = '中心'
+    angle: int = 20
+    text_size_pct: int = 100
+    logo_size_pct: int = 100
+    text_color: tuple = (0.0, 0.0, 0.0)  # 0–1 浮点 (r, g, b)
+    stamp_mode: str = 'xobject'
+    tile: bool = False           # 平铺：文字画成一个图案单元铺满整页，h_count × v_count 为每页的单元数
+    logo_dpi: int = 300          # Logo 按放置尺寸重采样到的分辨率
+    incremental: bool = False    # 增量更新输出：复制原文件，只在末尾追加改动
+    streaming: bool = False      # 流式输出：逐页写出并释放，内存不随页数增长
+    memory_limit_mb: int = 0     # 流式输出时的内存上限（MB），超出后清空解析缓存；0 为不限
+    pages: str = ''              # 要盖章的页面（PageSelection 的写法），空为全部；其余页面原样输出
+    flatten: bool = False        # 栅格化：盖章后每页渲染成一张图片，水印与页面内容合为一体，无法单独删除
+    flatten_dpi: int = 150
+    flatten_format: str = 'jpeg'
+    flatten_quality: int = 85    # JPEG 质量 1–100（flate 无损，忽略）
+
+
+class PdfTree:
+    # 输入的 PDF：文件直接使用，文件夹逐层 os.scandir 边扫描边产出 (PDF 路径, 相对子目录)，
+    # 大目录树不必等全部扫完就能开始处理；recursive 时包含子文件夹，子目录用于在输出目录里保持同样的结构
+    # 每层按文件名排序（先文件后子文件夹），同一棵树每次产出顺序相同；可多次迭代
+    def __init__(self, paths, recursive=True):
+        self.paths = list(paths)
+        self.recursive = recursive
+
+    def __iter__(self):
+        return self.walk()
+
+    def walk(self, exclude=None):
+        # exclude: 不进入的文件夹（如位于输入目录里的输出目录，避免把输出再盖一遍）
+        exclude = os.path.abspath(exclude) if exclude else None
+        for path in self.paths:
+            if os.path.isdir(path):
+                yield from self._walk(path, '', exclude)
+            elif path.lower().endswith('.pdf'):
+                yield path, ''
+
+    def _walk(self, folder, subdir, exclude):
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            return
+        folders = []
+        for entry in entries:
+            try:
+                # 不跟随指向文件夹的符号链接，避免链接成环时无限递归
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive and os.path.abspath(entry.path) != exclude:
+                        folders.append(entry)
+                elif entry.name.lower().endswith('.pdf') and not entry.is_dir():
+                    yield entry.path, subdir
+            except OSError:
+                continue
+        for entry in folders:
+            yield from self._walk(entry.path, os.path.join(subdir, entry.name), exclude)
+
+
+class PageSelection:
+    # 要盖章的页面（--pages）：逗号分隔的各项取并集，项内用 & 连接的条件取交集，页码从 1 开始
+    #   3  2-5  7-（到末页）  -3（前 3 页）  first:N  last:N  odd  even  every:K[:S]（从第 S 页起每 K 页）
+    #   landscape  portrait  a3/a4/a5/letter/legal  w>600  h<=842（按显示方向的页面尺寸，单位 pt）
+    # 例：1,last:1 只盖封面和封底；odd&a4 只盖 A4 尺寸的奇数页
+    def __init__(self, spec):
+        self.spec = spec
+        self.uses_size = False  # 有尺寸条件时才需要读取每页的尺寸
+        self.terms = [[self._atom(atom.strip().lower()) for atom in term.split('&')] for term in spec.split(',')]
+
+    def _atom(self, atom):
+        m = re.fullmatch(r'(\d*)-(\d*)|(\d+)', atom)
+        if m and atom != '-':
+            first = int(m.group(3) or m.group(1) or 1)
+            last = m.group(3) or m.group(2)
+            last = int(last) if last else None
+            if first < 1 or (last is not None and last < first):
+                raise ValueError(f"页码范围无效: {atom}")
+            return lambda n, count, size: first <= n and (last is None or n <= last)
+        m = re.fullmatch(r'(first|last):(\d+)', atom)
+        if m:
+            number = int(m.group(2))
+            if m.group(1) == 'first':
+                return lambda n, count, size: n <= number
+            return lambda n, count, size: n > count - number
+        if atom in ('odd', 'even'):
+            parity = 1 if atom == 'odd' else 0
+            return lambda n, count, size: n % 2 == parity
+        m = re.fullmatch(r'every:(\d+)(?::(\d+))?', atom)
+        if m:
+            step, start = int(m.group(1)), int(m.group(2) or 1)
+            if step < 1 or start < 1:
+                raise ValueError(f"every 的间隔和起始页应不小于 1: {atom}")
+            return lambda n, count, size: n >= start and (n - start) % step == 0
+        self.uses_size = True
+        if atom in ('landscape', 'portrait'):
+            wide = atom == 'landscape'
+            return lambda n, count, size: (size[0] > size[1]) == wide
+        if atom in PAPER_SIZES:
+            paper = PAPER_SIZES[atom]
+            return lambda n, count, size: any(
+                abs(size[0] - w) <= PAPER_TOLERANCE and abs(size[1] - h) <= PAPER_TOLERANCE
+                for w, h in (paper, paper[::-1]))
+        m = re.fullmatch(r'([wh])\s*(<=|>=|<|>|=)\s*(\d+(?:\.\d+)?)', atom)
+        if m:
+            axis, op, value = 0 if m.group(1) == 'w' else 1, m.group(2), float(m.group(3))
+            compare = {'<': float.__lt__, '<=': float.__le__, '>': float.__gt__, '>=': float.__ge__,
+                       '=': lambda a, b: abs(a - b) <= PAPER_TOLERANCE}[op]
+            return lambda n, count, size: compare(float(size[axis]), value)
+        raise ValueError(f"无法识别的页面选择: {atom or '（空）'}")
+
+    def wants(self, page_no, page_count, size=None):
+        # size: 按显示方向的 (宽, 高) pt，只在 uses_size 时需要
+        return any(all(atom(page_no, page_count, size) for atom in term) for term in self.terms)
+
+
+# 参数校验：命令行（argparse 的 type=）和 HTTP 服务的查询参数共用，出错时抛出 ArgumentTypeError
+def parse_color(value):
+    value = value.lstrip('#')
+    if len(value) != 6:
+        raise argparse.ArgumentTypeError(f"颜色格式应为 #RRGGBB: {value}")
+    try:
+        return tuple(int(value[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"颜色格式应为 #RRGGBB: {value}")
+
+
+def parse_position(value):
+    value = POSITION_ALIASES.get(value, value)
+    if value not in POSITIONS:
+        raise argparse.ArgumentTypeError(
+            f"位置应为 {'/'.join(POSITIONS)} 或 {'/'.join(POSITION_ALIASES)}"
+        )
+    return value
+
+
+def parse_range(value, low, high):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"应为整数: {value}")
+    if not low <= number <= high:
+        raise argparse.ArgumentTypeError(f"应在 {low}–{high} 之间: {value}")
+    return number
+
+
+def int_range(low, high):
+    # 给 argparse 的 type=：[low, high] 内的整数
+    return lambda value: parse_range(value, low, high)
+
+
+def check_counts(h_count, v_count, tile):
+    # 数量上限取决于是否平铺，要等全部参数解析完才能检查；超出时抛出 ValueError
+    limit = TILE_MAX_COUNT if tile else GRID_MAX_COUNT
+    if max(h_count, v_count) > limit:
+        raise ValueError(f"{'平铺' if tile else '网格'}时横向/纵向数量应在 1–{limit} 之间")
+
+
+def parse_pages(value):
+    # 空字符串为全部页面（argparse 也会用它检查默认值）
+    try:
+        if value:
+            PageSelection(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def add_settings_arguments(parser):
+    # 水印设置相关的参数，批处理与监视模式（watermark_watch.py）共用
+    parser.add_argument('--text', help="水印文字")
+    parser.add_argument('--font', default="微软雅黑",
+                        help=f"字体（{'/'.join(FONT_OPTIONS)}）；配合 --font-path 时作为注册名")
+    parser.add_argument('--font-path', default='', help="字体文件路径，覆盖内置字体表")
+    parser.add_argument('--font-dir', action='append', default=[],
+                        help="额外的字体目录（可重复），优先于系统字体目录")
+    parser.add_argument('--logo', default='', help="Logo 图片路径")
+    parser.add_argument('--alpha', type=int_range(0, 100), default=20, help="透明度 0–100")
+    parser.add_argument('--h-count', type=int_range(1, TILE_MAX_COUNT), default=1,
+                        help=f"横向数量 1–{GRID_MAX_COUNT}（平铺时 1–{TILE_MAX_COUNT}）")
+    parser.add_argument('--v-count', type=int_range(1, TILE_MAX_COUNT), default=1,
+                        help=f"纵向数量 1–{GRID_MAX_COUNT}（平铺时 1–{TILE_MAX_COUNT}）")
+    parser.add_argument('--tile', action='store_true',
+                        help="平铺：文字作为 PDF 平铺图案铺满整页，密度不影响输出大小和渲染耗时")
+    parser.add_argument('--pages', type=parse_pages, default='',
+                        help="只给这些页盖章，其余页面原样输出，如 1-3,7-  first:1  last:2  odd  every:3  landscape  "
+                             "a4  w>600；逗号取并集，& 取交集（默认全部页面）")
+    parser.add_argument('--text-pos', type=parse_position, default='中心', help="文字位置")
+    parser.add_argument('--logo-pos', type=parse_position, default='中心', help="Logo 位置")
+    parser.add_argument('--angle', type=int_range(*ANGLE_RANGE), default=20,
+                        help=f"旋转角度 (°) {ANGLE_RANGE[0]}–{ANGLE_RANGE[1]}")
+    parser.add_argument('--text-size', type=int_range(*SIZE_PCT_RANGE), default=100,
+                        help=f"文字大小百分比 {SIZE_PCT_RANGE[0]}–{SIZE_PCT_RANGE[1]}")
+    parser.add_argument('--logo-size', type=int_range(*SIZE_PCT_RANGE), default=100,
+                        help=f"Logo 大小百分比 {SIZE_PCT_RANGE[0]}–{SIZE_PCT_RANGE[1]}")
+    parser.add_argument('--logo-dpi', type=int, default=300, help="Logo 重采样分辨率 (DPI)")
+    parser.add_argument('--color', type=parse_color, default=(0.0, 0.0, 0.0), help="文字颜色 #RRGGBB")
+    parser.add_argument('--stamp-mode', choices=STAMP_MODES, default='xobject',
+                        help="xobject：共享 Form XObject（默认）；merge：逐页复制水印内容")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量更新：复制原文件并只追加改动，适合超大扫描件")
+    parser.add_argument('--streaming', action='store_true',
+                        help="流式输出：逐页写出并释放，内存占用不随页数增长（适合超长文档）")
+    parser.add_argument('--memory-limit', type=int, default=0, metavar='MB',
+                        help="流式输出时每个进程的内存上限，超出后清空解析缓存（隐含 --streaming）")
+    parser.add_argument('--flatten', action='store_true',
+                        help="栅格化：每页连同水印渲染成图片，水印无法用 PDF 编辑器删除（需要 PyMuPDF）")
+    parser.add_argument('--flatten-dpi', type=int, default=150, help="栅格化分辨率 (DPI)")
+    parser.add_argument('--flatten-format', choices=FLATTEN_FORMATS, default='jpeg',
+                        help="栅格化页面的编码：jpeg（有损，体积小，默认）/flate（无损）")
+    parser.add_argument('--flatten-quality', type=int_range(1, 100), default=85, help="栅格化 JPEG 质量 1–100")
+
+
+def settings_from_args(args):
+    add_font_dirs(args.font_dir)
+    if args.font_path:
+        font_name, font_path = args.font, args.font_path
+    elif args.font in FONT_OPTIONS:
+        try:
+            font_name, font_path = resolve_font(args.font)
+        except FileNotFoundError as e:
+            raise SystemExit(str(e))
+    else:
+        raise SystemExit(f"未知字体: {args.font}（可用 --font-path 指定字体文件）")
+    if not os.path.exists(font_path):
+        raise SystemExit(f"找不到字体文件: {font_path}")
+    try:
+        check_counts(args.h_count, args.v_count, args.tile)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    # 只查找不导入，启动时不必加载 PyMuPDF
+    if args.flatten and importlib.util.find_spec('pymupdf') is None:
+        raise SystemExit("--flatten 需要安装 PyMuPDF: pip install pymupdf")
+    return WatermarkSettings(
+        text=args.text,
+        font_name=font_name,
+        font_path=font_path,
+        logo_path=args.logo,
+        alpha=args.alpha / 100,
+        h_count=args.h_count,
+        v_count=args.v_count,
+        text_pos=args.text_pos,
+        logo_pos=args.logo_pos,
+        angle=args.angle,
+        text_size_pct=args.text_size,
+        logo_size_pct=args.logo_size,
+        logo_dpi=args.logo_dpi,
+        text_color=args.color,
+        stamp_mode=args.stamp_mode,
+        tile=args.tile,
+        pages=args.pages,
+        incremental=args.incremental,
+        streaming=args.streaming or args.memory_limit > 0,
+        memory_limit_mb=args.memory_limit,
+        flatten=args.flatten,
+        flatten_dpi=args.flatten_dpi,
+        flatten_format=args.flatten_format,
+        flatten_quality=args.flatten_quality,
+    )
@@ -0,0 +1,1368 @@
+import os
+import sys
+import re
+import gc
+import math
+import hashlib
+import shutil
+import time
+import argparse
+from io import BytesIO
+from collections import OrderedDict, deque, namedtuple
+from contextlib import nullcontext
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.filters import FlateDecode
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, FloatObject,
+    IndirectObject, NameObject, NumberObject, RectangleObject, StreamObject
+)
+
+# 启动时只加载 PyPDF2 和标准库里的轻量模块：reportlab 绘图、PIL、进程池、cProfile/tracemalloc
+# 都在第一次用到时才导入（见各函数开头），短任务和 --help 不必为用不到的依赖付出导入时间
+from watermark_config import (
+    A4, DEFAULT_OUTPUT_DIR, QUARANTINE_NAME, QUARANTINE_DIR, WatermarkSettings, PdfTree, PageSelection,
+    add_settings_arguments, settings_from_args,
+)
+from watermark_fonts import register_font, text_width
+from watermark_manifest import Manifest, settings_fingerprint
+from watermark_jobs import BatchJob, BatchCancelled, pending_job
+from watermark_progress import BatchProgress, format_progress
+from watermark_profile import StageProfile, BatchProfile, format_profile
+from watermark_preflight import (
+    PreflightLimits, scan, repair, unlock, encrypt_writer, quarantine, read_passwords, set_passwords, unlock_options,
+    current_passwords,
+)
+
+# 水印模板缓存上限：每种页面尺寸/旋转组合一份，超出后淘汰最久未用的
+WATERMARK_CACHE_SIZE = 32
+# 预读：I/O 线程数（0 为不预读）；不超过这个大小的文件读入内存直接交给盖章，更大的只预热系统缓存
+DEFAULT_IO_THREADS = 4
+PREFETCH_MAX_BYTES = 16 << 20
+# 流式输出的内存上限：每隔这么多页检查一次常驻内存；清空缓存后内存要再涨过上限的这个比例才会再清一次
+# （释放的内存多半留在进程里，常驻内存不会降回上限以下，不加间隔就会每页都清一遍、每页都整体 GC）
+MEMORY_CHECK_PAGES = 16
+MEMORY_LIMIT_STEP = 0.25
+# 进程池派发顺序：每个进程最多攒这么多个预读好的文件，从中先派发预检估算页数最多的（没有预检时按字节数）
+SCHEDULE_WINDOW_PER_WORKER = 2
+
+# 水印模板 LRU（每个进程各一份）：(设置, 页面几何) -> WatermarkTemplate
+_watermark_cache = OrderedDict()
+# 预处理后的 Logo：(路径, 修改时间, 大小百分比, DPI) -> (图像源, 放置宽 pt, 放置高 pt)
+_logo_cache = {}
+# 各水印模板共用的 Logo 图片：reportlab 资源名（按图像内容摘要生成）-> 首次解析出的间接引用
+_shared_images = {}
+# 各水印模板共用的字体：按内容摘要 -> 首次解析出的间接引用（相同文字在各几何模板里生成的子集相同）
+_shared_fonts = {}
+# 进程池子进程里的取消标志（由 init_worker 设置）
+_worker_cancel = None
+_worker_events = None
+_worker_profile = False
+
+
+# 批处理结果：failures 为失败的 (文件名, 错误)，skipped 为清单判定无需重做的文件数，
+# cancelled 表示被取消、仍有文件待处理（可继续）；profile 为开启分阶段统计时的整批汇总
+# quarantined 为预检判定无法处理、没有交给盖章的文件数（也计入 failures）；
+# warnings 为处理了但需要提醒的 (文件名, 说明)，如 --allow-weaker-encryption 放行的弱化重新加密
+BatchResult = namedtuple('BatchResult', ['failures', 'skipped', 'cancelled', 'profile', 'quarantined', 'warnings'],
+                         defaults=(None, 0, ()))
+
+# I/O 线程预读的一个文件：digest 为 sha256，data 为文件内容（太大、流式模式或无需重做时为 None，盖章时再读盘；
+# 需要修复的文件为修复后的内容），current 表示清单判定无需重做；读取失败时 error 为 OSError；
+# preflight 为预检结果（未预检或无需重做时为 None）
+Prefetched = namedtuple('Prefetched', ['inp', 'out', 'size', 'digest', 'data', 'current', 'error', 'preflight'],
+                        defaults=(None,))
+
+# page: 解析好的水印页（merge 方式直接合并）；form_data: 压缩后的内容流（xobject 方式复用）
+WatermarkTemplate = namedtuple('WatermarkTemplate', ['page', 'form_data'])
+
+
+def prepare_logo(settings):
+    # Logo 预处理：每批次每个进程只做一次，之后各水印模板复用同一个图像源
+    # PIL 只有设置了 Logo 才需要，在这里才导入
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    path = settings.logo_path
+    key = (path, os.path.getmtime(path), settings.logo_size_pct, settings.logo_dpi)
+    if key in _logo_cache:
+        return _logo_cache[key]
+    img = Image.open(path)
+    scale_factor = 0.2 * (settings.logo_size_pct / 100.0)
+    img_width, img_height = img.width * scale_factor, img.height * scale_factor
+
+    source = path
+    # Alpha 通道在这里统一处理：完全不透明的直接丢掉，省去每份输出里的 SMask
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    if has_alpha:
+        img = img.convert('RGBA')
+        if img.getchannel('A').getextrema() == (255, 255):
+            img = img.convert('RGB')
+        source = None
+    # 按放置尺寸和目标 DPI 计算实际需要的像素，原图更大时先缩小，避免把整张大图嵌入每个文件
+    target = (max(1, round(img_width / 72 * settings.logo_dpi)),
+              max(1, round(img_height / 72 * settings.logo_dpi)))
+    if target[0] < img.width:
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA') else 'RGB')
+        img = img.resize(target, Image.LANCZOS)
+        source = None
+    # 未缩放、无透明的原图（如 JPEG）直接按文件嵌入，保留原有压缩
+    if source is None:
+        source = ImageReader(img)
+
+    _logo_cache[key] = (source, img_width, img_height)
+    return _logo_cache[key]
+
+
+def create_watermark_page(settings, geometry=(0, 0) + A4 + (0,)):
+    # geometry: 目标页面可见区域 (left, bottom, width, height) 及 /Rotate
+    from reportlab.pdfgen import canvas
+    left, bottom, w, h, _ = geometry
+    packet = BytesIO()
+    can = canvas.Canvas(packet, pagesize=(left + w, bottom + h))
+    draw_watermark(can, settings, geometry)
+    can.showPage()
+    can.save()
+    packet.seek(0)
+    return packet
+
+
+def _reading_transform(geometry):
+    # 页面可见区域 -> 阅读方向坐标系：先对齐到可见区域左下角，再按 /Rotate 转正
+    # 返回变换矩阵 (a, b, c, d, e, f) 及阅读方向的宽、高
+    left, bottom, w, h, rotate = geometry
+    if rotate == 90:
+        return (0, 1, -1, 0, left + w, bottom), h, w
+    if rotate == 180:
+        return (-1, 0, 0, -1, left + w, bottom + h), w, h
+    if rotate == 270:
+        return (0, -1, 1, 0, left, bottom + h), h, w
+    return (1, 0, 0, 1, left, bottom), w, h
+
+
+def _concat(m1, m2):
+    # 先 m1 后 m2 的复合变换（PDF 行向量约定，即 m1 × m2）
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+
+def tile_steps(settings, geometry):
+    # 平铺图案的单元间距 (横向, 纵向)，按阅读方向；不平铺或没有文字时为 None
+    if not (settings.tile and settings.text):
+        return None
+    _, w, h = _reading_transform(geometry)
+    return w / settings.h_count, h / settings.v_count
+
+
+def draw_watermark(can, settings, geometry):
+    # 在 canvas 当前页上画文字网格和 Logo；settings.text 为空时只画 Logo，logo_path 为空时只画文字
+    # 平铺模式下文字只画一个单元（Form XObject），由 make_template 转成平铺图案
+    from reportlab.lib.colors import Color
+    matrix, w, h = _reading_transform(geometry)
+    can.saveState()
+
+    offsets = {
+        '左上': (-w / 4, h / 4),
+        '右上': (w / 4, h / 4),
+        '左下': (-w / 4, -h / 4),
+        '右下': (w / 4, -h / 4),
+        '中心': (0, 0)
+    }
+
+    if settings.text:
+        # --- 文字：动态字号 & 颜色 ---
+        base_pt = 40
+        pt_size = base_pt * (settings.text_size_pct / 100.0)
+        r, g, b = settings.text_color
+        # 文字宽度（pt 单位）
+        width = text_width(settings.text, settings.font_name, pt_size)
+        text_height = pt_size  # 近似行高就是字号
+        h_count, v_count = settings.h_count, settings.v_count
+
+    if settings.text and settings.tile:
+        from reportlab.pdfbase.pdfdoc import PDFArray
+        # 图案单元正好一个间距大小、以文字中心为原点；文字比间距大时，相邻单元伸进来的部分也画在本单元里，
+        # 单元之间互不重叠，各阅读器都能直接平铺（重叠的单元有的阅读器会裁掉）
+        xstep, ystep = w / h_count, h / v_count
+        angle = math.radians(-settings.angle)
+        cos, sin = math.cos(angle), math.sin(angle)
+        half_w, half_h = width / 2 + pt_size * 0.1, text_height  # 上下留出升部/降部
+        reach_x = abs(half_w * cos) + abs(half_h * sin)
+        reach_y = abs(half_w * sin) + abs(half_h * cos)
+        nx = math.ceil((reach_x - xstep / 2) / xstep) if reach_x > xstep / 2 else 0
+        ny = math.ceil((reach_y - ystep / 2) / ystep) if reach_y > ystep / 2 else 0
+        # 第一个单元的中心：按阅读方向平分页面，文字位置整体平移图案
+        cx = xstep / 2 + offsets[settings.text_pos][0]
+        cy = ystep / 2 + offsets[settings.text_pos][1]
+        name = f"WmTile{can.getPageNumber()}"
+        # 单元内文字不透明，透明度在页面上对整个图案填充只施加一次：
+        # 单元边缘抗锯齿的像素不会因两侧各叠一次半透明而出现接缝，文字相互重叠处也不会加深
+        can.setFillAlpha(settings.alpha)
+        can.beginForm(name, -xstep / 2, -ystep / 2, xstep / 2, ystep / 2)
+        can.setFont(settings.font_name, pt_size)
+        can.setFillColorRGB(r, g, b)
+        for i in range(-nx, nx + 1):
+            for j in range(-ny, ny + 1):
+                can.saveState()
+                can.translate(i * xstep, j * ystep)
+                can.rotate(-settings.angle)
+                can.drawString(-width / 2, -text_height / 2, settings.text)
+                can.restoreState()
+        # Matrix 把单元放到页面上第一个单元的位置（含 /Rotate 转正），转成图案后同样作为图案矩阵
+        can.endForm(Matrix=PDFArray(list(_concat((1, 0, 0, 1, cx, cy), matrix))))
+        can.doForm(name)
+
+    can.transform(*matrix)
+
+    if settings.text and not settings.tile:
+        can.setFont(settings.font_name, pt_size)
+        can.setFillColor(Color(r, g, b, settings.alpha))
+        for i in range(1, h_count + 1):
+            for j in range(1, v_count + 1):
+                cx = i * w / (h_count + 1) + offsets[settings.text_pos][0]
+                cy = j * h / (v_count + 1) + offsets[settings.text_pos][1]
+                can.saveState()
+                can.translate(cx, cy)
+                can.rotate(-settings.angle)
+                # 居中绘制：左移一半宽度，上移半行高
+                can.drawString(-width / 2, -text_height / 2, settings.text)
+                can.restoreState()
+
+    if settings.logo_path and os.path.exists(settings.logo_path):
+        logo, img_width, img_height = prepare_logo(settings)
+
+        coords = {
+            '左上': (0, h - img_height),
+            '右上': (w - img_width, h - img_height),
+            '左下': (0, 0),
+            '右下': (w - img_width, 0),
+            '中心': ((w - img_width) / 2, (h - img_height) / 2),
+        }
+        x, y = coords[settings.logo_pos]
+
+        can.drawImage(logo, x, y, width=img_width, height=img_height, preserveAspectRatio=True, mask='auto')
+    can.restoreState()
+
+
+def page_geometry(page):
+    # 以可见区域（CropBox，缺省即 MediaBox）和旋转角作为水印模板的几何键
+    box = page.cropbox
+    return (round(float(box.left), 2), round(float(box.bottom), 2),
+            round(float(box.width), 2), round(float(box.height), 2),
+            (page.get('/Rotate', 0) or 0) % 360)
+
+
+def page_selection(settings):
+    # settings.pages 对应的 PageSelection；为空（全部页面）时返回 None
+    return PageSelection(settings.pages) if settings.pages else None
+
+
+def page_selected(selection, page_no, page_count, page):
+    # 只有用到尺寸条件时才读页面的 CropBox / 旋转；不盖章的页面不解码内容、不生成水印
+    if selection is None:
+        return True
+    size = None
+    if selection.uses_size:
+        _, _, w, h, rotate = page_geometry(page)
+        size = (h, w) if rotate in (90, 270) else (w, h)
+    return selection.wants(page_no, page_count, size)
+
+
+def get_watermark_template(settings, geometry):
+    # 同一批次内设置相同：每种页面几何只在首次出现时渲染、解析一次，之后共用
+    key = (settings, geometry)
+    if key in _watermark_cache:
+        _watermark_cache.move_to_end(key)
+        return _watermark_cache[key]
+    watermark = create_watermark_page(settings, geometry)
+    template = make_template(PdfReader(watermark).pages[0], geometry, tile=tile_steps(settings, geometry))
+    _watermark_cache[key] = template
+    if len(_watermark_cache) > WATERMARK_CACHE_SIZE:
+        _watermark_cache.popitem(last=False)
+    return template
+
+
+def make_template(watermark_page, geometry, share=True, tile=None):
+    # 把解析出的水印页整理成可盖章的模板
+    # share: 把 Logo / 字体指向各模板共用的对象；一次性的模板（如个性化文字层）传 False，免得占住缓存
+    # tile: 平铺模式的单元间距（tile_steps 的结果），把文字单元转成平铺图案
+    # 合并时按水印页的 TrimBox 裁剪，这里让它与目标页可见区域完全重合
+    left, bottom, w, h, _ = geometry
+    watermark_page.mediabox = RectangleObject((left, bottom, left + w, bottom + h))
+    resources = watermark_page['/Resources'].get_object()
+    if tile is not None:
+        _tile_pattern(watermark_page, resources, tile)
+    if share and '/XObject' in resources:
+        # 不同几何的模板里同一 Logo 资源名相同，统一指向首次解析的对象，输出文件里只嵌入一份
+        xobjects = resources['/XObject'].get_object()
+        for name in list(xobjects):
+            xobjects[name] = _shared_images.setdefault(name, xobjects.raw_get(name))
+    if share and '/Font' in resources:
+        # 字体同理：内容相同的子集统一指向首次解析的对象，输出文件里每个子集只嵌入一份
+        fonts = resources['/Font'].get_object()
+        for name in list(fonts):
+            digest = _object_digest(fonts[name])
+            fonts[name] = _shared_fonts.setdefault(digest, fonts.raw_get(name))
+    contents = watermark_page['/Contents'].get_object()
+    if isinstance(contents, ArrayObject):
+        data = b'\n'.join(c.get_object().get_data() for c in contents)
+    else:
+        data = contents.get_data()
+    return WatermarkTemplate(watermark_page, FlateDecode.encode(data))
+
+
+def _tile_pattern(watermark_page, resources, steps):
+    # draw_watermark 把文字单元画成 Form XObject 并 Do 一次；这里把它原地改成平铺图案（PatternType 1），
+    # 那条 Do 换成铺满可见区域的图案填充：文字在输出里只有一份，网格再密也不增加字节数，阅读器只光栅化一个单元
+    xobjects = resources['/XObject'].get_object()
+    name = next(n for n in xobjects if n.startswith('/FormXob.WmTile'))
+    ref = xobjects.raw_get(name)
+    del xobjects[name]
+    cell = ref.get_object()
+    del cell['/Subtype'], cell['/FormType']
+    cell.update({
+        NameObject('/Type'): NameObject('/Pattern'),
+        NameObject('/PatternType'): NumberObject(1),
+        NameObject('/PaintType'): NumberObject(1),    # 单元自带颜色
+        NameObject('/TilingType'): NumberObject(1),   # 间距恒定
+        NameObject('/XStep'): FloatObject(f"{steps[0]:.4f}"),
+        NameObject('/YStep'): FloatObject(f"{steps[1]:.4f}"),
+    })
+    resources[NameObject('/Pattern')] = DictionaryObject({NameObject('/WmTile'): ref})
+    # 图案矩阵相对页面默认坐标系，draw_watermark 在变换之前 Do，填充矩形直接用可见区域
+    box = watermark_page.mediabox
+    fill = f"/Pattern cs /WmTile scn {float(box.left)} {float(box.bottom)} {float(box.width)} {float(box.height)} re f"
+    contents = watermark_page['/Contents'].get_object()
+    data = contents.get_data().replace(f"{name} Do".encode(), fill.encode())
+    contents._data = FlateDecode.encode(data)
+    contents[NameObject('/Filter')] = NameObject('/FlateDecode')
+    contents.pop('/DecodeParms', None)
+    contents.decoded_self = None
+
+
+def _object_digest(obj, digest=None):
+    # 按内容（展开间接引用）计算摘要
+    top = digest is None
+    if top:
+        digest = hashlib.sha1()
+    obj = obj.get_object()
+    if isinstance(obj, StreamObject):
+        digest.update(b'stream')
+        digest.update(obj._data)
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            digest.update(key.encode())
+            _object_digest(obj.raw_get(key), digest)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b'[')
+        for item in obj:
+            _object_digest(item, digest)
+        digest.update(b']')
+    else:
+        digest.update(repr(obj).encode())
+    return digest.hexdigest() if top else None
+
+
+def clear_cache():
+    # 新批次开始时调用（两次批处理之间 Logo 文件可能已被修改）
+    _watermark_cache.clear()
+    _logo_cache.clear()
+    _shared_images.clear()
+    _shared_fonts.clear()
+
+
+def _embed_form(add_object, template, resources):
+    # 把水印模板作为 Form XObject 写入当前输出文件（每种几何每个文件一次）
+    form = EncodedStreamObject()
+    form._data = template.form_data
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/FormType'): NumberObject(1),
+        NameObject('/BBox'): ArrayObject(template.page.mediabox),
+        NameObject('/Resources'): resources,
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+    })
+    return add_object(form)
+
+
+def _content_stream(add_object, data):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return add_object(stream)
+
+
+def _stamp_form(page, template, forms, add_object, import_object, key=None):
+    # 每页只改资源字典和内容数组：原内容包进 q/Q，末尾追加共享的 "/名称 Do" 调用流
+    # forms: 本文件已嵌入的 {几何键: (XObject 引用, 名称, Do 调用流引用)}，另有 'q' 开头流
+    # add_object 把新对象写入目标文件；import_object 把水印模板里的对象连同引用复制过去
+    # key: 同一几何有多个模板时（如个性化文字层）用来区分，缺省为页面几何
+    if key is None:
+        key = page_geometry(page)
+    if key not in forms:
+        name = f"/WmOverlay{len(forms)}"
+        resources = import_object(template.page['/Resources'])
+        forms[key] = (_embed_form(add_object, template, resources), name,
+                      _content_stream(add_object, f"Q\nq {name} Do Q\n".encode()))
+    form_ref, name, do_ref = forms[key]
+    if 'q' not in forms:
+        forms['q'] = _content_stream(add_object, b"q\n")
+
+    if '/Resources' in page:
+        resources = page['/Resources'].get_object()
+    else:
+        resources = DictionaryObject()
+        page[NameObject('/Resources')] = resources
+    if '/XObject' in resources:
+        xobjects = resources['/XObject'].get_object()
+    else:
+        xobjects = DictionaryObject()
+        resources[NameObject('/XObject')] = xobjects
+    # 名称已被页面自身占用（例如再次加水印的文件）时，换一个名称并单独生成调用流
+    if xobjects.get(name) not in (None, form_ref):
+        idx = 0
+        while f"{name}_{idx}" in xobjects:
+            idx += 1
+        name = f"{name}_{idx}"
+        do_ref = _content_stream(add_object, f"Q\nq {name} Do Q\n".encode())
+    xobjects[NameObject(name)] = form_ref
+
+    contents = page.get('/Contents')
+    if contents is None:
+        parts = []
+    elif isinstance(contents.get_object(), ArrayObject):
+        parts = list(contents.get_object())
+    elif isinstance(contents, IndirectObject):
+        parts = [contents]
+    else:
+        parts = [add_object(contents)]
+    page[NameObject('/Contents')] = ArrayObject([forms['q'], *parts, do_ref])
+
+
+class IncrementalUpdate:
+    # 增量更新：原文件字节原样保留，末尾只追加改动过的页面/资源字典、水印 XObject 和新的 xref，
+    # 输出耗时随页数而不是文件大小增长（扫描件里的大图不再被读取和重新序列化）
+    def __init__(self, reader):
+        self.reader = reader
+        # 交叉引用流（PDF 1.5+）的 trailer 里 PyPDF2 不保留 /Size，按已知对象号推算
+        nums = [num for table in reader.xref.values() for num in table]
+        nums += list(reader.xref_objStm)
+        self.next_num = max([int(reader.trailer.get('/Size', 0))] + [num + 1 for num in nums])
+        self.new_objects = {}  # 新对象号 -> 对象
+        self.modified = {}     # 原对象号 -> (代号, 对象)
+        self.imported = {}     # (来源 PDF, 来源对象号) -> 新对象号
+
+    def add_object(self, obj):
+        num = self.next_num
+        self.next_num += 1
+        self.new_objects[num] = obj
+        return IndirectObject(num, 0, self)
+
+    def mark_modified(self, ref):
+        if isinstance(ref, IndirectObject):
+            self.modified[ref.idnum] = (ref.generation, ref.get_object())
+
+    def import_object(self, obj):
+        # 水印模板来自另一个 PdfReader：连同引用链复制过来并重新编号
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum)
+            if key not in self.imported:
+                num = self.next_num
+                self.next_num += 1
+                self.imported[key] = num
+                self.new_objects[num] = self.import_object(obj.get_object())
+            return IndirectObject(self.imported[key], 0, self)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+        elif isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self.import_object(v) for v in obj)
+        else:
+            return obj
+        for k, v in obj.items():
+            copy[k] = self.import_object(v)
+        return copy
+
+    def get_object(self, ref):
+        # 供 IndirectObject.get_object() 回查本次新增的对象
+        return self.new_objects[ref.idnum]
+
+    def write(self, src_path, out_path, data=None):
+        # data: 已预读的原文件内容，给定时不再从磁盘读
+        if data is not None:
+            tail = data[-1024:]
+        else:
+            with open(src_path, 'rb') as f:
+                f.seek(max(0, os.path.getsize(src_path) - 1024))
+                tail = f.read()
+        found = re.findall(rb'startxref\s+(\d+)', tail)
+        if not found:
+            raise ValueError("找不到 startxref，无法增量更新")
+        prev = int(found[-1])
+
+        if data is not None:
+            with open(out_path, 'wb') as f:
+                f.write(data)
+        else:
+            shutil.copyfile(src_path, out_path)
+        with open(out_path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(b"\n")
+            offsets = {}
+            entries = [(num, 0, obj) for num, obj in self.new_objects.items()]
+            entries += [(num, gen, obj) for num, (gen, obj) in self.modified.items()]
+            for num, gen, obj in sorted(entries, key=lambda e: e[0]):
+                offsets[num] = (f.tell(), gen)
+                f.write(f"{num} {gen} obj\n".encode())
+                obj.write_to_stream(f, None)
+                f.write(b"\nendobj\n")
+
+            xref_pos = f.tell()
+            # 首段写空闲链表头（0 号对象），部分阅读器要求 xref 从 0 开始
+            f.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+            nums = sorted(offsets)
+            # 按连续对象号分段写 xref 子表
+            start = 0
+            while start < len(nums):
+                end = start
+                while end + 1 < len(nums) and nums[end + 1] == nums[end] + 1:
+                    end += 1
+                f.write(f"{nums[start]} {end - start + 1}\n".encode())
+                for num in nums[start:end + 1]:
+                    pos, gen = offsets[num]
+                    f.write(f"{pos:010d} {gen:05d} n\r\n".encode())
+                start = end + 1
+
+            trailer = DictionaryObject()
+            for key in ('/Root', '/Info', '/ID'):
+                if key in self.reader.trailer:
+                    trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+            trailer[NameObject('/Size')] = NumberObject(self.next_num)
+            trailer[NameObject('/Prev')] = NumberObject(prev)
+            f.write(b"trailer\n")
+            trailer.write_to_stream(f, None)
+            f.write(f"\nstartxref\n{xref_pos}\n%%EOF\n".encode())
+
+
+class StreamingWriter:
+    # 流式写出：每页盖章后立即把页面及其引用的对象序列化到输出文件，写完即可释放；
+    # 常驻内存只有 来源对象号 -> 新对象号 的映射和各对象偏移量，不随页面内容增长
+    # 与 PdfWriter 路径一样只输出页面（不复制书签、表单等文档级对象）
+    def __init__(self, stream, source=None):
+        self.stream = stream
+        self.source = source   # 原 PDF 的 PdfReader：写出的对象从它的解析缓存里移除
+        self.offsets = [None]  # 新对象号 -> 文件偏移（0 号为空闲链表头）
+        self.imported = {}     # (来源 PDF, 来源对象号, 代号) -> 新对象号
+        self.pending = []      # 已分配对象号、等当前页写完后再写出的来源对象
+        self.kids = []         # 各页的新对象号
+        stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.pages_ref = self._reserve()
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return IndirectObject(len(self.offsets) - 1, 0, self)
+
+    def _write(self, ref, obj):
+        self.offsets[ref.idnum] = self.stream.tell()
+        self.stream.write(f"{ref.idnum} 0 obj\n".encode())
+        obj.write_to_stream(self.stream, None)
+        self.stream.write(b"\nendobj\n")
+
+    def map_pages(self, pages):
+        # 先给所有页面分配对象号：注释的 /P 等指向其他页面的引用直接落到对应页，不会把整棵页面树拖进来
+        for page in pages:
+            ref = page.indirect_reference
+            num = self._reserve().idnum
+            self.imported[(id(ref.pdf), ref.idnum, ref.generation)] = num
+            self.kids.append(num)
+
+    def add_object(self, obj):
+        ref = self._reserve()
+        self._write(ref, self._copy(obj))
+        return ref
+
+    def import_object(self, obj):
+        # 来源对象（原 PDF 或水印模板）换成本文件的对象号；间接对象只分配号码并排队，由 flush() 写出
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is self:
+                return obj
+            key = (id(obj.pdf), obj.idnum, obj.generation)
+            if key not in self.imported:
+                ref = self._reserve()
+                self.imported[key] = ref.idnum
+                self.pending.append((ref, obj))
+            return IndirectObject(self.imported[key], 0, self)
+        if isinstance(obj, StreamObject):
+            # 流只能是间接对象（merge_page 生成的内容流是直接对象）
+            return self.add_object(obj)
+        return self._copy(obj)
+
+    def _copy(self, obj):
+        if isinstance(obj, EncodedStreamObject):
+            copy = EncodedStreamObject()
+            copy._data = obj._data
+            skip = ('/Length',)
+        elif isinstance(obj, StreamObject):
+            # 已解码的流（含 merge_page 的 ContentStream）按明文写出，去掉原来的过滤器声明
+            copy = DecodedStreamObject()
+            copy.set_data(obj.get_data())
+            skip = ('/Length', '/Filter', '/DecodeParms')
+        elif isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            skip = ()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self.import_object(v) for v in obj)
+        else:
+            return obj
+        for k, v in obj.items():
+            if k not in skip:
+                copy[k] = self.import_object(v)
+        return copy
+
+    def write_page(self, page):
+        ref = page.indirect_reference
+        num = self.imported[(id(ref.pdf), ref.idnum, ref.generation)]
+        copy = DictionaryObject()
+        for k, v in page.items():
+            if k != '/Parent':
+                copy[k] = self.import_object(v)
+        copy[NameObject('/Parent')] = self.pages_ref
+        self._write(IndirectObject(num, 0, self), copy)
+        self.flush()
+
+    def add_page(self, page, replaces=None):
+        # 新建的页面字典（不来自原 PDF，如栅格化生成的整页图片），引用的对象已用 add_object 写出
+        # replaces: map_pages 登记过的原页面，新页面顶替它的位置（其余页面照常用 write_page 写出）
+        if replaces is None:
+            ref = self._reserve()
+            self.kids.append(ref.idnum)
+        else:
+            src = replaces.indirect_reference
+            ref = IndirectObject(self.imported[(id(src.pdf), src.idnum, src.generation)], 0, self)
+        page[NameObject('/Parent')] = self.pages_ref
+        self._write(ref, page)
+
+    def release_page(self, index, page, contents=None):
+        # 页面写出后释放：merge 方式合并出的内容流挂在 flattened_pages 里的页面对象上，
+        # 被替换掉的原内容流不会经 flush() 写出，一直留在解析缓存里；不释放的话两者都随页数累积
+        # contents: 盖章前页面的 /Contents（未解析的引用）
+        self.source.flattened_pages[index] = None
+        page.pop(NameObject('/Contents'), None)
+        refs = contents if isinstance(contents, ArrayObject) else [contents]
+        for ref in refs:
+            if isinstance(ref, IndirectObject) and ref.pdf is self.source:
+                self.source.resolved_objects.pop((ref.generation, ref.idnum), None)
+        ref = page.indirect_reference
+        self.source.resolved_objects.pop((ref.generation, ref.idnum), None)
+
+    def flush(self):
+        # 写出排队的来源对象；写出时又引用到的新对象继续排队，直到清空
+        while self.pending:
+            ref, src = self.pending.pop()
+            self._write(ref, self._copy(src.get_object()))
+            # 每个对象只写一次，之后只用到对象号映射，不必留在缓存里（水印模板的对象各文件共用，保留）
+            if src.pdf is self.source:
+                self.source.resolved_objects.pop((src.generation, src.idnum), None)
+
+    def close(self):
+        self._write(self.pages_ref, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(num, 0, self) for num in self.kids),
+            NameObject('/Count'): NumberObject(len(self.kids)),
+        }))
+        root = self._reserve()
+        self._write(root, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): self.pages_ref,
+        }))
+        xref_pos = self.stream.tell()
+        self.stream.write(f"xref\n0 {len(self.offsets)}\n0000000000 65535 f\r\n".encode())
+        for pos in self.offsets[1:]:
+            self.stream.write(f"{pos:010d} 00000 n\r\n".encode())
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(len(self.offsets)),
+            NameObject('/Root'): root,
+        })
+        self.stream.write(b"trailer\n")
+        trailer.write_to_stream(self.stream, None)
+        self.stream.write(f"\nstartxref\n{xref_pos}\n%%EOF\n".encode())
+
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage',
+                'PagefileUsage', 'PeakPagefileUsage')
+        ]
+
+
+def memory_usage_mb():
+    # 返回本进程 (当前常驻内存, 峰值常驻内存)，单位 MB；取不到的项为 None
+    if sys.platform == 'win32':
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None, None
+        return counters.WorkingSetSize / (1 << 20), counters.PeakWorkingSetSize / (1 << 20)
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    peak = peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except OSError:
+        current = None
+    return current, peak
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise BatchCancelled()
+
+
+def _no_stage(name):
+    return nullcontext()
+
+
+def _add_watermark_incremental(inp_path, out_path, settings, cancel=None, on_page=None, stage=_no_stage,
+                               data=None):
+    # 增量模式只能用 Form XObject 盖章（merge_page 需要重写整页内容）
+    with stage('parse'):
+        reader = PdfReader(BytesIO(data) if data is not None else inp_path)
+        # 加密文件改为完整重写（解密后盖章、按原权限重新加密），追加的明文对象会破坏原有加密
+        if reader.is_encrypted:
+            return None
+        update = IncrementalUpdate(reader)
+        page_count = len(reader.pages)
+    forms = {}
+    selection = page_selection(settings)
+    for page_no, page in enumerate(reader.pages, 1):
+        _check_cancel(cancel)
+        # 不盖章的页面不追加任何内容，原样留在原文件部分
+        if not page_selected(selection, page_no, page_count, page):
+            if on_page is not None:
+                on_page(page_no, page_count)
+            continue
+        with stage('overlay'):
+            template = get_watermark_template(settings, page_geometry(page))
+        with stage('merge'):
+            _stamp_form(page, template, forms, update.add_object, update.import_object)
+            ref = page.indirect_reference
+            update.modified[ref.idnum] = (ref.generation, page)
+            # 共享的资源字典 / XObject 字典是独立对象时，改写后同样要追加
+            update.mark_modified(page.raw_get('/Resources'))
+            update.mark_modified(page['/Resources'].raw_get('/XObject'))
+        if on_page is not None:
+            on_page(page_no, page_count)
+    with stage('write'):
+        update.write(inp_path, out_path, data)
+    return page_count
+
+
+def _add_watermark_streaming(inp_path, out_path, settings, cancel=None, on_page=None, stage=_no_stage, data=None):
+    # 传文件对象而不是路径：PyPDF2 对路径会先把整个文件读进内存
+    # 先写到 .part 临时文件，完成后再改名，取消或出错时不留下半截输出
+    # data 只在预检修复过的文件时给定（修复后的内容只在内存里）
+    part_path = out_path + '.part'
+    try:
+        with (BytesIO(data) if data is not None else open(inp_path, 'rb')) as src:
+            with stage('parse'):
+                reader = PdfReader(src)
+                # 加密文件改为完整重写（解密后盖章、按原权限重新加密），流式写出不支持加密
+                if reader.is_encrypted:
+                    return None
+                page_count = len(reader.pages)
+            with open(part_path, 'wb') as dst:
+                writer = StreamingWriter(dst, reader)
+                writer.map_pages(reader.pages)
+                forms = {}
+                selection = page_selection(settings)
+                memory_limit = settings.memory_limit_mb
+                for page_no, page in enumerate(reader.pages, 1):
+                    _check_cancel(cancel)
+                    contents = page.raw_get('/Contents') if '/Contents' in page else None
+                    if page_selected(selection, page_no, page_count, page):
+                        with stage('overlay'):
+                            template = get_watermark_template(settings, page_geometry(page))
+                        with stage('merge'):
+                            if settings.stamp_mode == 'xobject':
+                                _stamp_form(page, template, forms, writer.add_object, writer.import_object)
+                            else:
+                                page.merge_page(template.page)
+                    with stage('write'):
+                        writer.write_page(page)
+                        writer.release_page(page_no - 1, page, contents)
+                    # 超过内存上限时丢掉其余已解析对象的缓存（共享资源等），之后的页面需要时再从文件读
+                    if memory_limit and page_no % MEMORY_CHECK_PAGES == 0:
+                        current = memory_usage_mb()[0]
+                        if current is not None and current > memory_limit:
+                            reader.resolved_objects.clear()
+                            gc.collect()
+                            current = memory_usage_mb()[0] or current
+                            memory_limit = max(memory_limit,
+                                               current + settings.memory_limit_mb * MEMORY_LIMIT_STEP)
+                    if on_page is not None:
+                        on_page(page_no, page_count)
+                with stage('write'):
+                    writer.close()
+        os.replace(part_path, out_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return page_count
+
+
+def add_watermark(inp_path, out_path, settings, cancel=None, on_page=None, profile=None, data=None,
+                  page_pool=None, reencrypt=True):
+    # cancel: 可选的 Event，逐页检查，置位后抛出 BatchCancelled 且不写输出
+    # on_page: 可选回调 on_page(已完成页数, 总页数)，每盖完一页调用一次；返回总页数
+    # profile: 可选的 StageProfile，累计 解析/水印/合并/写出 各阶段的耗时和内存
+    # data: 可选，已预读的文件内容（或预检修复后的内容），给定时不再从磁盘读
+    # page_pool: 可选的 watermark_flatten.PagePool，栅格化时各页分给它并行渲染
+    # 加密输入用 set_passwords 给定的密码解密，输出按原权限重新加密（reencrypt=False 时输出不加密，供栅格化的中间文件用）
+    stage = profile.stage if profile is not None else _no_stage
+    if settings.flatten:
+        from watermark_flatten import flatten_pdf
+        return flatten_pdf(inp_path, out_path, settings, page_pool, cancel, on_page, stage, data)
+    # 增量/流式模式遇到加密文件返回 None，改走下面的完整重写
+    page_count = None
+    if settings.incremental:
+        page_count = _add_watermark_incremental(inp_path, out_path, settings, cancel, on_page, stage, data)
+    elif settings.streaming:
+        page_count = _add_watermark_streaming(inp_path, out_path, settings, cancel, on_page, stage, data)
+    if page_count is not None:
+        return page_count
+
+    output = PdfWriter()
+    with stage('parse'):
+        reader = PdfReader(BytesIO(data) if data is not None else inp_path)
+        encryption = unlock(reader, current_passwords()) if reader.is_encrypted else None
+        page_count = len(reader.pages)
+    forms = {}
+    selection = page_selection(settings)
+
+    # 按页面尺寸/旋转取对应的水印，Letter、A3、横向页面同样居中不裁切
+    for page_no, page in enumerate(reader.pages, 1):
+        _check_cancel(cancel)
+        # 不盖章的页面原样复制：不合并、不解码内容流
+        if not page_selected(selection, page_no, page_count, page):
+            output.add_page(page)
+            if on_page is not None:
+                on_page(page_no, page_count)
+            continue
+        with stage('overlay'):
+            template = get_watermark_template(settings, page_geometry(page))
+        with stage('merge'):
+            if settings.stamp_mode == 'xobject':
+                _stamp_form(output.add_page(page), template, forms,
+                            output._add_object, lambda obj: obj.clone(output))
+            else:
+                page.merge_page(template.page)
+                output.add_page(page)
+        if on_page is not None:
+            on_page(page_no, page_count)
+
+    with stage('write'):
+        if encryption is not None and reencrypt:
+            encrypt_writer(output, encryption)
+        with open(out_path, "wb") as f:
+            output.write(f)
+    return page_count
+
+
+def init_worker(font_name, font_path, cancel=None, events=None, profile=False, decrypt=((), False)):
+    # 进程池的 initializer（批处理、监视、个性化、HTTP 服务共用）：子进程启动时注册一次字体；
+    # 每个新进程池都从空的水印缓存开始
+    global _worker_cancel, _worker_events, _worker_profile
+    register_font(font_name, font_path)
+    clear_cache()
+    # decrypt: 主进程 unlock_options() 的结果（密码，是否接受弱化的重新加密）
+    set_passwords(*decrypt)
+    _worker_cancel = cancel
+    _worker_events = events
+    _worker_profile = profile
+    if profile:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def _pool_add_watermark(inp_path, out_path, settings, data=None):
+    # 页级进度经队列发回主进程；同一文件至多每 0.1 秒发一次，最后一页一定发送
+    last = [0.0]
+
+    def on_page(page_no, page_count):
+        now = time.perf_counter()
+        if page_no == page_count or now - last[0] >= 0.1:
+            last[0] = now
+            _worker_events.put((inp_path, page_no, page_count))
+
+    profile = StageProfile() if _worker_profile else None
+    start = time.perf_counter()
+    pages = add_watermark(inp_path, out_path, settings, _worker_cancel,
+                          on_page if _worker_events is not None else None, profile, data)
+    stats = {'seconds': time.perf_counter() - start, 'pages': pages}
+    if profile is not None:
+        stats['stages'] = profile.as_dict()
+    return stats
+
+
+def output_path(inp_path, out_dir, subdir=''):
+    # subdir: 输入在所扫描文件夹里的相对子目录，输出目录里保持同样的结构
+    return os.path.join(out_dir, subdir, f"wm_{os.path.basename(inp_path)}")
+
+
+def run_batch(pdf_list, out_dir, settings, workers=1, on_progress=None, force=False, cancel=None,
+              on_stats=None, profile=False, io_threads=DEFAULT_IO_THREADS, preflight=PreflightLimits()):
+    # 批处理入口：GUI 线程与命令行共用
+    # pdf_list 为文件列表，或 PdfTree（边扫描边处理，子文件夹里的文件输出到同名子目录）
+    # cancel 为 multiprocessing.Event：置位后在文件之间/页面之间停下，进度保存在任务检查点里
+    # on_progress(已完成文件数) 按文件回调；on_stats(ProgressInfo) 按页回调（限频），含速度和剩余时间
+    # profile 为 True 时统计各阶段耗时和内存，写出 profile.json / profile.csv（有额外开销，默认关闭）
+    # io_threads: 预读后续文件的 I/O 线程数，磁盘/NAS 的读取延迟与盖章重叠；0 为不预读
+    # preflight: 预检上限 PreflightLimits，预读时顺便预检，加密无密码/损坏/超限的文件不交给盖章，放进输出目录的 quarantine/、
+    #            记入 quarantine.jsonl；多进程时按预检估算的页数先派发大文件；
+    #            None 为不预检（加密文件仍会用 set_passwords 给定的密码解密）
+    os.makedirs(out_dir, exist_ok=True)
+    if isinstance(pdf_list, PdfTree):
+        job = BatchJob.create(out_dir, [], settings, workers, force, source=pdf_list)
+    else:
+        job = BatchJob.create(out_dir, pdf_list, settings, workers, force)
+    return _run_job(job, settings, on_progress, cancel, on_stats, profile, io_threads, preflight)
+
+
+def resume_batch(out_dir, on_progress=None, cancel=None, workers=None, on_stats=None, profile=False,
+                 io_threads=DEFAULT_IO_THREADS, preflight=PreflightLimits()):
+    # 继续上次被取消/中断的批处理；没有未完成任务时抛出 FileNotFoundError
+    job = BatchJob.load(out_dir)
+    settings = WatermarkSettings(**dict(job.settings, text_color=tuple(job.settings['text_color'])))
+    if workers is not None:
+        job.workers = workers
+    return _run_job(job, settings, on_progress, cancel, on_stats, profile, io_threads, preflight)
+
+
+def _read_ahead(inp, out, manifest, fingerprint, force, keep_data, preflight=None):
+    # 在 I/O 线程里运行：清单记录的哈希仍有效且输出未变时不读文件；
+    # 否则整读一遍算 sha256，不太大的文件顺便留下内容交给盖章，不必从磁盘/NAS 再读一遍
+    # preflight 为 PreflightLimits 时顺便预检（None 为不预检）；需要修复的文件在这里修好，data 为修复后的内容
+    try:
+        st = os.stat(inp)
+        digest = manifest.cached_digest(inp, out, st)
+        current = digest is not None and not force and manifest.is_current(inp, out, digest, fingerprint)
+        data = None
+        if not current:
+            keep = keep_data and st.st_size <= PREFETCH_MAX_BYTES
+            h = hashlib.sha256()
+            chunks = []
+            with open(inp, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+                    if keep:
+                        chunks.append(chunk)
+            digest = h.hexdigest()
+            # 内容没变但 mtime 变了（如被 touch）时同样无需重做
+            current = not force and manifest.is_current(inp, out, digest, fingerprint)
+            if keep and not current:
+                data = b''.join(chunks)
+        result = None
+        if preflight is not None and not current:
+            result = scan(inp, current_passwords(), preflight, data)
+            if result.status == 'repair':
+                try:
+                    data = repair(inp, data, current_passwords())
+                except Exception as e:
+                    result = result._replace(status='damaged', usable=False, detail=f"修复失败: {e}")
+        return Prefetched(inp, out, st.st_size, digest, data, current, None, result)
+    except OSError as e:
+        return Prefetched(inp, out, None, None, None, False, e)
+
+
+def _read_pipeline(items, read, threads, depth):
+    # 按原顺序产出 read(*item)；I/O 线程池最多提前读 depth 个文件，threads 为 0 时在当前线程逐个读
+    if threads <= 0:
+        for item in items:
+            yield read(*item)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    ahead = deque()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='pdf-read') as io:
+        try:
+            for item in items:
+                ahead.append(io.submit(read, *item))
+                if len(ahead) > depth:
+                    yield ahead.popleft().result()
+            while ahead:
+                yield ahead.popleft().result()
+        finally:
+            # 提前结束（取消）时丢掉还没开始的读取
+            for future in ahead:
+                future.cancel()
+
+
+def _run_job(job, settings, on_progress, cancel, on_stats=None, profile=False, io_threads=DEFAULT_IO_THREADS,
+             preflight=PreflightLimits()):
+    # 输出目录里的清单记录每个输入的哈希和设置指纹，未变化且输出仍在的文件直接跳过（force 时全部重做）
+    # 文件按 扫描 -> I/O 线程预读并算哈希 -> 盖章 流水线处理：扫描到第一个文件就开始，读盘与盖章重叠
+    out_dir = job.out_dir
+    register_font(settings.font_name, settings.font_path)
+    clear_cache()
+    manifest = Manifest(out_dir)
+    fingerprint = settings_fingerprint(settings)
+    failures = []
+    warnings = []
+    cancelled = False
+    skipped = 0
+    quarantined = 0
+    source = job.source()
+    pending = job.pending()
+    log_file = os.path.join(out_dir, 'error_log.txt')
+    # 追加写日志：继续上次任务时不丢失之前的错误记录
+    with open(log_file, 'a', encoding='utf-8') as log:
+        scope = f"共 {len(job.pdf_list)} 个文件" if source is None else f"扫描 {', '.join(source[0])}"
+        log.write(f"=== {time.strftime('%Y-%m-%d %H:%M:%S')} "
+                  f"{'继续' if job.done or job.failed else '开始'}批处理，{scope} ===\n")
+        done = len(job.pdf_list) - len(pending)
+        if on_progress is not None and done:
+            on_progress(done)
+        # 文件列表已完整且只剩一个文件时不启动进程池（栅格化按页并行，单个文件也要用进程池）
+        workers = job.workers if source is not None or settings.flatten else min(job.workers, len(pending))
+        workers = max(workers, 1)
+        tracker = BatchProgress(out_dir, done, workers)
+        if on_stats is not None:
+            on_stats(tracker.snapshot())
+
+        def on_page(inp, page_no, page_count):
+            tracker.page(inp, page_no, page_count)
+            if on_stats is not None and tracker.due():
+                on_stats(tracker.snapshot())
+
+        def discovered():
+            # 先是任务里待处理的文件，再是扫描中新发现的（继续任务时重新扫描，跳过已在列表里的）
+            for inp in pending:
+                tracker.add(inp)
+                yield inp, output_path(inp, out_dir, job.subdir(inp))
+            if source is not None:
+                for inp, subdir in PdfTree(*source).walk(exclude=out_dir):
+                    if job.add(inp, subdir):
+                        tracker.add(inp)
+                        yield inp, output_path(inp, out_dir, subdir)
+                job.finish_discovery()
+            tracker.discovery_done()
+
+        def read(inp, out):
+            # 流式模式本来就逐页读文件，只预热系统缓存，不把内容读进内存
+            return _read_ahead(inp, out, manifest, fingerprint, job.force, not settings.streaming, preflight)
+
+        def todo():
+            # 在主线程按扫描顺序取预读结果：读取失败记为失败，预检不通过的隔离，无需重做的记为完成，其余交给盖章
+            nonlocal done, skipped, quarantined
+            for item in _read_pipeline(discovered(), read, io_threads, workers + 1):
+                if item.error is None and not item.current:
+                    try:
+                        os.makedirs(os.path.dirname(item.out), exist_ok=True)
+                    except OSError as e:
+                        item = item._replace(error=e)
+                tracker.sized(item.inp, item.size or 0)
+                if item.error is not None:
+                    log.write(f"{os.path.basename(item.inp)} failed: {item.error}\n")
+                    failures.append((os.path.basename(item.inp), item.error))
+                    job.mark_failed(item.inp, item.error)
+                    tracker.file_done(item.inp, 'failed', {}, item.error)
+                elif item.preflight is not None and not item.preflight.usable:
+                    problem = f"{item.preflight.status}: {item.preflight.detail}"
+                    quarantine(out_dir, item.inp, item.preflight, job.subdir(item.inp))
+                    log.write(f"{os.path.basename(item.inp)} quarantined: {problem}\n")
+                    failures.append((os.path.basename(item.inp), problem))
+                    job.mark_failed(item.inp, problem, quarantined=True)
+                    tracker.file_done(item.inp, 'failed', {}, problem)
+                    quarantined += 1
+                elif item.current:
+                    # 刷新记录（mtime 可能变了），下次不必再算哈希
+                    manifest.record(item.inp, item.out, item.digest, fingerprint)
+                    job.mark_done(item.inp)
+                    tracker.skip(item.inp)
+                    skipped += 1
+                else:
+                    if item.preflight is not None and item.preflight.warning:
+                        log.write(f"{os.path.basename(item.inp)} warning: {item.preflight.warning}\n")
+                        warnings.append((os.path.basename(item.inp), item.preflight.warning))
+                    yield item
+                    continue
+                done += 1
+                if on_progress is not None:
+                    on_progress(done)
+                if on_stats is not None and tracker.due():
+                    on_stats(tracker.snapshot())
+
+        profiler = BatchProfile(out_dir) if profile else None
+        # 串行时在本进程统计内存；进程池在各子进程里开启（栅格化的页级进程池只渲染，各阶段仍在本进程）
+        own_tracing = False
+        if profile and (workers == 1 or settings.flatten):
+            import tracemalloc
+            own_tracing = not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start()
+        items = todo()
+        page_pool = None
+        if settings.flatten and workers > 1:
+            # 栅格化以页为单位并行：文件逐个处理，每个文件的页面分给页级进程池渲染
+            from watermark_flatten import PagePool
+            page_pool = PagePool(workers)
+            results = _run_serial(items, settings, cancel, on_page, profile, page_pool)
+        elif workers > 1:
+            results = _run_pool(_largest_first(items, workers * SCHEDULE_WINDOW_PER_WORKER),
+                                settings, workers, cancel, on_page, profile)
+        else:
+            results = _run_serial(items, settings, cancel, on_page, profile)
+        try:
+            for item, e, stats in results:
+                inp, out = item.inp, item.out
+                # 子进程被 Ctrl+C 打断也按取消处理，文件留在待处理列表里
+                if isinstance(e, (BatchCancelled, KeyboardInterrupt)):
+                    cancelled = True
+                    continue
+                if e is not None:
+                    log.write(f"{os.path.basename(inp)} failed: {e}\n")
+                    failures.append((os.path.basename(inp), e))
+                    manifest.forget(out)
+                    job.mark_failed(inp, e)
+                    tracker.file_done(inp, 'failed', stats, e)
+                else:
+                    manifest.record(inp, out, item.digest, fingerprint)
+                    job.mark_done(inp)
+                    tracker.file_done(inp, 'done', stats)
+                    if profiler is not None:
+                        profiler.add(inp, stats)
+                done += 1
+                if on_progress is not None:
+                    on_progress(done)
+                if on_stats is not None:
+                    on_stats(tracker.snapshot())
+        finally:
+            # 先停下流水线（取消时还有预读中的文件），再保存清单和检查点
+            results.close()
+            items.close()
+            if page_pool is not None:
+                page_pool.close()
+            manifest.save()
+            job.close()
+            tracker.close(cancelled or bool(job.pending()) or not job.complete)
+            if own_tracing:
+                tracemalloc.stop()
+            if profiler is not None:
+                profiler.save()
+        cancelled = cancelled or bool(job.pending()) or not job.complete
+        if cancelled:
+            log.write(f"已取消，剩余 {len(job.pending())} 个文件待处理"
+                      f"{'' if job.complete else '（输入还没扫描完）'}\n")
+    return BatchResult(failures, skipped, cancelled, profiler.summary() if profiler is not None else None,
+                       quarantined, warnings)
+
+
+def _estimated_cost(item):
+    # 预检读出的页数优先（盖章耗时主要随页数增长），相同或没有预检时按文件大小
+    pages = item.preflight.pages if item.preflight is not None else None
+    return pages or 0, item.size or 0
+
+
+def _largest_first(items, window):
+    # 最多攒 window 个预读好的文件，每次先产出估算最大的：大文件尽早开始，不会排在最后单独拖长整批的耗时
+    # 扫描和预读仍是流式的，只在窗口内调整顺序；串行处理时总耗时与顺序无关，不经过这里
+    buffer = []
+    for item in items:
+        buffer.append(item)
+        if len(buffer) >= window:
+            yield buffer.pop(max(range(len(buffer)), key=lambda i: _estimated_cost(buffer[i])))
+    while buffer:
+        yield buffer.pop(max(range(len(buffer)), key=lambda i: _estimated_cost(buffer[i])))
+
+
+def _run_serial(items, settings, cancel=None, on_page=None, profile=False, page_pool=None):
+    # items 为预读好的 Prefetched；逐个产出 (Prefetched, 异常或 None, 单文件统计 {'seconds', 'pages'[, 'stages']})
+    items = iter(items)
+    while cancel is None or not cancel.is_set():
+        item = next(items, None)
+        if item is None:
+            return
+        stages = StageProfile() if profile else None
+        start = time.perf_counter()
+        try:
+            pages = add_watermark(item.inp, item.out, settings, cancel,
+                                  None if on_page is None else lambda n, total, inp=item.inp: on_page(inp, n, total),
+                                  stages, item.data, page_pool)
+        except Exception as e:
+            yield item, e, {'seconds': time.perf_counter() - start}
+        else:
+            stats = {'seconds': time.perf_counter() - start, 'pages': pages}
+            if stages is not None:
+                stats['stages'] = stages.as_dict()
+            yield item, None, stats
+
+
+def _drain_events(events, on_page):
+    from queue import Empty
+    while True:
+        try:
+            inp, page_no, page_count = events.get_nowait()
+        except Empty:
+            return
+        if on_page is not None:
+            on_page(inp, page_no, page_count)
+
+
+def _run_pool(items, settings, workers, cancel=None, on_page=None, profile=False):
+    # 多进程：PyPDF2 解析/写出受 GIL 限制，按文件分发到进程池才能用满多核
+    # 子进程的页级进度经 events 队列回传，等待结果时每 0.1 秒转发一次
+    # 同时交给进程池的文件不超过 2×进程数，其余还在扫描/预读，不会一次把整棵目录树排进队列
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    events = multiprocessing.Queue()
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(settings.font_name, settings.font_path, cancel, events, profile,
+                                       unlock_options())) as pool:
+        futures = {}
+
+        def fill():
+            while len(futures) < workers * 2 and (cancel is None or not cancel.is_set()):
+                item = next(items, None)
+                if item is None:
+                    return
+                futures[pool.submit(_pool_add_watermark, item.inp, item.out, settings, item.data)] = item
+
+        fill()
+        # 按完成顺序回传进度和单文件错误；取消后撤掉还没开始的文件
+        while futures:
+            finished, _ = wait(futures, timeout=0.1, return_when=FIRST_COMPLETED)
+            _drain_events(events, on_page)
+            if cancel is not None and cancel.is_set():
+                for f in futures:
+                    f.cancel()
+            for future in finished:
+                item = futures.pop(future)
+                if future.cancelled():
+                    continue
+                e = future.exception()
+                yield item, e, {} if e is not None else future.result()
+            fill()
+    events.close()
+
+
+def profile_file(inp_path, out_dir, settings):
+    # 用 cProfile 跑单个文件（不开 tracemalloc，以免干扰函数耗时），
+    # 结果存为 cprofile_<文件名>.prof，可用 pstats / snakeviz 查看；返回 (路径, Profile, StageProfile)
+    import cProfile
+    os.makedirs(out_dir, exist_ok=True)
+    register_font(settings.font_name, settings.font_path)
+    clear_cache()
+    stages = StageProfile()
+    profiler = cProfile.Profile()
+    profiler.runcall(add_watermark, inp_path, output_path(inp_path, out_dir), settings, profile=stages)
+    name = os.path.splitext(os.path.basename(inp_path))[0]
+    path = os.path.join(out_dir, f"cprofile_{name}.prof")
+    profiler.dump_stats(path)
+    return path, profiler, stages
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="批量为 PDF 添加文字/Logo 水印（无需图形界面）")
+    parser.add_argument('inputs', nargs='*', help="PDF 文件或包含 PDF 的文件夹（含子文件夹，输出保持同样的目录结构）")
+    parser.add_argument('--no-recursive', action='store_true', help="只处理文件夹第一层的 PDF，不进入子文件夹")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT_DIR, help="输出目录")
+    add_settings_arguments(parser)
+    parser.add_argument('--force', action='store_true',
+                        help="忽略输出目录里的清单，重新处理所有文件")
+    parser.add_argument('--resume', action='store_true',
+                        help="继续输出目录里上次被取消/中断的批处理（沿用当时的文件和设置）")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS,
+                        help="预读后续文件的 I/O 线程数，读盘与盖章重叠（0 为不预读，默认 %(default)s）")
+    parser.add_argument('--profile', action='store_true',
+                        help="统计 解析/水印/合并/写出 各阶段耗时和内存，写入输出目录的 profile.json / profile.csv")
+    parser.add_argument('--cprofile', metavar='PDF',
+                        help="用 cProfile 单独分析一个 PDF，结果存为输出目录里的 cprofile_<文件名>.prof")
+    parser.add_argument('--password', action='append', default=[],
+                        help="加密 PDF 的密码（可重复，逐个尝试）；输出按原权限重新加密。不保存，--resume 时需重新指定")
+    parser.add_argument('--password-file', help="密码文件，每行一个（免得密码出现在进程列表里）")
+    parser.add_argument('--allow-weaker-encryption', action='store_true',
+                        help="接受比原文件弱的重新加密：AES 输入改用 RC4-128、只有权限密码时用它作打开密码"
+                             "（默认隔离这些文件；放行时记入 error_log.txt）")
+    parser.add_argument('--no-preflight', action='store_true',
+                        help="不做预检（默认在预读时检查加密/损坏/超限，读不了的文件放进 quarantine/，不交给盖章）")
+    parser.add_argument('--max-size', type=int, default=0, metavar='MB', help="超过这个大小的文件隔离（0 为不限）")
+    parser.add_argument('--max-pages', type=int, default=0, help="超过这个页数的文件隔离（0 为不限）")
+    return parser
+
+
+def _print_stats(info):
+    # 原地刷新一行；\033[K 清掉上一行更长时残留的字符
+    print(f"\r{format_progress(info)}\033[K", end='', file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    set_passwords(read_passwords(args.password, args.password_file), args.allow_weaker_encryption)
+    preflight = None if args.no_preflight else PreflightLimits(args.max_size, args.max_pages)
+    try:
+        if args.resume:
+            progress = pending_job(args.output)
+            if progress is None:
+                print(f"{args.output} 中没有未完成的批处理", file=sys.stderr)
+                return 1
+            result = resume_batch(args.output, workers=args.workers, on_stats=_print_stats,
+                                  profile=args.profile, io_threads=args.io_threads, preflight=preflight)
+        else:
+            if not (args.inputs or args.cprofile) or not args.text:
+                parser.error("需要指定输入文件/文件夹和 --text（或使用 --resume）")
+            settings = settings_from_args(args)
+            if args.cprofile:
+                import pstats
+                path, profiler, stages = profile_file(args.cprofile, args.output, settings)
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+                print(format_profile(BatchProfile.summarize([{'stages': stages.as_dict()}])))
+                print(f"cProfile 结果: {path}")
+                return 0
+            # 边扫描边处理；这里只确认至少有一个文件
+            pdfs = PdfTree(args.inputs, recursive=not args.no_recursive)
+            if next(pdfs.walk(exclude=args.output), None) is None:
+                print("没有找到可处理的 PDF", file=sys.stderr)
+                return 1
+            result = run_batch(pdfs, args.output, settings, workers=args.workers, force=args.force,
+                               on_stats=_print_stats, profile=args.profile, io_threads=args.io_threads,
+                               preflight=preflight)
+    except KeyboardInterrupt:
+        print(f"\n已中断，可用 --resume -o {args.output} 继续", file=sys.stderr)
+        return 130
+    print(file=sys.stderr)
+    for fn, e in result.failures:
+        print(f"{fn} failed: {e}", file=sys.stderr)
+    for fn, warning in result.warnings:
+        print(f"{fn} warning: {warning}", file=sys.stderr)
+    if result.skipped:
+        print(f"跳过 {result.skipped} 个未变化的文件")
+    if result.quarantined:
+        print(f"隔离 {result.quarantined} 个无法处理的文件到 {os.path.join(args.output, QUARANTINE_DIR)}，"
+              f"原因见 {QUARANTINE_NAME}")
+    if result.profile is not None and result.profile['files']:
+        print(format_profile(result.profile))
+    if result.cancelled:
+        print(f"已取消，可用 --resume -o {args.output} 继续")
+        return 130
+    print(f"处理完成，输出目录: {args.output}")
+    return 1 if result.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
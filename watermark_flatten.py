@@ -0,0 +1,209 @@
+import os
+import zlib
+import dataclasses
+from collections import deque
+
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, FloatObject, NameObject, NumberObject
+)
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from watermark_engine import (
+    StreamingWriter, add_watermark, page_selection, page_selected, _check_cancel, _no_stage,
+)
+from watermark_preflight import read_encryption, encrypt_writer, current_passwords
+
+# 栅格化（--flatten）：先按原设置盖上矢量水印，写到临时文件，再把每页渲染成一张图片重新组成 PDF
+# 输出里没有可单独删除的文字/XObject，水印与页面内容是同一张图；渲染用 PyMuPDF（可选依赖，用到时才导入）
+
+# 页级进程池里每个进程同时在途的页数：已提交、正在渲染、已渲染但等前面页面先写出的都算在内
+FLATTEN_PAGES_PER_WORKER = 2
+# flate 编码的 zlib 压缩级别
+FLATE_LEVEL = 6
+
+
+def _load_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        raise RuntimeError("栅格化需要安装 PyMuPDF: pip install pymupdf") from None
+    return pymupdf
+
+
+def _render(page, dpi, fmt, quality):
+    # 渲染一页并编码，返回 (页宽 pt, 页高 pt, 像素宽, 像素高, 编码后的图像数据)
+    # page.rect 已按 /Rotate 转过来，输出页面不再带旋转
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    if fmt == 'jpeg':
+        data = pix.tobytes('jpeg', jpg_quality=quality)
+    else:
+        data = zlib.compress(pix.samples, FLATE_LEVEL)
+    return page.rect.width, page.rect.height, pix.width, pix.height, data
+
+
+def render_page(path, index, dpi, fmt, quality):
+    # 进程池任务：每个任务自己打开文件（只读 xref 和这一页），子进程不会一直占着临时文件
+    pymupdf = _load_pymupdf()
+    with pymupdf.open(path) as doc:
+        return _render(doc[index], dpi, fmt, quality)
+
+
+class PagePool:
+    # 栅格化用的页级进程池：一个长文档的各页分给多个进程渲染，单个千页扫描件也能用满多核
+    # 同时在途的页数不超过 inflight，内存占用只与进程数有关，与文档页数无关
+    def __init__(self, workers, inflight=None):
+        from concurrent.futures import ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.inflight = inflight or workers * FLATTEN_PAGES_PER_WORKER
+
+    def render(self, path, indices, settings, cancel=None):
+        # 按 indices（从 0 开始的页序号）的顺序产出各页的渲染结果；等待时每 0.1 秒检查一次取消
+        from concurrent.futures import wait
+        args = (settings.flatten_dpi, settings.flatten_format, settings.flatten_quality)
+        indices = iter(indices)
+        futures = deque()
+        try:
+            while True:
+                while len(futures) < self.inflight:
+                    index = next(indices, None)
+                    if index is None:
+                        break
+                    futures.append(self.executor.submit(render_page, path, index, *args))
+                if not futures:
+                    return
+                future = futures.popleft()
+                while not wait([future], timeout=0.1).done:
+                    _check_cancel(cancel)
+                yield future.result()
+        finally:
+            # 取消或出错时撤掉还没开始的页面，并等正在渲染的页面结束，之后临时文件才能删除
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def _render_serial(path, indices, settings, cancel=None):
+    pymupdf = _load_pymupdf()
+    with pymupdf.open(path) as doc:
+        for index in indices:
+            _check_cancel(cancel)
+            yield _render(doc[index], settings.flatten_dpi, settings.flatten_format, settings.flatten_quality)
+
+
+def _number(value):
+    return FloatObject(f"{value:.4f}")
+
+
+def _write_page(writer, replaces, fmt, width, height, px_width, px_height, data):
+    # 整页一张图：图像 XObject + 把它铺满页面的内容流
+    image = EncodedStreamObject()
+    image._data = data
+    image.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Image'),
+        NameObject('/Width'): NumberObject(px_width),
+        NameObject('/Height'): NumberObject(px_height),
+        NameObject('/ColorSpace'): NameObject('/DeviceRGB'),
+        NameObject('/BitsPerComponent'): NumberObject(8),
+        NameObject('/Filter'): NameObject('/DCTDecode' if fmt == 'jpeg' else '/FlateDecode'),
+    })
+    content = DecodedStreamObject()
+    content.set_data(f"q {width:.4f} 0 0 {height:.4f} 0 0 cm /Im0 Do Q".encode())
+    writer.add_page(DictionaryObject({
+        NameObject('/Type'): NameObject('/Page'),
+        NameObject('/MediaBox'): ArrayObject([_number(0), _number(0), _number(width), _number(height)]),
+        NameObject('/Resources'): DictionaryObject({
+            NameObject('/XObject'): DictionaryObject({NameObject('/Im0'): writer.add_object(image)}),
+        }),
+        NameObject('/Contents'): writer.add_object(content),
+    }), replaces)
+
+
+def rasterize(vector_path, out_path, settings, pool=None, cancel=None, on_page=None, stage=_no_stage):
+    # 把已盖章的 PDF 逐页渲染成图片写到 out_path；每页渲染完立即写出，不在内存里攒整份文档
+    # 只渲染 settings.pages 选中的页面，其余页面原样（矢量）写出
+    # pool: 可选的 PagePool，给定时各页分给进程池并行渲染，否则在本进程逐页渲染
+    _load_pymupdf()
+    part_path = out_path + '.part'
+    pages = None
+    try:
+        with open(vector_path, 'rb') as src, open(part_path, 'wb') as dst:
+            reader = PdfReader(src)
+            page_count = len(reader.pages)
+            selection = page_selection(settings)
+            selected = [page_selected(selection, page_no, page_count, page)
+                        for page_no, page in enumerate(reader.pages, 1)]
+            indices = [index for index, wanted in enumerate(selected) if wanted]
+            if pool is not None:
+                pages = pool.render(vector_path, indices, settings, cancel)
+            else:
+                pages = _render_serial(vector_path, indices, settings, cancel)
+            writer = StreamingWriter(dst, reader)
+            writer.map_pages(reader.pages)
+            for page_no, page in enumerate(reader.pages, 1):
+                if selected[page_no - 1]:
+                    with stage('merge'):
+                        rendered = next(pages)
+                    with stage('write'):
+                        _write_page(writer, page, settings.flatten_format, *rendered)
+                else:
+                    _check_cancel(cancel)
+                    with stage('write'):
+                        writer.write_page(page)
+                if on_page is not None:
+                    on_page(page_no, page_count)
+            with stage('write'):
+                writer.close()
+        os.replace(part_path, out_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        if pages is not None:
+            pages.close()
+    return page_count
+
+
+def _encrypt_copy(src_path, out_path, encryption):
+    # 栅格化结果按原文件的密码和权限重新加密
+    part_path = out_path + '.part'
+    try:
+        writer = PdfWriter()
+        for page in PdfReader(src_path).pages:
+            writer.add_page(page)
+        encrypt_writer(writer, encryption)
+        with open(part_path, 'wb') as f:
+            writer.write(f)
+        os.replace(part_path, out_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def flatten_pdf(inp_path, out_path, settings, pool=None, cancel=None, on_page=None, stage=_no_stage, data=None):
+    # 盖章（矢量，沿用流式/增量等设置）-> 栅格化；返回总页数
+    # 加密输入：中间文件不加密（渲染进程不需要密码），栅格化后再按原权限加密
+    vector_path = out_path + '.vec.part'
+    raster_path = out_path + '.raw.part'
+    try:
+        with stage('parse'):
+            encryption = read_encryption(inp_path, data, current_passwords())
+        with stage('overlay'):
+            add_watermark(inp_path, vector_path, dataclasses.replace(settings, flatten=False), cancel, data=data,
+                          reencrypt=False)
+        if encryption is None:
+            return rasterize(vector_path, out_path, settings, pool, cancel, on_page, stage)
+        page_count = rasterize(vector_path, raster_path, settings, pool, cancel, on_page, stage)
+        with stage('write'):
+            _encrypt_copy(raster_path, out_path, encryption)
+        return page_count
+    finally:
+        for path in (vector_path, raster_path):
+            if os.path.exists(path):
+                os.remove(path)
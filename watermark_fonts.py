@@ -0,0 +1,131 @@
+import os
+import sys
+import copy
+from functools import lru_cache
+from weakref import WeakKeyDictionary
+
+# 字体配置：显示名 -> (注册名, 候选文件名)
+# 候选按顺序在搜索路径里查找（不区分大小写），Windows 字体之后是 Linux/macOS 上常见的同类字体：
+# Liberation 与 Arial/Times/Courier 等宽，文泉驿、AR PL 为 TrueType 轮廓的中文字体
+# （Noto/思源 CJK 是 CFF 轮廓，reportlab 不支持，不列入）
+FONT_OPTIONS = {
+    "微软雅黑": ("MicrosoftYaHei", ("msyh.ttc", "msyh.ttf", "wqy-microhei.ttc", "wqy-zenhei.ttc",
+                                  "DroidSansFallbackFull.ttf")),
+    "宋体": ("SimSun", ("simsun.ttc", "uming.ttc", "wqy-zenhei.ttc")),
+    "黑体": ("SimHei", ("simhei.ttf", "wqy-zenhei.ttc", "wqy-microhei.ttc")),
+    "楷体": ("KaiTi", ("simkai.ttf", "ukai.ttc")),
+    "仿宋": ("FangSong", ("simfang.ttf", "uming.ttc")),
+    "Arial": ("Arial", ("arial.ttf", "LiberationSans-Regular.ttf", "DejaVuSans.ttf")),
+    "Times New Roman": ("TimesNewRoman", ("times.ttf", "Times New Roman.ttf", "LiberationSerif-Regular.ttf",
+                                          "DejaVuSerif.ttf")),
+    "Courier New": ("CourierNew", ("cour.ttf", "Courier New.ttf", "LiberationMono-Regular.ttf",
+                                   "DejaVuSansMono.ttf")),
+}
+
+# 额外的字体目录，多个用 os.pathsep 分隔；优先于系统字体目录
+FONT_PATH_ENV = 'PDF_WATERMARK_FONT_PATH'
+FONT_EXTENSIONS = ('.ttf', '.ttc')
+
+# 命令行 --font-dir 等追加的目录（排在环境变量之前）
+_extra_dirs = []
+# 搜索路径下的字体文件索引：小写文件名 -> 路径（首次查找时扫描一次）
+_font_index = None
+# 已解析的字体：(路径, 修改时间) -> TTFont；同一文件注册为多个名称时共用解析结果
+_parsed_fonts = {}
+# 本进程已注册到 reportlab 的字体名
+_registered_fonts = set()
+
+
+def system_font_dirs():
+    if sys.platform == 'win32':
+        return [os.path.join(os.environ.get('WINDIR', 'C:/Windows'), 'Fonts'),
+                os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Microsoft', 'Windows', 'Fonts')]
+    home = os.path.expanduser('~')
+    if sys.platform == 'darwin':
+        return ['/System/Library/Fonts', '/Library/Fonts', os.path.join(home, 'Library', 'Fonts')]
+    return ['/usr/share/fonts', '/usr/local/share/fonts',
+            os.path.join(home, '.local', 'share', 'fonts'), os.path.join(home, '.fonts')]
+
+
+def font_dirs():
+    env = [d for d in os.environ.get(FONT_PATH_ENV, '').split(os.pathsep) if d]
+    return _extra_dirs + env + system_font_dirs()
+
+
+def add_font_dirs(dirs):
+    # 追加字体目录，下次查找时重新建索引
+    global _font_index
+    for d in dirs:
+        if d not in _extra_dirs:
+            _extra_dirs.append(d)
+    _font_index = None
+
+
+def _build_index():
+    # 递归扫描各目录；同名文件以排在前面的目录为准
+    index = {}
+    for folder in font_dirs():
+        for root, _, names in os.walk(folder):
+            for name in names:
+                if name.lower().endswith(FONT_EXTENSIONS):
+                    index.setdefault(name.lower(), os.path.join(root, name))
+    return index
+
+
+def find_font_file(filename):
+    global _font_index
+    if _font_index is None:
+        _font_index = _build_index()
+    return _font_index.get(filename.lower())
+
+
+def resolve_font(key):
+    # 显示名 -> (注册名, 字体文件路径)；搜索路径里一个候选都没有时抛出 FileNotFoundError
+    font_name, candidates = FONT_OPTIONS[key]
+    for filename in candidates:
+        path = find_font_file(filename)
+        if path is not None:
+            return font_name, path
+    raise FileNotFoundError(
+        f"找不到字体 {key}（{'/'.join(candidates)}），"
+        f"可用 --font-dir 或环境变量 {FONT_PATH_ENV} 指定字体目录，或用 --font-path 直接指定文件"
+    )
+
+
+def available_fonts():
+    # 当前搜索路径下能找到的字体显示名（界面下拉框用）
+    available = []
+    for key in FONT_OPTIONS:
+        try:
+            resolve_font(key)
+        except FileNotFoundError:
+            continue
+        available.append(key)
+    return available
+
+
+def register_font(font_name, font_path):
+    # 每个进程每种字体只注册一次，每个字体文件只解析一次（.ttc 之类的大字体解析很慢）
+    # asciiReadable=False：子集只含水印实际用到的字形，不再固定带上整套 ASCII
+    if font_name in _registered_fonts:
+        return
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    key = (os.path.abspath(font_path), os.path.getmtime(font_path))
+    if key in _parsed_fonts:
+        # 共用已解析的字形表，只换注册名；子集状态按文档单独记录
+        font = copy.copy(_parsed_fonts[key])
+        font.fontName = font_name
+        font.state = WeakKeyDictionary()
+    else:
+        font = TTFont(font_name, font_path, asciiReadable=False)
+        _parsed_fonts[key] = font
+    pdfmetrics.registerFont(font)
+    _registered_fonts.add(font_name)
+
+
+@lru_cache(maxsize=1024)
+def text_width(text, font_name, size):
+    # stringWidth 逐字查宽度表，同一文字/字号在每个水印模板、每个预览里都要算，结果缓存起来
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    return stringWidth(text, font_name, size)
@@ -0,0 +1,171 @@
+import os
+import json
+from dataclasses import asdict
+
+JOB_VERSION = 1
+JOB_NAME = 'job_checkpoint.json'
+JOURNAL_NAME = 'job_journal.jsonl'
+
+
+class BatchCancelled(Exception):
+    # 用户取消：当前文件不写输出，留在待处理列表里，之后可继续
+    pass
+
+
+class BatchJob:
+    # 可继续的批处理任务，保存在输出目录：
+    #   job_checkpoint.json  任务头：文件列表、输出子目录、水印设置、进程数（开始时写一次，扫描完输入后再写一次）
+    #   job_journal.jsonl    每发现/完成/失败一个文件追加一行，崩溃或睡眠后按它恢复进度
+    # 输入是边扫描边处理的文件夹时，任务头还记下输入路径；扫描中途中断的任务继续时重新扫描，补上还没发现的文件
+    # 全部处理完才删除这两个文件；取消或中断时保留，供“继续上次”使用
+    # 继续时重试上次失败的文件（读取失败、网络盘断开之类可能是暂时的）；预检隔离的文件不再重试
+    def __init__(self, out_dir, pdf_list, settings, workers=1, force=False,
+                 subdirs=None, inputs=None, recursive=False, complete=True):
+        self.out_dir = out_dir
+        self.pdf_list = list(pdf_list)
+        self.settings = settings      # 字典形式，由调用方还原为 WatermarkSettings
+        self.workers = workers
+        self.force = force
+        self.subdirs = dict(subdirs or {})   # 输入 -> 输出子目录（平铺输出的文件不记）
+        self.inputs = inputs          # 扫描来源（PdfTree 的路径），文件列表事先给定时为 None
+        self.recursive = recursive
+        self.complete = complete      # 文件列表是否已完整（扫描结束）
+        self.done = set()
+        self.failed = {}
+        self._known = set(self.pdf_list)
+        self._journal = None
+
+    @classmethod
+    def create(cls, out_dir, pdf_list, settings, workers=1, force=False, source=None):
+        # source: 可选的 PdfTree；给定时文件列表先为空，扫描中逐个 add()，扫描完调用 finish_discovery()
+        if source is not None:
+            job = cls(out_dir, [], asdict(settings), workers, force,
+                      inputs=source.paths, recursive=source.recursive, complete=False)
+        else:
+            job = cls(out_dir, pdf_list, asdict(settings), workers, force)
+        # 先清空旧日志再让新任务头生效，避免新任务读到上一次的进度
+        open(job._path(JOURNAL_NAME), 'w', encoding='utf-8').close()
+        job._write_header()
+        return job
+
+    @classmethod
+    def load(cls, out_dir):
+        # 没有未完成任务时抛出 FileNotFoundError
+        with open(os.path.join(out_dir, JOB_NAME), encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != JOB_VERSION:
+            raise ValueError(f"不支持的任务版本: {data.get('version')}")
+        job = cls(out_dir, data['pdf_list'], data['settings'], data['workers'], data['force'],
+                  data.get('subdirs'), data.get('inputs'), data.get('recursive', False),
+                  data.get('complete', True))
+        try:
+            with open(job._path(JOURNAL_NAME), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 崩溃时可能留下半行
+                    if entry['status'] == 'queued':
+                        job._add(entry['file'], entry.get('subdir', ''))
+                    elif entry['status'] == 'done':
+                        job.done.add(entry['file'])
+                        job.failed.pop(entry['file'], None)
+                    elif entry['status'] == 'quarantined':
+                        job.failed[entry['file']] = entry.get('error', '')
+                    else:
+                        job.failed.pop(entry['file'], None)
+        except OSError:
+            pass
+        return job
+
+    @staticmethod
+    def exists(out_dir):
+        return os.path.exists(os.path.join(out_dir, JOB_NAME))
+
+    def _path(self, name):
+        return os.path.join(self.out_dir, name)
+
+    def _write_header(self):
+        tmp = self._path(JOB_NAME) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': JOB_VERSION,
+                'pdf_list': self.pdf_list,
+                'subdirs': self.subdirs,
+                'inputs': self.inputs,
+                'recursive': self.recursive,
+                'complete': self.complete,
+                'settings': self.settings,
+                'workers': self.workers,
+                'force': self.force,
+            }, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self._path(JOB_NAME))
+
+    def _add(self, inp, subdir):
+        if inp in self._known:
+            return False
+        self._known.add(inp)
+        self.pdf_list.append(inp)
+        if subdir:
+            self.subdirs[inp] = subdir
+        return True
+
+    def add(self, inp, subdir=''):
+        # 扫描中发现一个文件；已在列表里的（继续任务时重新扫描到的）返回 False
+        if not self._add(inp, subdir):
+            return False
+        self._append({'file': inp, 'status': 'queued', 'subdir': subdir})
+        return True
+
+    def finish_discovery(self):
+        # 扫描结束：把完整列表写回任务头，之后继续任务不再重新扫描
+        self.complete = True
+        self._write_header()
+
+    def source(self):
+        # 扫描还没结束时返回需要重新扫描的 (输入路径, 是否递归)，否则返回 None
+        return None if self.complete or self.inputs is None else (self.inputs, self.recursive)
+
+    def subdir(self, inp):
+        return self.subdirs.get(inp, '')
+
+    def pending(self):
+        return [inp for inp in self.pdf_list if inp not in self.done and inp not in self.failed]
+
+    def _append(self, entry):
+        if self._journal is None:
+            self._journal = open(self._path(JOURNAL_NAME), 'a', encoding='utf-8')
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._journal.flush()
+
+    def mark_done(self, inp):
+        self.done.add(inp)
+        self._append({'file': inp, 'status': 'done'})
+
+    def mark_failed(self, inp, error, quarantined=False):
+        # 本次运行内不再处理；quarantined 为 False 时继续任务会重试
+        self.failed[inp] = str(error)
+        self._append({'file': inp, 'status': 'quarantined' if quarantined else 'failed', 'error': str(error)})
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        # 扫描完且全部文件都有结果：任务结束，删除检查点
+        if self.complete and not self.pending():
+            for name in (JOB_NAME, JOURNAL_NAME):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+
+def pending_job(out_dir):
+    # 供界面判断是否可“继续上次”：返回 (已完成数, 总数)，没有则返回 None
+    if not BatchJob.exists(out_dir):
+        return None
+    try:
+        job = BatchJob.load(out_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+    return len(job.pdf_list) - len(job.pending()), len(job.pdf_list)
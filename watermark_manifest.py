@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+from dataclasses import asdict
+
+# 清单格式或输出内容的生成方式变化时加一，使旧清单整体失效
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def settings_fingerprint(settings):
+    # 水印设置指纹：全部字段 + Logo 文件内容（同名 Logo 被替换时也要重做）
+    data = asdict(settings)
+    if settings.logo_path and os.path.exists(settings.logo_path):
+        data['logo_sha256'] = file_digest(settings.logo_path)
+    data['manifest_version'] = MANIFEST_VERSION
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=list)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    # 输出目录里的内容寻址清单：输出文件相对路径 -> 输入路径、大小、mtime、sha256、设置指纹
+    # 大小和 mtime 都没变时直接沿用记录的哈希，2 万个文件的目录不必每次全部重读
+    # 键用 / 分隔（平铺的输出就是文件名，与旧清单兼容），保持子目录结构时不同子目录的同名文件互不覆盖
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self.entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+
+    def _key(self, out):
+        return os.path.relpath(out, self.out_dir).replace(os.sep, '/')
+
+    def cached_digest(self, inp, out, st=None):
+        # 记录里的哈希仍可用（来源、大小、mtime 都没变）时返回它，否则返回 None
+        st = st or os.stat(inp)
+        entry = self.entries.get(self._key(out))
+        if (entry and entry['source'] == os.path.abspath(inp)
+                and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns):
+            return entry['sha256']
+        return None
+
+    def input_digest(self, inp, out):
+        return self.cached_digest(inp, out) or file_digest(inp)
+
+    def is_current(self, inp, out, digest, fingerprint):
+        entry = self.entries.get(self._key(out))
+        return (entry is not None and os.path.exists(out)
+                and entry['sha256'] == digest and entry['settings'] == fingerprint)
+
+    def record(self, inp, out, digest, fingerprint):
+        st = os.stat(inp)
+        self.entries[self._key(out)] = {
+            'source': os.path.abspath(inp),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha256': digest,
+            'settings': fingerprint,
+        }
+
+    def forget(self, out):
+        self.entries.pop(self._key(out), None)
+
+    def save(self):
+        # 先写临时文件再替换，中途中断不会留下半截清单
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.entries}, f,
+                      ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
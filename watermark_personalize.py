@@ -0,0 +1,332 @@
+import os
+import re
+import csv
+import sys
+import time
+import string
+import argparse
+import dataclasses
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PyPDF2 import PdfReader, PdfWriter, PageObject
+from reportlab.pdfgen import canvas
+
+from watermark_engine import (
+    DEFAULT_OUTPUT_DIR, BatchResult, register_font, clear_cache, draw_watermark, make_template,
+    get_watermark_template, page_geometry, page_selection, page_selected, tile_steps, add_settings_arguments,
+    settings_from_args,
+    init_worker, _stamp_form, _check_cancel,
+)
+from watermark_flatten import rasterize, _encrypt_copy
+from watermark_preflight import (
+    unlock, encrypt_writer, read_encryption, read_passwords, set_passwords, unlock_options, current_passwords,
+)
+from watermark_jobs import BatchCancelled
+
+# 输出文件名模板，可用的字段与水印文字相同（{page}/{pages} 除外）
+DEFAULT_NAME_TEMPLATE = 'wm_{file}_{row}.pdf'
+# 每页取值不同的字段；文字模板不含它们时，同一尺寸的页面共用一个文字层
+PAGE_FIELDS = ('page', 'pages')
+# 多进程时每个进程大约分到几批副本（批越小，进度越平滑、负载越均衡）
+CHUNKS_PER_WORKER = 4
+
+# 子进程里的取消标志（由 _init_personalize_worker 设置）
+_worker_cancel = None
+# 子进程里已准备好的源文件：(路径, 修改时间, 设置) -> Personalizer；同一进程的多批副本只解析一次
+_personalizers = {}
+
+
+def template_fields(text):
+    # 文字模板里用到的字段名，如 "{recipient} {page}/{pages}" -> {'recipient', 'page', 'pages'}
+    fields = set()
+    for _, name, _, _ in string.Formatter().parse(text):
+        if name is None:
+            continue
+        if not name or name.isdigit():
+            raise ValueError(f"模板字段需要名称: {text}")
+        fields.add(re.split(r'[.\[]', name)[0])
+    return fields
+
+
+def load_recipients(csv_path):
+    # 第一行为表头；utf-8-sig 兼容 Excel 导出的带 BOM 文件
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames:
+            raise ValueError(f"{csv_path} 没有表头")
+        return [{(k or '').strip(): (v or '').strip() for k, v in row.items()} for row in reader]
+
+
+def _safe_filename(name):
+    return re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', name).strip() or '_'
+
+
+class Personalizer:
+    # 一个源文件生成多份个性化副本：
+    #   源文件只解析一次，每份副本从同一个 PdfReader 克隆页面；
+    #   Logo 和不含字段的文字属于静态层，走普通水印模板缓存，每种页面几何只渲染一次；
+    #   每份副本只生成文字层：各页文字画在同一个多页 canvas 里，副本里的字体子集只嵌入一份
+    def __init__(self, source, settings):
+        self.settings = settings
+        self.reader = PdfReader(source)
+        # 加密的源文件用 set_passwords 给定的密码解密，每份副本按原权限重新加密
+        self.encryption = unlock(self.reader, current_passwords()) if self.reader.is_encrypted else None
+        self.geometries = [page_geometry(page) for page in self.reader.pages]
+        # --pages 没选中的页面不盖章，也不为它们生成文字层
+        selection = page_selection(settings)
+        self.selected = [page_selected(selection, page_no, len(self.geometries), page)
+                         for page_no, page in enumerate(self.reader.pages, 1)]
+        fields = template_fields(settings.text)
+        has_logo = bool(settings.logo_path) and os.path.exists(settings.logo_path)
+        static_text = '' if fields else settings.text
+        self.static = dataclasses.replace(settings, text=static_text) if static_text or has_logo else None
+        self.text_settings = dataclasses.replace(settings, logo_path='') if fields else None
+        self.page_dependent = bool(fields & set(PAGE_FIELDS))
+
+    def page_texts(self, fields):
+        if self.text_settings is None:
+            return None
+        pages = len(self.geometries)
+        if not self.page_dependent:
+            return [self.text_settings.text.format_map(fields)] * pages
+        return [self.text_settings.text.format_map(dict(fields, page=i, pages=pages))
+                for i in range(1, pages + 1)]
+
+    def text_layers(self, texts):
+        # 相同 (文字, 几何) 只画一页；返回 {(文字, 几何): 水印模板}
+        items = list(dict.fromkeys(item for item, wanted in zip(zip(texts, self.geometries), self.selected)
+                                   if wanted))
+        packet = BytesIO()
+        can = canvas.Canvas(packet)
+        for text, geometry in items:
+            left, bottom, w, h, _ = geometry
+            can.setPageSize((left + w, bottom + h))
+            draw_watermark(can, dataclasses.replace(self.text_settings, text=text), geometry)
+            can.showPage()
+        can.save()
+        packet.seek(0)
+        reader = PdfReader(packet)
+        return {item: make_template(page, item[1], share=False,
+                                    tile=tile_steps(dataclasses.replace(self.text_settings, text=item[0]), item[1]))
+                for item, page in zip(items, reader.pages)}
+
+    def write_copy(self, out_path, fields, cancel=None):
+        texts = self.page_texts(fields)
+        layers = self.text_layers(texts) if texts is not None else {}
+        output = PdfWriter()
+        forms = {}
+        for index, page in enumerate(self.reader.pages):
+            _check_cancel(cancel)
+            if not self.selected[index]:
+                output.add_page(page)
+                continue
+            geometry = self.geometries[index]
+            stamps = []
+            if self.static is not None:
+                stamps.append((get_watermark_template(self.static, geometry), ('static', geometry)))
+            if texts is not None:
+                key = (texts[index], geometry)
+                stamps.append((layers[key], ('text',) + key))
+            if self.settings.stamp_mode == 'xobject':
+                # add_page 克隆到输出文件里再盖章，源文件的页面对象保持不变，可供下一份副本使用
+                target = output.add_page(page)
+                for template, key in stamps:
+                    _stamp_form(target, template, forms, output._add_object,
+                                lambda obj: obj.clone(output), key)
+            else:
+                # merge_page 要在 add_page 之前做（与引擎的完整重写相同），克隆时才会把合并后的内容流和
+                # 模板里的字体一并复制进输出文件；在源页面的浅拷贝上合并，源页面不变，可供下一份副本使用
+                target = PageObject(self.reader)
+                target.update(page)
+                for template, _ in stamps:
+                    target.merge_page(template.page)
+                output.add_page(target)
+        if not self.settings.flatten:
+            if self.encryption is not None:
+                encrypt_writer(output, self.encryption)
+            with open(out_path, 'wb') as f:
+                output.write(f)
+            return
+        # 栅格化：矢量副本先写到临时文件，再逐页渲染成图片（副本之间已按进程并行，这里逐页渲染）
+        vector_path = out_path + '.vec.part'
+        raster_path = out_path + '.raw.part'
+        try:
+            with open(vector_path, 'wb') as f:
+                output.write(f)
+            if self.encryption is None:
+                rasterize(vector_path, out_path, self.settings, cancel=cancel)
+            else:
+                rasterize(vector_path, raster_path, self.settings, cancel=cancel)
+                _encrypt_copy(raster_path, out_path, self.encryption)
+        finally:
+            for path in (vector_path, raster_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def _get_personalizer(source, settings):
+    key = (source, os.path.getmtime(source), settings)
+    if key not in _personalizers:
+        _personalizers.clear()
+        _personalizers[key] = Personalizer(source, settings)
+    return _personalizers[key]
+
+
+def _init_personalize_worker(font_name, font_path, cancel, decrypt=((), False)):
+    global _worker_cancel
+    init_worker(font_name, font_path, decrypt=decrypt)
+    _worker_cancel = cancel
+
+
+def _personalize_chunk(source, settings, jobs):
+    # 子进程处理一批副本，返回 [(输出路径, 错误或 None)]；取消时已完成的照常返回
+    personalizer = _get_personalizer(source, settings)
+    results = []
+    for out_path, fields in jobs:
+        try:
+            personalizer.write_copy(out_path, fields, _worker_cancel)
+        except BatchCancelled:
+            break
+        except Exception as e:
+            results.append((out_path, str(e)))
+        else:
+            results.append((out_path, None))
+    return results
+
+
+def plan_copies(source, rows, out_dir, settings, name_template=DEFAULT_NAME_TEMPLATE):
+    # 展开每份副本的输出路径和字段；字段缺失、文件名重复时在开始前报错
+    stem = os.path.splitext(os.path.basename(source))[0]
+    now = time.localtime()
+    base = {
+        'file': stem,
+        'date': time.strftime('%Y-%m-%d', now),
+        'datetime': time.strftime('%Y-%m-%d %H:%M', now),
+    }
+    available = set(base) | {'row'} | set(rows[0] if rows else ())
+    missing = (template_fields(settings.text) - set(PAGE_FIELDS) - available) \
+        | (template_fields(name_template) - available)
+    if missing:
+        raise ValueError(f"未知字段: {', '.join(sorted(missing))}（可用: {', '.join(sorted(available | set(PAGE_FIELDS)))}）")
+    copies, names = [], set()
+    for index, row in enumerate(rows, 1):
+        fields = {**base, 'row': f"{index:04d}", **row}
+        name = _safe_filename(name_template.format_map(fields))
+        if not name.lower().endswith('.pdf'):
+            name += '.pdf'
+        if name in names:
+            raise ValueError(f"输出文件名重复: {name}（请在 --name-template 中加入 {{row}} 或唯一的列）")
+        names.add(name)
+        copies.append((os.path.join(out_dir, name), fields))
+    return copies
+
+
+def personalize(source, rows, out_dir, settings, workers=1, name_template=DEFAULT_NAME_TEMPLATE,
+                cancel=None, on_progress=None):
+    # 为 rows（CSV 每行一个 dict）各生成一份副本；settings.text 为文字模板，如 "{recipient} {date} {page}/{pages}"
+    # on_progress(已完成份数, 总份数) 每完成一份回调一次；返回 BatchResult（skipped 恒为 0）
+    os.makedirs(out_dir, exist_ok=True)
+    copies = plan_copies(source, rows, out_dir, settings, name_template)
+    # 加密的源文件先检查一次密码（缺密码或拒绝弱化的重新加密时抛出 ValueError，不必等各副本逐个失败）
+    encryption = read_encryption(source, passwords=current_passwords())
+    register_font(settings.font_name, settings.font_path)
+    clear_cache()
+    failures = []
+    warnings = []
+    done = 0
+    log_file = os.path.join(out_dir, 'error_log.txt')
+    if encryption is not None and encryption.warning:
+        warnings.append((os.path.basename(source), encryption.warning))
+        with open(log_file, 'a', encoding='utf-8') as log:
+            log.write(f"{os.path.basename(source)} warning: {encryption.warning}\n")
+
+    def finished(results):
+        nonlocal done
+        for out_path, e in results:
+            done += 1
+            if e is not None:
+                failures.append((os.path.basename(out_path), e))
+                with open(log_file, 'a', encoding='utf-8') as log:
+                    log.write(f"{os.path.basename(out_path)} failed: {e}\n")
+            if on_progress is not None:
+                on_progress(done, len(copies))
+
+    workers = min(workers, len(copies))
+    if workers <= 1:
+        personalizer = Personalizer(source, settings)
+        for out_path, fields in copies:
+            try:
+                personalizer.write_copy(out_path, fields, cancel)
+            except BatchCancelled:
+                break
+            except Exception as e:
+                finished([(out_path, str(e))])
+            else:
+                finished([(out_path, None)])
+    else:
+        size = max(1, -(-len(copies) // (workers * CHUNKS_PER_WORKER)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_personalize_worker,
+                                 initargs=(settings.font_name, settings.font_path, cancel,
+                                           unlock_options())) as pool:
+            futures = [pool.submit(_personalize_chunk, source, settings, copies[i:i + size])
+                       for i in range(0, len(copies), size)]
+            for future in as_completed(futures):
+                finished(future.result())
+    return BatchResult(failures, 0, done < len(copies), warnings=warnings)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="个性化水印：按 CSV 名单为每位收件人生成一份带专属文字的副本")
+    parser.add_argument('source', help="源 PDF")
+    parser.add_argument('--recipients', required=True, help="收件人 CSV（第一行为表头，列名可在模板中引用）")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT_DIR, help="输出目录")
+    add_settings_arguments(parser)
+    parser.add_argument('--name-template', default=DEFAULT_NAME_TEMPLATE,
+                        help="输出文件名模板（默认 %(default)s）")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument('--password', action='append', default=[], help="加密源文件的密码（可重复）")
+    parser.add_argument('--password-file', help="密码文件，每行一个")
+    parser.add_argument('--allow-weaker-encryption', action='store_true',
+                        help="接受比原文件弱的重新加密（AES 改为 RC4-128、只有权限密码时用它作打开密码）")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if not args.text:
+        parser.error("需要指定 --text，如 \"{recipient} {date} {page}/{pages}\"")
+    settings = settings_from_args(args)
+    set_passwords(read_passwords(args.password, args.password_file), args.allow_weaker_encryption)
+    try:
+        rows = load_recipients(args.recipients)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    cancel = multiprocessing.Event()
+
+    def on_progress(done, total):
+        print(f"\r{done}/{total} 份", end='', flush=True)
+
+    start = time.perf_counter()
+    try:
+        result = personalize(args.source, rows, args.output, settings, args.workers,
+                             args.name_template, cancel, on_progress)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        cancel.set()
+        print("\n已取消", file=sys.stderr)
+        return 130
+    print(f"\n完成 {len(rows) - len(result.failures)} 份，用时 {time.perf_counter() - start:.1f}s，输出到 {args.output}")
+    for name, e in result.failures:
+        print(f"{name} failed: {e}", file=sys.stderr)
+    for name, warning in result.warnings:
+        print(f"{name} warning: {warning}", file=sys.stderr)
+    return 1 if result.failures or result.cancelled else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import os
+import re
+import sys
+import json
+import shutil
+import secrets
+import argparse
+import importlib.util
+from io import BytesIO
+from collections import namedtuple, Counter
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.errors import DependencyError
+from PyPDF2._encryption import PasswordType
+
+from watermark_config import QUARANTINE_NAME, QUARANTINE_DIR, PdfTree
+from watermark_progress import PROGRESS_LOG_NAME
+
+# 预检：开工前只读文件头、文件尾的 startxref / trailer、交叉引用表和加密字典（另读 /Root、/Pages 两个对象取页数），
+# 不解析页面内容。批处理里在 I/O 线程中随预读进行，读不了的文件在占用盖章进程之前就被隔离
+# 状态：ok        可直接处理
+#       encrypted 加密：有可用密码时解密后处理，输出按原权限重新加密；没有则隔离
+#       repair    文件头/交叉引用表/文件尾损坏但能重建，修复后处理
+#       oversized 超过 --max-size / --max-pages，隔离
+#       damaged   无法读取，隔离
+STATUSES = ('ok', 'encrypted', 'repair', 'oversized', 'damaged')
+HEAD_BYTES = 1024
+TAIL_BYTES = 2048
+
+# 单个文件的预检结果：pages 为页数估计（读不出时为 None），bytes 为文件大小；
+# usable 表示可以处理（包括已找到密码的加密文件和可修复的文件），detail 为问题说明；
+# warning 为允许弱化重新加密时的提示（见 unlock），批处理写进 error_log.txt 和 BatchResult.warnings
+Preflight = namedtuple('Preflight', ['status', 'pages', 'bytes', 'encrypted', 'usable', 'detail', 'warning'],
+                       defaults=('',))
+# 预检上限（0 为不限）
+PreflightLimits = namedtuple('PreflightLimits', ['max_mb', 'max_pages'], defaults=(0, 0))
+# 重新加密所需的参数：打开密码、权限密码、权限位（原文件的 /P）；warning 为输出加密比原文件弱时的说明
+Encryption = namedtuple('Encryption', ['user_password', 'owner_password', 'permissions', 'warning'])
+
+# 批处理里加密输入可用的密码（set_passwords 设置，其他模块用 current_passwords() 读取；进程池子进程由初始化函数设置）
+# 只留在内存里，不写进任务检查点和清单，继续任务时需要重新提供
+_passwords = ()
+# 是否接受比原文件弱的重新加密（--allow-weaker-encryption）；默认拒绝并隔离
+_allow_weaker = False
+
+
+def set_passwords(passwords, allow_weaker=False):
+    global _passwords, _allow_weaker
+    _passwords = tuple(passwords)
+    _allow_weaker = allow_weaker
+
+
+def current_passwords():
+    return _passwords
+
+
+def unlock_options():
+    # 传给进程池初始化函数的 (密码, 是否接受弱化的重新加密)
+    return list(_passwords), _allow_weaker
+
+
+def _uses_aes(reader):
+    encrypt = reader.trailer['/Encrypt']
+    filters = encrypt.get('/CF', {})
+    return any(filters[name].get('/CFM') in ('/AESV2', '/AESV3') for name in filters)
+
+
+def unlock(reader, passwords=()):
+    # 用空密码和给定的密码依次尝试解密；成功时 reader 保持解密状态，返回重新加密用的 Encryption
+    # 不知道权限密码时随机生成一个，原有的权限限制仍然有效
+    # 输出加密会比原文件弱的两种情况默认抛出 ValueError（预检时隔离），set_passwords(..., allow_weaker=True) 时放行并带上 warning：
+    #   原文件为 AES：PyPDF2 只能写出 RC4-128
+    #   只知道权限密码：输出的打开密码只能用权限密码，收件人原来的打开密码不再可用
+    # 校验密码不需要 PyCryptodome，解密 AES 对象才需要：预先检查，免得盖章到一半才失败
+    if _uses_aes(reader) and importlib.util.find_spec('Crypto') is None:
+        raise DependencyError("AES 加密，需要安装 PyCryptodome 才能解密")
+    user = owner = None
+    for password in ('',) + tuple(passwords):
+        kind = reader.decrypt(password)
+        if kind == PasswordType.USER_PASSWORD and user is None:
+            user = password
+        elif kind == PasswordType.OWNER_PASSWORD and owner is None:
+            owner = password
+    if user is None and owner is None:
+        raise ValueError("加密 PDF，没有可用的密码（用 --password 指定）")
+    reader.decrypt(user if user is not None else owner)
+    permissions = int(reader.trailer['/Encrypt'].get('/P', -4))
+    weaker = []
+    if _uses_aes(reader):
+        weaker.append("原文件为 AES 加密，输出只能用 RC4-128 重新加密")
+    if user is None:
+        weaker.append("只提供了权限密码，输出的打开密码改为权限密码，原打开密码不再可用")
+    warning = "；".join(weaker)
+    if warning and not _allow_weaker:
+        raise ValueError(f"{warning}（确认接受请加 --allow-weaker-encryption）")
+    return Encryption(user if user is not None else owner,
+                      owner if owner is not None else secrets.token_hex(16), permissions, warning)
+
+
+def read_encryption(path, data=None, passwords=()):
+    # 输入的加密参数（未加密时为 None）；没有可用密码时抛出 ValueError
+    reader = PdfReader(BytesIO(data) if data is not None else path, strict=False)
+    return unlock(reader, passwords) if reader.is_encrypted else None
+
+
+def encrypt_writer(writer, encryption):
+    # PyPDF2 只能写出 RC4-128 加密（原文件是 AES 时需要 allow_weaker，见 unlock）
+    writer.encrypt(encryption.user_password, encryption.owner_password, permissions_flag=encryption.permissions)
+
+
+def _structure(read_at, size):
+    # 文件头有 %PDF-，文件尾有 startxref 和 %%EOF，且 startxref 指向交叉引用表或交叉引用流对象
+    if b'%PDF-' not in read_at(0, HEAD_BYTES):
+        return "文件头没有 %PDF-"
+    tail = read_at(max(0, size - TAIL_BYTES), TAIL_BYTES)
+    found = re.findall(rb'startxref\s+(\d+)', tail)
+    if not found or b'%%EOF' not in tail:
+        return "文件尾没有 startxref / %%EOF（文件不完整）"
+    pos = int(found[-1])
+    if not re.match(rb'\s*(xref|\d+\s+\d+\s+obj)', read_at(pos, 32)):
+        return f"startxref 指向的位置 {pos} 不是交叉引用表"
+    return ''
+
+
+def _load_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        return None
+    return pymupdf
+
+
+def _pymupdf_pages(path, data):
+    # PyPDF2 读不了的文件再用 PyMuPDF 试一次（它能重建截断或交叉引用表损坏的文件）；读不了时返回 None
+    pymupdf = _load_pymupdf()
+    if pymupdf is None:
+        return None
+    try:
+        with (pymupdf.open(stream=data) if data is not None else pymupdf.open(path)) as doc:
+            return doc.page_count or None
+    except Exception:
+        return None
+
+
+def scan(path, passwords=(), limits=PreflightLimits(), data=None):
+    # data: 已读入内存的文件内容，给定时不再读盘
+    size = len(data) if data is not None else os.path.getsize(path)
+    if size == 0:
+        return Preflight('damaged', None, 0, False, False, "空文件")
+    encrypted = False
+    encryption = None
+    with (BytesIO(data) if data is not None else open(path, 'rb')) as stream:
+        def read_at(pos, n):
+            stream.seek(pos)
+            return stream.read(n)
+
+        problem = _structure(read_at, size)
+        try:
+            stream.seek(0)
+            reader = PdfReader(stream, strict=False)
+            encrypted = reader.is_encrypted
+            if encrypted:
+                encryption = unlock(reader, passwords)
+            pages = int(reader.trailer['/Root']['/Pages']['/Count'])
+        except DependencyError:
+            return Preflight('encrypted', None, size, True, False, "AES 加密，需要安装 PyCryptodome 才能解密")
+        except Exception as e:
+            if encrypted:
+                return Preflight('encrypted', None, size, True, False, str(e))
+            # PyPDF2 读不出页数：交给 PyMuPDF 判断能否修复
+            pages = _pymupdf_pages(path, data)
+            if pages is None:
+                return Preflight('damaged', None, size, False, False, problem or str(e))
+            problem = problem or str(e)
+    if limits.max_mb and size > limits.max_mb * (1 << 20):
+        return Preflight('oversized', pages, size, encrypted, False, f"{size / (1 << 20):.1f} MB，超过 {limits.max_mb} MB")
+    if limits.max_pages and pages > limits.max_pages:
+        return Preflight('oversized', pages, size, encrypted, False, f"{pages} 页，超过 {limits.max_pages} 页")
+    warning = encryption.warning if encryption is not None else ''
+    if problem:
+        return Preflight('repair', pages, size, encrypted, True, problem, warning)
+    if encrypted:
+        return Preflight('encrypted', pages, size, True, True, warning or "已找到密码，解密后处理并重新加密", warning)
+    return Preflight('ok', pages, size, False, True, '')
+
+
+def repair(path, data=None, passwords=()):
+    # 重建交叉引用表，返回修复后的文件内容；之后的盖章（包括增量更新）都基于修复后的内容
+    # 有 PyMuPDF 时用它（截断的文件也能读），保留原有加密；否则用 PyPDF2 宽松模式重写，加密的按原权限重新加密
+    pymupdf = _load_pymupdf()
+    if pymupdf is not None:
+        with (pymupdf.open(stream=data) if data is not None else pymupdf.open(path)) as doc:
+            if doc.needs_pass and not any(doc.authenticate(password) for password in ('',) + tuple(passwords)):
+                raise ValueError("加密 PDF，没有可用的密码（用 --password 指定）")
+            # garbage=1 顺带去掉截断后丢失对象的悬空引用，PyPDF2 复制页面时不会再因此出错
+            return doc.tobytes(garbage=1, encryption=pymupdf.PDF_ENCRYPT_KEEP)
+    reader = PdfReader(BytesIO(data) if data is not None else path, strict=False)
+    encryption = unlock(reader, passwords) if reader.is_encrypted else None
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+    if encryption is not None:
+        encrypt_writer(writer, encryption)
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def quarantine(out_dir, inp, result, subdir=''):
+    # 把文件放进输出目录的 quarantine/（保持子目录结构），记录追加到 quarantine.jsonl；返回隔离后的路径
+    # 用硬链接（不同文件系统时复制）而不是移动：输入目录可能是只读的共享盘，原文件也可能仍被别的流程使用
+    path = os.path.join(out_dir, QUARANTINE_DIR, subdir, os.path.basename(inp))
+    entry = {'file': inp, 'status': result.status, 'detail': result.detail,
+             'pages': result.pages, 'bytes': result.bytes, 'quarantined': path}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+        try:
+            os.link(inp, path)
+        except OSError:
+            shutil.copy2(inp, path)
+    except OSError as e:
+        # 放不进隔离文件夹（如输入已被删除）时只留记录，不影响批处理
+        path = entry['quarantined'] = None
+        entry['error'] = str(e)
+    with open(os.path.join(out_dir, QUARANTINE_NAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    return path
+
+
+def read_passwords(passwords, password_file=None):
+    # --password 可重复；--password-file 每行一个密码（免得密码出现在进程列表里）
+    passwords = list(passwords)
+    if password_file:
+        with open(password_file, encoding='utf-8') as f:
+            passwords += [line.rstrip('\r\n') for line in f if line.rstrip('\r\n')]
+    return passwords
+
+
+def history_rate(out_dir):
+    # 输出目录里最近一次完整批处理的速度（页/秒），用来估算耗时；没有记录时返回 None
+    rate = None
+    try:
+        with open(os.path.join(out_dir, PROGRESS_LOG_NAME), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('event') == 'batch' and not entry.get('cancelled') and entry.get('pages_per_sec'):
+                    rate = entry['pages_per_sec']
+    except OSError:
+        pass
+    return rate
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="PDF 预检：只读文件尾、交叉引用表和加密字典，分类并估算页数和大小")
+    parser.add_argument('inputs', nargs='+', help="PDF 文件或包含 PDF 的文件夹（含子文件夹）")
+    parser.add_argument('--no-recursive', action='store_true', help="只检查文件夹第一层的 PDF")
+    parser.add_argument('--password', action='append', default=[], help="加密 PDF 的密码（可重复）")
+    parser.add_argument('--password-file', help="密码文件，每行一个")
+    parser.add_argument('--allow-weaker-encryption', action='store_true',
+                        help="接受比原文件弱的重新加密（AES 输入改为 RC4-128、只有权限密码时改用它作打开密码）")
+    parser.add_argument('--max-size', type=int, default=0, metavar='MB', help="超过这个大小记为 oversized（0 为不限）")
+    parser.add_argument('--max-pages', type=int, default=0, help="超过这个页数记为 oversized（0 为不限）")
+    parser.add_argument('-o', '--output', help="批处理的输出目录：按其中 progress_log.jsonl 的速度估算耗时")
+    parser.add_argument('--json', metavar='PATH', help="把每个文件的结果写成 JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    passwords = read_passwords(args.password, args.password_file)
+    set_passwords(passwords, args.allow_weaker_encryption)
+    limits = PreflightLimits(args.max_size, args.max_pages)
+    results = {}
+    for inp, _ in PdfTree(args.inputs, recursive=not args.no_recursive):
+        try:
+            result = scan(inp, passwords, limits)
+        except OSError as e:
+            result = Preflight('damaged', None, None, False, False, str(e))
+        results[inp] = result
+        if result.status != 'ok':
+            print(f"{result.status:<10} {inp}  {result.detail}")
+    counts = Counter(result.status for result in results.values())
+    usable = [result for result in results.values() if result.usable]
+    pages = sum(result.pages or 0 for result in usable)
+    size = sum(result.bytes or 0 for result in usable)
+    print(f"共 {len(results)} 个文件：" + "，".join(f"{status} {counts[status]}" for status in STATUSES if counts[status]))
+    print(f"可处理 {len(usable)} 个文件，约 {pages} 页，{size / (1 << 20):.1f} MB")
+    rate = history_rate(args.output) if args.output else None
+    if rate:
+        minutes, seconds = divmod(int(pages / rate + 0.5), 60)
+        print(f"按上次批处理 {rate:.1f} 页/秒估算，约需 {minutes}:{seconds:02d}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({inp: result._asdict() for inp, result in results.items()}, f, ensure_ascii=False, indent=2)
+    return 1 if len(usable) < len(results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
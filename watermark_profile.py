@@ -0,0 +1,100 @@
+import os
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+PROFILE_JSON = 'profile.json'
+PROFILE_CSV = 'profile.csv'
+# 单个文件的处理阶段：解析 PdfReader、生成/取缓存水印、盖章合并、写出
+STAGES = ('parse', 'overlay', 'merge', 'write')
+
+
+class StageProfile:
+    # 单文件各阶段的累计耗时和内存峰值（峰值为进入该阶段后 Python 分配量的最大增量，需开启 tracemalloc）
+    def __init__(self):
+        self.seconds = {}
+        self.peak = {}
+
+    @contextmanager
+    def stage(self, name):
+        import tracemalloc
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                self.peak[name] = max(self.peak.get(name, 0), peak)
+
+    def as_dict(self):
+        return {
+            name: {'seconds': round(self.seconds.get(name, 0.0), 6), 'peak_bytes': self.peak.get(name)}
+            for name in STAGES
+        }
+
+
+class BatchProfile:
+    # 汇总一次批处理的分阶段统计，结束时写出 profile.json（逐文件 + 整批）和 profile.csv（逐文件一行）
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.files = []
+
+    def add(self, inp, stats):
+        self.files.append({
+            'file': inp,
+            'pages': stats.get('pages'),
+            'seconds': round(stats.get('seconds', 0.0), 6),
+            'stages': stats['stages'],
+        })
+
+    def summary(self):
+        return self.summarize(self.files)
+
+    @staticmethod
+    def summarize(files):
+        # files: 含 'stages'（StageProfile.as_dict()）的逐文件记录
+        total = {}
+        for name in STAGES:
+            seconds = sum(f['stages'][name]['seconds'] for f in files)
+            peaks = [f['stages'][name]['peak_bytes'] for f in files
+                     if f['stages'][name]['peak_bytes'] is not None]
+            total[name] = {'seconds': round(seconds, 6), 'peak_bytes': max(peaks) if peaks else None}
+        all_seconds = sum(stage['seconds'] for stage in total.values())
+        for stage in total.values():
+            stage['share'] = round(stage['seconds'] / all_seconds, 4) if all_seconds else 0.0
+        return {
+            'files': len(files),
+            'pages': sum(f.get('pages') or 0 for f in files),
+            'stages': total,
+        }
+
+    def save(self):
+        with open(os.path.join(self.out_dir, PROFILE_JSON), 'w', encoding='utf-8') as f:
+            json.dump({'batch': self.summary(), 'files': self.files}, f, ensure_ascii=False, indent=1)
+        with open(os.path.join(self.out_dir, PROFILE_CSV), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'pages', 'seconds']
+                            + [f'{name}_seconds' for name in STAGES]
+                            + [f'{name}_peak_bytes' for name in STAGES])
+            for entry in self.files:
+                writer.writerow([entry['file'], entry['pages'], entry['seconds']]
+                                + [entry['stages'][name]['seconds'] for name in STAGES]
+                                + [entry['stages'][name]['peak_bytes'] for name in STAGES])
+
+
+def format_profile(summary):
+    # 命令行结束时打印的一行分阶段占比
+    parts = []
+    for name in STAGES:
+        stage = summary['stages'][name]
+        text = f"{name} {stage['seconds']:.2f}s ({stage['share']:.0%})"
+        if stage['peak_bytes'] is not None:
+            text += f" 峰值 {stage['peak_bytes'] / (1 << 20):.1f}MB"
+        parts.append(text)
+    return '  '.join(parts)
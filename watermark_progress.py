@@ -0,0 +1,157 @@
+import os
+import json
+import time
+from collections import namedtuple
+
+PROGRESS_LOG_NAME = 'progress_log.jsonl'
+# 页级进度回调的最小间隔（秒），避免几千页的文件把界面/终端刷爆
+STATS_INTERVAL = 0.25
+
+# 整批进度快照：fraction 为 0~1，按输入字节估算（处理中的文件按已盖章页数折算）
+# pages_per_sec / bytes_per_sec / eta（秒）在还没有数据时为 None
+ProgressInfo = namedtuple('ProgressInfo', [
+    'files_done', 'files_total', 'pages_done', 'fraction',
+    'pages_per_sec', 'bytes_per_sec', 'eta',
+])
+
+
+def format_progress(info):
+    # 命令行与界面共用的一行进度文字
+    text = f"{info.files_done}/{info.files_total} 个文件  {info.pages_done} 页"
+    if info.pages_per_sec is not None:
+        text += f"  {info.pages_per_sec:.1f} 页/秒  {info.bytes_per_sec / (1 << 20):.1f} MB/秒"
+    if info.eta is not None:
+        minutes, seconds = divmod(int(info.eta + 0.5), 60)
+        text += f"  剩余 {minutes}:{seconds:02d}"
+    return text
+
+
+class BatchProgress:
+    # 汇总一次批处理的页级进度：各文件逐页回报 (已完成页, 总页数)，整体比例和剩余时间按输入文件大小估算
+    # 每个文件结束时往 progress_log.jsonl 追加一行（页数、字节数、耗时），结束时追加整批汇总，供容量规划使用
+    # 文件边扫描边加入：add() 计入总数，读入后 sized() 补上大小，清单判定无需重做的用 skip() 记为完成；
+    # 扫描结束（discovery_done）前总数还在增长，不给剩余时间
+    def __init__(self, out_dir, files_before, workers):
+        self.log_path = os.path.join(out_dir, PROGRESS_LOG_NAME)
+        self.files_total = files_before
+        self.files_done = files_before  # 之前已完成 / 本次跳过的文件
+        self.files_before = files_before
+        self.workers = workers
+        self.sizes = {}
+        self.unsized = 0         # 已加入、还不知道大小的文件数
+        self.todo_bytes = 0
+        self.discovering = True
+        self.bytes_done = 0
+        self.pages_done = 0      # 已结束文件的页数
+        self.partial = {}        # 处理中的文件 -> (已完成页, 总页数)
+        self.finished = set()
+        self.start = time.perf_counter()
+        self._last_stats = 0.0
+        self._log = None
+
+    def add(self, inp):
+        self.files_total += 1
+        self.unsized += 1
+
+    def sized(self, inp, size):
+        if inp not in self.sizes:
+            self.unsized -= 1
+            self.sizes[inp] = size
+            self.todo_bytes += size
+
+    def skip(self, inp):
+        # 无需处理的文件：按之前已完成计，不参与速度和剩余时间估算
+        if inp in self.sizes:
+            self.todo_bytes -= self.sizes.pop(inp)
+        else:
+            self.unsized -= 1
+        self.files_before += 1
+        self.files_done += 1
+
+    def discovery_done(self):
+        self.discovering = False
+
+    def page(self, inp, page_no, page_count):
+        # 进程池的页级消息可能晚于文件结果到达，已结束的文件直接忽略
+        if inp not in self.finished:
+            self.partial[inp] = (page_no, page_count)
+
+    def file_done(self, inp, status, stats, error=None):
+        # stats: 单文件统计，成功时带 'pages'（以它为准，进程池的最后一条页级消息可能还没到）
+        page_no, page_count = self.partial.pop(inp, (0, 0))
+        if stats.get('pages') is not None:
+            page_no = page_count = stats['pages']
+        seconds = stats.get('seconds')
+        self.finished.add(inp)
+        self.files_done += 1
+        self.pages_done += page_no
+        self.bytes_done += self.sizes.get(inp, 0)
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'file': inp,
+            'status': status,
+            'pages': page_no,
+            'page_count': page_count,
+            'bytes': self.sizes.get(inp, 0),
+            'seconds': None if seconds is None else round(seconds, 4),
+        }
+        if error is not None:
+            entry['error'] = str(error)
+        self._append(entry)
+
+    def due(self):
+        # 距上次回调超过 STATS_INTERVAL 才返回 True
+        now = time.perf_counter()
+        if now - self._last_stats < STATS_INTERVAL:
+            return False
+        self._last_stats = now
+        return True
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.start
+        pages = self.pages_done + sum(n for n, _ in self.partial.values())
+        done_bytes = self.bytes_done + sum(
+            self.sizes.get(inp, 0) * n / total
+            for inp, (n, total) in self.partial.items() if total
+        )
+        todo_files = self.files_total - self.files_before
+        # 还没读到大小的文件按已知文件的平均大小估算
+        todo_bytes = self.todo_bytes
+        if self.unsized > 0 and self.sizes:
+            todo_bytes += self.unsized * self.todo_bytes / len(self.sizes)
+        fraction = 1.0
+        if self.files_total:
+            share = done_bytes / todo_bytes if todo_bytes else 0.0
+            fraction = (self.files_before + todo_files * min(share, 1.0)) / self.files_total
+        pages_per_sec = bytes_per_sec = eta = None
+        if elapsed > 0 and pages:
+            pages_per_sec = pages / elapsed
+            bytes_per_sec = done_bytes / elapsed
+            if bytes_per_sec > 0 and not self.discovering:
+                eta = max(0.0, (todo_bytes - done_bytes) / bytes_per_sec)
+        return ProgressInfo(self.files_done, self.files_total, pages, fraction,
+                            pages_per_sec, bytes_per_sec, eta)
+
+    def close(self, cancelled=False):
+        info = self.snapshot()
+        self._append({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'event': 'batch',
+            'files': self.files_done - self.files_before,
+            'pages': info.pages_done,
+            'bytes': int(self.bytes_done),
+            'seconds': round(time.perf_counter() - self.start, 4),
+            'pages_per_sec': info.pages_per_sec,
+            'bytes_per_sec': info.bytes_per_sec,
+            'workers': self.workers,
+            'cancelled': cancelled,
+        })
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _append(self, entry):
+        if self._log is None:
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._log.flush()
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import dataclasses
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ProcessPoolExecutor
+
+from watermark_engine import add_watermark, add_settings_arguments, settings_from_args, register_font, init_worker
+from watermark_config import (
+    STAMP_MODES, TILE_MAX_COUNT, SIZE_PCT_RANGE, ANGLE_RANGE, parse_color, parse_position, parse_pages,
+    parse_range, check_counts,
+)
+from watermark_preflight import scan, repair
+
+DEFAULT_PORT = 8765
+# 同一批最多合并的请求数，以及第一个请求到达后最多等多久凑批（秒）
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_BATCH_WINDOW = 0.01
+# 排队 + 处理中的请求上限，超出直接返回 503
+DEFAULT_MAX_PENDING = 64
+DEFAULT_MAX_UPLOAD_MB = 200
+CHUNK_SIZE = 256 * 1024
+
+# 请求里允许覆盖的设置（查询参数名 -> (字段名, 解析函数)）；字体和 Logo 路径只能在服务端配置
+# 数值参数限定在界面控件的范围内：一个 h_count × v_count 过大的非平铺请求就能让进程池卡住
+# 数量先按平铺的上限检查，合并设置后再按是否平铺检查一次
+REQUEST_PARAMS = {
+    'text': ('text', str),
+    'alpha': ('alpha', lambda v: parse_range(v, 0, 100) / 100),
+    'h_count': ('h_count', lambda v: parse_range(v, 1, TILE_MAX_COUNT)),
+    'v_count': ('v_count', lambda v: parse_range(v, 1, TILE_MAX_COUNT)),
+    'text_pos': ('text_pos', parse_position),
+    'logo_pos': ('logo_pos', parse_position),
+    'angle': ('angle', lambda v: parse_range(v, *ANGLE_RANGE)),
+    'text_size': ('text_size_pct', lambda v: parse_range(v, *SIZE_PCT_RANGE)),
+    'logo_size': ('logo_size_pct', lambda v: parse_range(v, *SIZE_PCT_RANGE)),
+    'color': ('text_color', parse_color),
+    'stamp_mode': ('stamp_mode', lambda v: _parse_choice(v, STAMP_MODES)),
+    'tile': ('tile', lambda v: _parse_choice(v, ['0', '1']) == '1'),
+    'pages': ('pages', parse_pages),
+    # 栅格化的分辨率、编码和质量沿用服务端设置，请求只能开关
+    'flatten': ('flatten', lambda v: _parse_choice(v, ['0', '1']) == '1'),
+    'logo': ('logo_path', lambda v: _parse_choice(v, ['0']) and ''),  # logo=0 关闭服务端配置的 Logo
+}
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def _parse_choice(value, choices):
+    if value not in choices:
+        raise ValueError(f"应为 {'/'.join(choices)}: {value}")
+    return value
+
+
+def _process_batch(jobs):
+    # 在常驻子进程里依次处理一批请求；字体和水印模板缓存跨请求保留
+    results = []
+    for inp, out, settings in jobs:
+        start = time.perf_counter()
+        try:
+            pages = add_watermark(inp, out, settings)
+        except Exception as e:
+            results.append((None, str(e), time.perf_counter() - start))
+        else:
+            results.append((pages, None, time.perf_counter() - start))
+    return results
+
+
+def _preflight_upload(path):
+    # 在线程里预检上传的文件，可修复的就地修复；返回 Preflight
+    # 服务没有密码，只有空打开密码的加密文件能处理
+    result = scan(path)
+    if result.status == 'repair':
+        try:
+            data = repair(path)
+        except Exception as e:
+            return result._replace(status='damaged', usable=False, detail=f"修复失败: {e}")
+        with open(path, 'wb') as f:
+            f.write(data)
+    return result
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WatermarkService:
+    # 本地 HTTP 水印服务：
+    #   POST /watermark?text=...   请求体为 PDF，返回加好水印的 PDF
+    #   GET  /health               存活检查
+    #   GET  /metrics              计数器（JSON）
+    # 请求先进队列，调度协程把短时间内到达的请求合并成一批交给进程池，同时在跑的批数不超过进程数
+    def __init__(self, settings, workers=1, batch_size=DEFAULT_BATCH_SIZE, batch_window=DEFAULT_BATCH_WINDOW,
+                 max_pending=DEFAULT_MAX_PENDING, max_upload_mb=DEFAULT_MAX_UPLOAD_MB, tmp_dir=None):
+        self.settings = settings
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_pending = max_pending
+        self.max_upload = max_upload_mb << 20
+        self.tmp_dir = tmp_dir
+        self.pending = 0
+        self.started = time.time()
+        self.metrics = {
+            'requests_total': 0, 'responses': {}, 'pages_total': 0, 'bytes_in': 0, 'bytes_out': 0,
+            'batches_total': 0, 'batched_requests': 0, 'processing_seconds': 0.0, 'latency_seconds': 0.0,
+            'rejected_total': 0,
+        }
+        self.pool = None
+        self.queue = None
+        self.server = None
+        self._dispatcher = None
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        register_font(self.settings.font_name, self.settings.font_path)
+        self.work_dir = tempfile.mkdtemp(prefix='pdf_watermark_service_', dir=self.tmp_dir)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                        initargs=(self.settings.font_name, self.settings.font_path))
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.workers)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 进程都在忙时在这里等待，期间到达的请求会并入下一批
+            await self.slots.acquire()
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.metrics['batches_total'] += 1
+            self.metrics['batched_requests'] += len(batch)
+            task = loop.run_in_executor(self.pool, _process_batch, [job for job, _ in batch])
+            task.add_done_callback(lambda t, batch=batch: self._batch_done(t, batch))
+
+    def _batch_done(self, task, batch):
+        self.slots.release()
+        if task.cancelled():
+            return
+        e = task.exception()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if e is not None:
+                future.set_exception(e)
+            else:
+                future.set_result(task.result()[i])
+
+    async def _handle(self, reader, writer):
+        start = time.perf_counter()
+        status = 500
+        try:
+            method, target, headers = await self._read_head(reader)
+            self.metrics['requests_total'] += 1
+            path = urlsplit(target).path
+            if path == '/health':
+                status = await self._send_json(writer, 200, {'status': 'ok'})
+            elif path == '/metrics':
+                status = await self._send_json(writer, 200, self.snapshot())
+            elif path == '/watermark':
+                if method != 'POST':
+                    raise HTTPError(405, "只支持 POST")
+                status = await self._watermark(reader, writer, target, headers)
+            else:
+                raise HTTPError(404, f"未知路径: {path}")
+        except HTTPError as e:
+            status = await self._send_json(writer, e.status, {'error': str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = 499  # 客户端中途断开
+        except Exception as e:
+            # 进程池异常等意外错误：返回 500，服务本身继续运行
+            status = await self._send_json(writer, 500, {'error': repr(e)})
+        finally:
+            self.metrics['responses'][str(status)] = self.metrics['responses'].get(str(status), 0) + 1
+            self.metrics['latency_seconds'] += time.perf_counter() - start
+            writer.close()
+
+    async def _read_head(self, reader):
+        line = (await reader.readline()).decode('latin-1').strip()
+        parts = line.split()
+        if len(parts) != 3:
+            raise HTTPError(400, "无效的请求行")
+        headers = {}
+        while True:
+            header = (await reader.readline()).decode('latin-1')
+            if header in ('\r\n', '\n', ''):
+                break
+            name, _, value = header.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return parts[0].upper(), parts[1], headers
+
+    def _request_settings(self, target):
+        changes = {}
+        for key, value in parse_qsl(urlsplit(target).query):
+            if key not in REQUEST_PARAMS:
+                raise HTTPError(400, f"未知参数: {key}")
+            field, parse = REQUEST_PARAMS[key]
+            try:
+                changes[field] = parse(value)
+            except (ValueError, argparse.ArgumentTypeError) as e:
+                raise HTTPError(400, f"参数 {key} 无效: {e}")
+        settings = dataclasses.replace(self.settings, **changes)
+        try:
+            check_counts(settings.h_count, settings.v_count, settings.tile)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if not settings.text:
+            raise HTTPError(400, "需要 text 参数")
+        return settings
+
+    async def _watermark(self, reader, writer, target, headers):
+        settings = self._request_settings(target)
+        if 'content-length' not in headers:
+            raise HTTPError(411, "需要 Content-Length")
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise HTTPError(400, "无效的 Content-Length")
+        if length > self.max_upload:
+            raise HTTPError(413, f"上传超过 {self.max_upload >> 20} MB")
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, "服务繁忙，请稍后重试")
+        self.pending += 1
+        fd, inp = tempfile.mkstemp(suffix='.pdf', dir=self.work_dir)
+        out = inp[:-4] + '_wm.pdf'
+        try:
+            # 上传按块写入临时文件，不整份留在内存里
+            with os.fdopen(fd, 'wb') as f:
+                remaining = length
+                while remaining:
+                    chunk = await reader.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b'', remaining)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            self.metrics['bytes_in'] += length
+            # 加密/损坏的文件在预检时就返回 422，不占用进程池
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, _preflight_upload, inp)
+            if not result.usable:
+                self.metrics['rejected_total'] += 1
+                raise HTTPError(422, f"{result.status}: {result.detail}")
+            future = loop.create_future()
+            await self.queue.put(((inp, out, settings), future))
+            pages, error, seconds = await future
+            self.metrics['processing_seconds'] += seconds
+            if error is not None:
+                raise HTTPError(422, error)
+            self.metrics['pages_total'] += pages
+            return await self._send_file(writer, out)
+        finally:
+            self.pending -= 1
+            for path in (inp, out):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    async def _send_head(self, writer, status, content_type, length):
+        writer.write(f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+                     f"Content-Type: {content_type}\r\nContent-Length: {length}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1'))
+
+    async def _send_json(self, writer, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        await self._send_head(writer, status, 'application/json; charset=utf-8', len(body))
+        writer.write(body)
+        await writer.drain()
+        return status
+
+    async def _send_file(self, writer, path):
+        # 分块读出并发送，读文件放到线程池里，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(path)
+        await self._send_head(writer, 200, 'application/pdf', size)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        self.metrics['bytes_out'] += size
+        return 200
+
+    def snapshot(self):
+        data = dict(self.metrics, responses=dict(self.metrics['responses']))
+        data.update(
+            uptime_seconds=round(time.time() - self.started, 3),
+            workers=self.workers,
+            pending=self.pending,
+            queued=self.queue.qsize() if self.queue is not None else 0,
+        )
+        return data
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="本地 HTTP 水印服务：POST PDF 到 /watermark，返回加好水印的 PDF")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址（默认只监听本机）")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="监听端口")
+    add_settings_arguments(parser)
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="常驻进程数")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="每批最多合并的请求数")
+    parser.add_argument('--batch-window', type=float, default=DEFAULT_BATCH_WINDOW,
+                        help="凑批等待时间（秒）")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help="排队 + 处理中的请求上限，超出返回 503")
+    parser.add_argument('--max-upload', type=int, default=DEFAULT_MAX_UPLOAD_MB, metavar='MB',
+                        help="单个上传的大小上限")
+    return parser
+
+
+async def serve(service, host, port):
+    host, port = await service.start(host, port)
+    print(f"水印服务已启动: http://{host}:{port}/watermark （/health, /metrics），Ctrl+C 停止", flush=True)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    # --text 作为默认文字，每个请求可以用 text 参数覆盖
+    args.text = args.text or ''
+    service = WatermarkService(
+        settings_from_args(args), workers=args.workers, batch_size=args.batch_size,
+        batch_window=args.batch_window, max_pending=args.max_pending, max_upload_mb=args.max_upload,
+    )
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        print("服务已停止", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
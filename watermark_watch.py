@@ -0,0 +1,275 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    # 可选：watchdog 提供 inotify / FSEvents / ReadDirectoryChangesW 事件；未安装时定时扫描目录
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+from watermark_config import A4
+from watermark_engine import (
+    DEFAULT_OUTPUT_DIR, register_font, clear_cache, get_watermark_template, output_path,
+    add_settings_arguments, settings_from_args, init_worker, _pool_add_watermark,
+)
+from watermark_jobs import BatchCancelled
+from watermark_manifest import Manifest, settings_fingerprint
+
+# 文件大小和修改时间保持不变多少秒后才认为已写完
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_SECONDS = 1.0
+# 待处理队列上限：队列满时监视线程暂停入队，新文件留到有空位再排
+DEFAULT_QUEUE_SIZE = 64
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.touch(event.src_path)
+
+    def on_modified(self, event):
+        self.watcher.touch(event.src_path)
+
+    def on_moved(self, event):
+        self.watcher.touch(event.dest_path)
+
+
+class FolderWatcher:
+    # 监视若干输入目录（不递归），把写完的 PDF 放进有界队列
+    # 有 watchdog 时按文件系统事件只检查变动的文件，否则每 poll 秒扫描一次目录；
+    # 两种方式都要等文件 settle 秒内大小和修改时间不变、且能以只读方式打开，才算写完
+    def __init__(self, dirs, ready_queue, settle=DEFAULT_SETTLE_SECONDS, poll=DEFAULT_POLL_SECONDS,
+                 exclude=None, use_events=True):
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self.queue = ready_queue
+        self.settle = settle
+        self.poll = poll
+        self.exclude = os.path.abspath(exclude) if exclude else None
+        self.use_events = use_events and Observer is not None
+        self.seen = {}      # 路径 -> ((大小, mtime), 最近一次变化的时间)
+        self.queued = {}    # 路径 -> 已入队的 (大小, mtime)，同一版本只入队一次
+        self.dirty = set()  # 事件模式下有变动、待检查的路径
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.observer = None
+
+    def touch(self, path):
+        if path.lower().endswith('.pdf'):
+            with self.lock:
+                self.dirty.add(os.path.abspath(path))
+
+    def _scan(self):
+        for folder in self.dirs:
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            for name in names:
+                if name.lower().endswith('.pdf'):
+                    yield os.path.join(folder, name)
+
+    def _ready(self, path, now):
+        # 返回 True 表示文件已写完、且这个版本还没入过队
+        if self.exclude and os.path.dirname(path) == self.exclude:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.seen.pop(path, None)
+            self.queued.pop(path, None)
+            return False
+        signature = (st.st_size, st.st_mtime_ns)
+        previous = self.seen.get(path)
+        if previous is None or previous[0] != signature:
+            self.seen[path] = (signature, now)
+            return False
+        if now - previous[1] < self.settle or self.queued.get(path) == signature:
+            return False
+        try:
+            # Windows 上写入方通常独占文件，能打开说明复制已结束
+            with open(path, 'rb'):
+                pass
+        except OSError:
+            return False
+        self.queued[path] = signature
+        return True
+
+    def _run(self):
+        # 事件模式：启动时扫描一次已有文件，之后只检查有事件的文件和尚未稳定的文件
+        candidates = set(self._scan())
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if self.use_events:
+                with self.lock:
+                    candidates |= self.dirty
+                    self.dirty.clear()
+            else:
+                candidates = set(self._scan())
+            waiting = set()
+            for path in sorted(candidates):
+                if self._ready(path, now):
+                    # 队列满时在这里阻塞，形成背压
+                    while not self.stop_event.is_set():
+                        try:
+                            self.queue.put(path, timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
+                elif path in self.seen and self.queued.get(path) != self.seen[path][0]:
+                    waiting.add(path)
+            if self.use_events:
+                candidates = waiting
+            self.stop_event.wait(min(self.poll, self.settle / 2) if waiting else self.poll)
+
+    def start(self):
+        if self.use_events:
+            self.observer = Observer()
+            handler = _EventHandler(self)
+            for folder in self.dirs:
+                self.observer.schedule(handler, folder, recursive=False)
+            self.observer.start()
+        self.thread = threading.Thread(target=self._run, name='folder-watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def _init_watch_worker(settings, cancel):
+    # 常驻进程：字体只注册一次，并预先生成 A4 纵向的水印模板，第一个文件也不用等渲染
+    init_worker(settings.font_name, settings.font_path, cancel)
+    get_watermark_template(settings, (0, 0) + A4 + (0,))
+
+
+def watch(dirs, out_dir, settings, workers=1, settle=DEFAULT_SETTLE_SECONDS, poll=DEFAULT_POLL_SECONDS,
+          queue_size=DEFAULT_QUEUE_SIZE, stop=None, cancel=None, on_done=None, use_events=True):
+    # 常驻监视：新 PDF 写完后几秒内由常驻进程池加上水印，输出到 out_dir
+    # stop（threading.Event）置位后停止接收新文件、等进行中的文件完成后返回；
+    # cancel（multiprocessing.Event）置位时进行中的文件也在当前页停下；Ctrl+C（KeyboardInterrupt）时由这里置位，
+    # 进程池退出前进行中的文件就已停下，不必等它们处理完
+    # on_done(输入, 异常或 None, 耗时秒数) 每处理完一个文件回调一次（被取消的文件不回调）
+    os.makedirs(out_dir, exist_ok=True)
+    stop = stop or threading.Event()
+    register_font(settings.font_name, settings.font_path)
+    clear_cache()
+    manifest = Manifest(out_dir)
+    fingerprint = settings_fingerprint(settings)
+    ready = queue.Queue(maxsize=queue_size)
+    watcher = FolderWatcher(dirs, ready, settle, poll, exclude=out_dir, use_events=use_events)
+    log_file = os.path.join(out_dir, 'error_log.txt')
+    in_flight = {}  # Future -> (输入, 摘要, 提交时间)
+
+    def finish(done):
+        for future in done:
+            inp, digest, started = in_flight.pop(future)
+            out = output_path(inp, out_dir)
+            if future.cancelled():
+                continue
+            e = future.exception()
+            if isinstance(e, (BatchCancelled, KeyboardInterrupt)):
+                continue
+            if e is None:
+                manifest.record(inp, out, digest, fingerprint)
+            else:
+                manifest.forget(out)
+                with open(log_file, 'a', encoding='utf-8') as log:
+                    log.write(f"{os.path.basename(inp)} failed: {e}\n")
+            manifest.save()
+            if on_done is not None:
+                on_done(inp, e, time.monotonic() - started)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_watch_worker,
+                             initargs=(settings, cancel)) as pool:
+        watcher.start()
+        try:
+            while not stop.is_set():
+                # 进程池里最多 workers 个文件在跑，其余留在有界队列里
+                if len(in_flight) >= workers:
+                    done, _ = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+                    finish(done)
+                    continue
+                try:
+                    inp = ready.get(timeout=0.5)
+                except queue.Empty:
+                    finish([f for f in in_flight if f.done()])
+                    continue
+                out = output_path(inp, out_dir)
+                try:
+                    digest = manifest.input_digest(inp, out)
+                except OSError:
+                    continue  # 入队后又被移走/删除
+                # 重启后目录里已处理过、内容和设置都没变的文件直接跳过
+                if manifest.is_current(inp, out, digest, fingerprint):
+                    continue
+                future = pool.submit(_pool_add_watermark, inp, out, settings)
+                in_flight[future] = (inp, digest, time.monotonic())
+        except KeyboardInterrupt:
+            if cancel is not None:
+                cancel.set()
+            raise
+        finally:
+            watcher.stop()
+            finish(wait(in_flight).done)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="监视文件夹：新 PDF 写完后自动添加水印（常驻运行，Ctrl+C 停止）")
+    parser.add_argument('inputs', nargs='+', help="要监视的文件夹")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT_DIR, help="输出目录")
+    add_settings_arguments(parser)
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="常驻进程数")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="文件大小/修改时间保持不变多少秒后才处理")
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS, help="扫描/检查间隔（秒）")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help="待处理队列上限")
+    parser.add_argument('--no-events', action='store_true',
+                        help="不用文件系统事件（watchdog），改为定时扫描目录（适合网络共享盘）")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if not args.text:
+        parser.error("需要指定 --text")
+    missing = [d for d in args.inputs if not os.path.isdir(d)]
+    if missing:
+        parser.error(f"不是文件夹: {', '.join(missing)}")
+    settings = settings_from_args(args)
+    cancel = multiprocessing.Event()
+
+    def on_done(inp, e, seconds):
+        if e is None:
+            print(f"{os.path.basename(inp)} -> {os.path.basename(output_path(inp, args.output))} ({seconds:.2f}s)", flush=True)
+        else:
+            print(f"{os.path.basename(inp)} failed: {e}", file=sys.stderr, flush=True)
+
+    mode = "文件系统事件" if Observer is not None and not args.no_events else "定时扫描"
+    print(f"正在监视 {', '.join(args.inputs)}（{mode}），输出到 {args.output}，Ctrl+C 停止", flush=True)
+    try:
+        watch(args.inputs, args.output, settings, workers=args.workers, settle=args.settle, poll=args.poll,
+              queue_size=args.queue_size, cancel=cancel, on_done=on_done, use_events=not args.no_events)
+    except KeyboardInterrupt:
+        print("已停止监视", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,88 +1,244 @@
 import os
 import sys
-from io import BytesIO
-from PIL import Image
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfbase.pdfmetrics import stringWidth
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.colors import Color
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+import multiprocessing
+from collections import OrderedDict
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QPushButton, QLineEdit,
     QComboBox, QSpinBox, QSlider, QProgressBar, QFileDialog,
     QHBoxLayout, QVBoxLayout, QSplitter, QScrollArea, QMessageBox,
-    QGroupBox, QFormLayout, QSizePolicy, QColorDialog
+    QGroupBox, QFormLayout, QSizePolicy, QColorDialog, QCheckBox
 )
-from PyQt5.QtGui import QPixmap, QPainter, QFontDatabase, QFont, QFontMetrics, QColor
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-
-# 字体配置
-FONT_OPTIONS = {
-    "微软雅黑": ("MicrosoftYaHei", "C:/Windows/Fonts/msyh.ttc"),
-    "宋体": ("SimSun", "C:/Windows/Fonts/simsun.ttc"),
-    "黑体": ("SimHei", "C:/Windows/Fonts/simhei.ttf"),
-    "楷体": ("KaiTi", "C:/Windows/Fonts/simkai.ttf"),
-    "仿宋": ("FangSong", "C:/Windows/Fonts/simfang.ttf"),
-    "Arial": ("Arial", "C:/Windows/Fonts/arial.ttf"),
-    "Times New Roman": ("TimesNewRoman", "C:/Windows/Fonts/times.ttf"),
-    "Courier New": ("CourierNew", "C:/Windows/Fonts/cour.ttf")
-}
+from PyQt5.QtGui import QPixmap, QImage, QPainter, QFontDatabase, QFont, QFontMetrics, QColor
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, QSize, pyqtSignal, pyqtSlot
+
+# 启动时只导入轻量模块，窗口先出来；PyPDF2 / reportlab 在开始处理时、PyMuPDF 在预览线程里才导入
+from watermark_config import (
+    A4, POSITIONS, DEFAULT_OUTPUT_DIR, QUARANTINE_NAME, QUARANTINE_DIR, GRID_MAX_COUNT, TILE_MAX_COUNT,
+    SIZE_PCT_RANGE, ANGLE_RANGE, WatermarkSettings, PdfTree, PageSelection,
+)
+from watermark_fonts import FONT_OPTIONS, available_fonts, register_font, resolve_font
+from watermark_jobs import pending_job
+from watermark_progress import format_progress
+
+# 进度条按千分比显示：单个几千页的文件也能逐页推进
+PROGRESS_STEPS = 1000
 
 class WatermarkThread(QThread):
-    progress = pyqtSignal(int)
+    progress = pyqtSignal(object)  # ProgressInfo：逐页更新的整批进度、速度和剩余时间
     finished = pyqtSignal(str)
+    failed = pyqtSignal(str)       # 批处理整体出错（单个文件的错误记在 error_log.txt，不走这里）
 
-    def __init__(
-        self, pdf_list, text, font_name, logo_path,
-        alpha, h_count, v_count, text_pos, logo_pos,
-        angle, text_size_pct, logo_size_pct, text_color, parent=None
-    ):
+    def __init__(self, pdf_list=None, settings=None, workers=1, force=False,
+                 resume=False, passwords=(), allow_weaker=False, parent=None):
         super().__init__(parent)
         self.pdf_list       = pdf_list
-        self.text           = text
-        self.font_name      = font_name
-        self.logo_path      = logo_path
-        self.alpha          = alpha
-        self.h_count        = h_count
-        self.v_count        = v_count
-        self.text_pos       = text_pos
-        self.logo_pos       = logo_pos
-        self.angle          = angle
-        self.text_size_pct  = text_size_pct
-        self.logo_size_pct  = logo_size_pct
-        self.text_color     = text_color
-        self.parent         = parent
+        self.settings       = settings
+        self.workers        = workers
+        self.force          = force
+        self.resume         = resume  # True：继续输出目录里上次未完成的任务
+        self.passwords      = list(passwords)  # 加密 PDF 的密码，只在内存里
+        self.allow_weaker   = allow_weaker     # 接受比原文件弱的重新加密（AES -> RC4-128 等）
+        # 进程池子进程也要能看到取消标志，所以用 multiprocessing.Event
+        self.cancel_event   = multiprocessing.Event()
+        self.result         = None
+
+    def cancel(self):
+        self.cancel_event.set()
 
     def run(self):
-        out_dir = os.path.join(os.path.expanduser('~'), 'Desktop', 'pdf_watermark_output')
-        os.makedirs(out_dir, exist_ok=True)
-        log_file = os.path.join(out_dir, 'error_log.txt')
-        with open(log_file, 'w', encoding='utf-8') as log:
-            for idx, inp in enumerate(self.pdf_list, 1):
-                fn = os.path.basename(inp)
-                out = os.path.join(out_dir, f"wm_{fn}")
-                try:    self.parent._add_watermark(
-                        inp, out,
-                        self.text, self.font_name,
-                        self.logo_path, self.alpha,
-                        self.h_count, self.v_count,
-                        self.text_pos, self.logo_pos,
-                        self.angle,
-                        self.text_size_pct, self.logo_size_pct, self.text_color
-                    )
-                except Exception as e:
-                    log.write(f"{fn} failed: {e}\n")
-                self.progress.emit(idx)
-        self.finished.emit(out_dir)
+        from watermark_engine import run_batch, resume_batch, set_passwords
+        out_dir = DEFAULT_OUTPUT_DIR
+        # 检查点丢失/损坏、输出目录没有写权限、字体注册失败等都在逐文件处理之外抛出；
+        # 无论如何都要发出 finished，否则界面一直停在运行状态
+        try:
+            set_passwords(self.passwords, self.allow_weaker)
+            if self.resume:
+                self.result = resume_batch(out_dir, on_stats=self.progress.emit,
+                                           cancel=self.cancel_event, workers=self.workers)
+            else:
+                self.result = run_batch(self.pdf_list, out_dir, self.settings,
+                                        workers=self.workers, on_stats=self.progress.emit,
+                                        force=self.force, cancel=self.cancel_event)
+        except Exception as e:
+            self.failed.emit(f"{type(e).__name__}: {e}")
+        finally:
+            self.finished.emit(out_dir)
+
+# 预览防抖：滑块拖动时的连续变化合并成一次渲染
+PREVIEW_DEBOUNCE_MS = 50
+# 预览页面的栅格化分辨率及缓存页数（按 文件、修改时间、页码 缓存，改设置只重画水印层）
+PREVIEW_PAGE_DPI = 96
+PREVIEW_PAGE_CACHE_SIZE = 16
+
+_pymupdf = False  # 尚未尝试导入
+
+
+def _load_pymupdf():
+    # 可选：PyMuPDF，用于在预览里显示真实页面；未安装时返回 None，预览空白 A4
+    # 导入要 0.2 秒左右，放到预览线程第一次渲染 PDF 页面时再做
+    global _pymupdf
+    if _pymupdf is False:
+        try:
+            import pymupdf
+        except ImportError:
+            pymupdf = None
+        _pymupdf = pymupdf
+    return _pymupdf
+
+def _preview_selected(spec, index, page):
+    # 预览页是否在“盖章页面”里；写法有误时照常画水印，开始处理时再提示
+    if not spec:
+        return True
+    try:
+        selection = PageSelection(spec)
+    except ValueError:
+        return True
+    count, size = (page[3], (page[1], page[2])) if page else (1, A4)
+    return selection.wants(min(index + 1, count), count, size)
+
+class PreviewWorker(QObject):
+    # 在后台线程把水印画到 QImage 上（QPixmap 只能在界面线程使用），界面线程只负责显示
+    rendered = pyqtSignal(int, QImage, int)  # 序号、预览图、PDF 总页数（空白 A4 时为 0）
+
+    def __init__(self):
+        super().__init__()
+        self.logo_path  = ''
+        self.logo_cache = {}  # 尺寸 -> 缩放好的 Logo；None -> 解码后的原图
+        self.page_cache = OrderedDict()  # (路径, mtime, 页码) -> (页面图, 宽 pt, 高 pt, 总页数)
+
+    def _page(self, path, index):
+        # 低分辨率渲染一页 PDF；没有 PyMuPDF、没选 PDF 或渲染失败时返回 None，退回空白 A4
+        pymupdf = _load_pymupdf() if path else None
+        if pymupdf is None:
+            return None
+        try:
+            key = (path, os.stat(path).st_mtime_ns, index)
+            if key in self.page_cache:
+                self.page_cache.move_to_end(key)
+                return self.page_cache[key]
+            with pymupdf.open(path) as doc:
+                count = doc.page_count
+                page = doc[min(index, count - 1)]
+                zoom = PREVIEW_PAGE_DPI / 72
+                pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+                image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888).copy()
+                entry = (image, page.rect.width, page.rect.height, count)
+        except Exception:
+            return None
+        self.page_cache[key] = entry
+        if len(self.page_cache) > PREVIEW_PAGE_CACHE_SIZE:
+            self.page_cache.popitem(last=False)
+        return entry
+
+    def _logo(self, path, size):
+        # 解码和平滑缩放的结果按尺寸缓存，换 Logo 时整体清空
+        if path != self.logo_path:
+            self.logo_path, self.logo_cache = path, {}
+        if None not in self.logo_cache:
+            self.logo_cache[None] = QImage(path)
+        logo = self.logo_cache[None]
+        if logo.isNull():
+            return logo
+        if size not in self.logo_cache:
+            self.logo_cache[size] = logo.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return self.logo_cache[size]
+
+    @pyqtSlot(int, object)
+    def render(self, seq, p):
+        page = self._page(p['pdf_path'], p['page_index'])
+        # 页面尺寸 pt 转像素（/Rotate 已由 PyMuPDF 算进页面尺寸）
+        w_pt, h_pt = (page[1], page[2]) if page else A4
+        scale = 0.4  # 初始缩放比例
+        w_px, h_px = int(w_pt * scale), int(h_pt * scale)
+        # 计算缩放比例，保持宽高比例
+        scale = min(p['label_size'].width() / w_px, p['label_size'].height() / h_px)
+        # 根据缩放比例调整尺寸
+        w_px, h_px = max(1, int(w_px * scale)), max(1, int(h_px * scale))
+
+        image = QImage(w_px, h_px, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.white)
+        # 创建画笔对象
+        painter = QPainter(image)
+        if page:
+            painter.drawImage(0, 0, page[0].scaled(w_px, h_px, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        # 不盖章的页面按原样预览
+        if not _preview_selected(p['pages'], p['page_index'], page):
+            painter.end()
+            self.rendered.emit(seq, image, page[3] if page else 0)
+            return
+        painter.setOpacity(p['alpha'])
+        painter.setPen(p['color'])
+
+        # 动态字体大小：字体大小 = 预览画布宽度 * 比例
+        font_ratio = 0.05  # 5%，可以根据你界面自行调整
+        base_size = w_px * font_ratio
+        font_size = max(1, int(base_size * (p['text_size_pct'] / 100.0)))
+        font = QFont(p['font_family'], font_size)
+        painter.setFont(font)
+
+        # 取字体度量
+        metrics = QFontMetrics(font)
+        text = p['text']
+        text_width = metrics.horizontalAdvance(text)
+        text_height = metrics.height()
+        h_count, v_count = p['h_count'], p['v_count']
+
+        # —— 定义偏移量表 ——
+        offsets = {
+            '左上': (-w_px/4, -h_px/4),
+            '右上': ( w_px/4, -h_px/4),
+            '左下': (-w_px/4,  h_px/4),
+            '右下': ( w_px/4,  h_px/4),
+            '中心': (0, 0),
+        }
+
+        # 绘制文本水印；平铺时按单元间距铺满整个预览，伸出边缘的单元也画上
+        if p['tile']:
+            x_step, y_step = w_px / h_count, h_px / v_count
+            reach = text_width + text_height
+            nx, ny = int(reach // x_step) + 1, int(reach // y_step) + 1
+            cells = [((i + 0.5) * x_step, (j + 0.5) * y_step)
+                     for i in range(-nx, h_count + nx) for j in range(-ny, v_count + ny)]
+        else:
+            cells = [(i * w_px / (h_count + 1), j * h_px / (v_count + 1))
+                     for i in range(1, h_count + 1) for j in range(1, v_count + 1)]
+        for x, y in cells:
+            ox, oy = offsets[p['text_pos']]
+            painter.save()
+            painter.translate(int(x + ox), int(y + oy))
+            painter.rotate(p['angle'])
+            # 以文字中心为原点，向左/向上偏移一半宽高
+            painter.drawText(
+                int(-text_width / 2),
+                int(text_height / 2),
+                text
+            )
+            painter.restore()
+
+        # 绘制 Logo 水印
+        if p['logo_path']:
+            logo = self._logo(p['logo_path'], max(1, int(100 * scale * (p['logo_size_pct'] / 100.0))))
+            if not logo.isNull():
+                coords = {
+                    '左上': (0, 0), '右上': (w_px - logo.width(), 0),
+                    '左下': (0, h_px - logo.height()), '右下': (w_px - logo.width(), h_px - logo.height()),
+                    '中心': ((w_px - logo.width()) // 2, (h_px - logo.height()) // 2)
+                }
+                x_l, y_l = coords[p['logo_pos']]
+                painter.drawImage(x_l, y_l, logo)
+
+        painter.end()
+        self.rendered.emit(seq, image, page[3] if page else 0)
 
 class PDFWatermarkerApp(QMainWindow):
+    preview_requested = pyqtSignal(int, object)
+
     def __init__(self):
         super().__init__()
         self.resize(1000, 700)
         self.folder_path     = ''
+        self.dropped_file    = None
         self.logo_path       = ''
         self.font_cache      = {}
         self.text_size_pct   = 100  # 文字大小百分比
@@ -91,7 +247,9 @@ class PDFWatermarkerApp(QMainWindow):
         self.worker          = None
 
         self._init_ui()
+        self._init_preview_worker()
         self._connect_signals()
+        self._set_running(False)
         self.update_preview()
         self.setAcceptDrops(True)
 
@@ -221,7 +379,8 @@ class PDFWatermarkerApp(QMainWindow):
         # 字体选择
         hlayout_font_logo.addWidget(QLabel("🖋️ 字体"))
         self.combo_font = QComboBox()
-        self.combo_font.addItems(FONT_OPTIONS.keys())
+        # 只列出本机找得到的字体；一个都找不到时列出全部，开始处理时再提示怎样指定字体目录
+        self.combo_font.addItems(available_fonts() or list(FONT_OPTIONS))
         self.combo_font.setFixedHeight(30)
         self.combo_font.setStyleSheet(
             "border:1px solid #d9d9d9; border-radius:4px; padding:4px;"
@@ -250,7 +409,7 @@ class PDFWatermarkerApp(QMainWindow):
         hlayout_size = QHBoxLayout()
         label_size = QLabel("🖱️ 文字大小")
         self.slider_text_size = QSlider(Qt.Horizontal)
-        self.slider_text_size.setRange(10, 200)
+        self.slider_text_size.setRange(*SIZE_PCT_RANGE)
         self.slider_text_size.setValue(self.text_size_pct)
         hlayout_size.addWidget(label_size)
         hlayout_size.addWidget(self.slider_text_size)
@@ -270,7 +429,7 @@ class PDFWatermarkerApp(QMainWindow):
         hlayout_logo = QHBoxLayout()
         label_logo_size = QLabel("🖱️ Logo 大小")
         self.slider_logo_size = QSlider(Qt.Horizontal)
-        self.slider_logo_size.setRange(10, 200)
+        self.slider_logo_size.setRange(*SIZE_PCT_RANGE)
         self.slider_logo_size.setValue(self.logo_size_pct)
         hlayout_logo.addWidget(label_logo_size)
         hlayout_logo.addWidget(self.slider_logo_size)
@@ -299,11 +458,11 @@ class PDFWatermarkerApp(QMainWindow):
         # 🔢 水印数量
         layout_cnt = QHBoxLayout()
         self.spin_h = QSpinBox();
-        self.spin_h.setRange(1, 10);
+        self.spin_h.setRange(1, GRID_MAX_COUNT);
         self.spin_h.setValue(1);
         self.spin_h.setFixedWidth(60)
         self.spin_v = QSpinBox();
-        self.spin_v.setRange(1, 10);
+        self.spin_v.setRange(1, GRID_MAX_COUNT);
         self.spin_v.setValue(1);
         self.spin_v.setFixedWidth(60)
         layout_cnt.addWidget(QLabel("↔️ 横行数量"));
@@ -311,24 +470,42 @@ class PDFWatermarkerApp(QMainWindow):
         layout_cnt.addSpacing(12)
         layout_cnt.addWidget(QLabel("↕️ 纵行数量"));
         layout_cnt.addWidget(self.spin_v)
+        layout_cnt.addSpacing(12)
+        # 🧱 平铺：文字作为图案单元铺满整页
+        self.chk_tile = QCheckBox("🧱 平铺")
+        layout_cnt.addWidget(self.chk_tile)
         layout_all.addLayout(layout_cnt)
 
         # 🚩 水印位置
         layout_pos = QFormLayout()
         self.combo_text_pos = QComboBox();
-        self.combo_text_pos.addItems(["中心", "左上", "右上", "左下", "右下"])
+        self.combo_text_pos.addItems(POSITIONS)
         self.combo_logo_pos = QComboBox();
-        self.combo_logo_pos.addItems(["中心", "左上", "右上", "左下", "右下"])
+        self.combo_logo_pos.addItems(POSITIONS)
         self.combo_text_pos.setFixedHeight(25);
         self.combo_logo_pos.setFixedHeight(25)
         layout_pos.addRow("📝 文本位置", self.combo_text_pos)
         layout_pos.addRow("📊 Logo 位置", self.combo_logo_pos)
+        # 📄 只给部分页面盖章，其余页面原样输出
+        self.edit_pages = QLineEdit()
+        self.edit_pages.setPlaceholderText("全部页面；如 1,last:1  1-3  odd  every:3  landscape  a4")
+        self.edit_pages.setFixedHeight(25)
+        layout_pos.addRow("📄 盖章页面", self.edit_pages)
+        # 🔑 加密 PDF 的密码：解密后盖章，输出按原权限重新加密；不保存，也不随“清空设置”以外的操作变化
+        self.edit_password = QLineEdit()
+        self.edit_password.setEchoMode(QLineEdit.Password)
+        self.edit_password.setPlaceholderText("加密 PDF 的密码，多个用空格分隔（不保存）")
+        self.edit_password.setFixedHeight(25)
+        layout_pos.addRow("🔑 PDF 密码", self.edit_password)
+        # 默认隔离重新加密会变弱的文件（AES 只能改用 RC4-128；只有权限密码时打开密码会变），勾选后放行并记入 error_log.txt
+        self.chk_allow_weaker = QCheckBox("接受较弱的重新加密（AES→RC4、只有权限密码）")
+        layout_pos.addRow("", self.chk_allow_weaker)
         layout_all.addLayout(layout_pos)
 
         # 🔄 旋转角度
         layout_ang = QHBoxLayout()
         self.spin_angle = QSpinBox();
-        self.spin_angle.setRange(-90, 90);
+        self.spin_angle.setRange(*ANGLE_RANGE);
         self.spin_angle.setValue(20);
         self.spin_angle.setFixedWidth(100)
         layout_ang.addWidget(QLabel("🔺 角度 (°):"))
@@ -338,16 +515,61 @@ class PDFWatermarkerApp(QMainWindow):
         # 添加到主布局
         panel_layout.addWidget(gb_layout)
 
+        # ⚙️ 并行进程数
+        layout_workers = QHBoxLayout()
+        self.spin_workers = QSpinBox()
+        self.spin_workers.setRange(1, os.cpu_count() or 1)
+        self.spin_workers.setValue(os.cpu_count() or 1)
+        self.spin_workers.setFixedWidth(60)
+        layout_workers.addWidget(QLabel("⚙️ 并行进程数"))
+        layout_workers.addWidget(self.spin_workers)
+        layout_workers.addStretch()
+        # ♻️ 输入和设置都没变的文件不再重复处理
+        self.chk_skip_unchanged = QCheckBox("♻️ 跳过未变化的文件")
+        self.chk_skip_unchanged.setChecked(True)
+        layout_workers.addWidget(self.chk_skip_unchanged)
+        # 📁 子文件夹里的 PDF 一并处理，输出目录保持同样的子目录结构
+        self.chk_recursive = QCheckBox("📁 包含子文件夹")
+        self.chk_recursive.setChecked(True)
+        layout_workers.addWidget(self.chk_recursive)
+        panel_layout.addLayout(layout_workers)
+
+        # 🖨️ 栅格化：每页连同水印渲染成图片，水印无法用 PDF 编辑器删除（需要 PyMuPDF）
+        layout_flatten = QHBoxLayout()
+        self.chk_flatten = QCheckBox("🖨️ 栅格化（水印不可删除）")
+        self.spin_flatten_dpi = QSpinBox()
+        self.spin_flatten_dpi.setRange(72, 600)
+        self.spin_flatten_dpi.setValue(150)
+        self.spin_flatten_dpi.setFixedWidth(60)
+        self.spin_flatten_dpi.setEnabled(False)
+        layout_flatten.addWidget(self.chk_flatten)
+        layout_flatten.addWidget(QLabel("DPI"))
+        layout_flatten.addWidget(self.spin_flatten_dpi)
+        layout_flatten.addStretch()
+        panel_layout.addLayout(layout_flatten)
+
         # 操作按钮 & 进度条
         self.btn_start = QPushButton("▶️ 开始添加"); self.btn_start.setFixedHeight(34); self.btn_start.setStyleSheet(btn_style)
         self.btn_clear = QPushButton("🔙 重置设置");     self.btn_clear.setFixedHeight(34); self.btn_clear.setStyleSheet(btn_style)
         self.progress  = QProgressBar();              self.progress.setFixedHeight(14); self.progress.setStyleSheet(progress_style)
+        self.progress.setMaximum(PROGRESS_STEPS)
+        self.lbl_stats = QLabel()
+        self.lbl_stats.setStyleSheet("color: #333333;")
         btn_layout = QHBoxLayout()
         btn_layout.setSpacing(8)  # 两按钮之间的间距
         btn_layout.addWidget(self.btn_clear)
         btn_layout.addWidget(self.btn_start)
         panel_layout.addLayout(btn_layout)
+        # 取消 / 继续上次未完成的批处理
+        self.btn_resume = QPushButton("⏯️ 继续上次"); self.btn_resume.setFixedHeight(34); self.btn_resume.setStyleSheet(btn_style)
+        self.btn_cancel = QPushButton("⏹️ 取消");     self.btn_cancel.setFixedHeight(34); self.btn_cancel.setStyleSheet(btn_style)
+        job_layout = QHBoxLayout()
+        job_layout.setSpacing(8)
+        job_layout.addWidget(self.btn_resume)
+        job_layout.addWidget(self.btn_cancel)
+        panel_layout.addLayout(job_layout)
         panel_layout.addWidget(self.progress)
+        panel_layout.addWidget(self.lbl_stats)
         panel_layout.addStretch()
         splitter.addWidget(panel)
 
@@ -365,6 +587,19 @@ class PDFWatermarkerApp(QMainWindow):
         lbl_preview.setAlignment(Qt.AlignCenter)
         lbl_preview.setStyleSheet("font: bold 18px 'Microsoft YaHei'; color: #096dd9;")
         layout_preview.addWidget(lbl_preview)
+        # 📄 预览页：显示所选文件（或文件夹中第一个 PDF）的哪一页
+        layout_page = QHBoxLayout()
+        self.spin_page = QSpinBox()
+        self.spin_page.setRange(1, 1)
+        self.spin_page.setFixedWidth(80)
+        self.lbl_preview_file = QLabel()
+        self.lbl_preview_file.setStyleSheet("color: #333333; border: none;")
+        layout_page.addWidget(QLabel("📄 预览页"))
+        layout_page.addWidget(self.spin_page)
+        layout_page.addSpacing(8)
+        layout_page.addWidget(self.lbl_preview_file)
+        layout_page.addStretch()
+        layout_preview.addLayout(layout_page)
         self.scroll_area = QScrollArea()
         self.scroll_area.setWidgetResizable(True)
         self.preview_label = QLabel()
@@ -384,10 +619,12 @@ class PDFWatermarkerApp(QMainWindow):
         self.btn_logo.clicked.connect(self.choose_logo)
         self.btn_start.clicked.connect(self.start_process)
         self.btn_clear.clicked.connect(self.clear_settings)
+        self.btn_resume.clicked.connect(self.resume_process)
+        self.btn_cancel.clicked.connect(self.cancel_process)
 
-        widgets = [self.edit_text, self.combo_font, self.slider_alpha,
+        widgets = [self.edit_text, self.edit_pages, self.combo_font, self.slider_alpha,
                    self.spin_h, self.spin_v, self.combo_text_pos,
-                   self.combo_logo_pos, self.spin_angle]
+                   self.combo_logo_pos, self.spin_angle, self.spin_page]
         # 现有 widgets 列表后面添加：
         widgets += [self.slider_text_size, self.slider_logo_size]
         for w in (self.slider_text_size, self.slider_logo_size):
@@ -395,6 +632,10 @@ class PDFWatermarkerApp(QMainWindow):
 
         # 文字颜色按钮
         self.btn_text_color.clicked.connect(self.choose_text_color)
+        self.chk_tile.toggled.connect(self._on_tile_toggled)
+        self.chk_flatten.toggled.connect(self.spin_flatten_dpi.setEnabled)
+        # 是否包含子文件夹会改变预览用的第一个文件
+        self.chk_recursive.toggled.connect(self._reset_preview_page)
 
         for w in widgets:
             if hasattr(w, 'textChanged'):
@@ -428,16 +669,18 @@ class PDFWatermarkerApp(QMainWindow):
         else:
             # 非 PDF 或文件夹，忽略
             return
-        # 更新进度条归零、重置预览
+        # 更新进度条归零、预览换成新文件的第一页
         self.progress.setValue(0)
-        self.preview_label.clear()
+        self._reset_preview_page()
 
 
     def browse_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "📂 选择文件夹")
         if folder:
+            self.dropped_file = None
             self.folder_path = folder
             self.lbl_folder.setText(folder)
+            self._reset_preview_page()
 
     def choose_text_color(self):
         color = QColorDialog.getColor(initial=self.text_color, parent=self, title="🎨 文字颜色")
@@ -452,114 +695,133 @@ class PDFWatermarkerApp(QMainWindow):
             self.logo_path = path
             self.update_preview()
 
+    def _on_tile_toggled(self, tile):
+        # 关闭平铺时超出网格上限的数量会被 QSpinBox 自动收回到上限
+        for spin in (self.spin_h, self.spin_v):
+            spin.setMaximum(TILE_MAX_COUNT if tile else GRID_MAX_COUNT)
+        self.update_preview()
+
     def clear_settings(self):
         self.lbl_folder.setText('未选择文件夹')
         self.edit_text.setText('研汇工坊')
         self.slider_alpha.setValue(20)
         self.spin_h.setValue(1)
         self.spin_v.setValue(1)
+        self.chk_tile.setChecked(False)
+        self.edit_pages.clear()
+        self.edit_password.clear()
+        self.chk_allow_weaker.setChecked(False)
+        self.chk_flatten.setChecked(False)
         self.combo_text_pos.setCurrentIndex(0)
         self.combo_logo_pos.setCurrentIndex(0)
         self.spin_angle.setValue(30)
         self.progress.setValue(0)
         self.preview_label.clear()
         self.dropped_file = None
+    def _init_preview_worker(self):
+        # 预览在独立线程渲染；同一时间只有一个渲染在跑，期间的新请求只保留最新一个
+        self._preview_seq     = 0
+        self._preview_busy    = False
+        self._preview_pending = None
+        # 文件夹预览用的第一个 PDF：((文件夹, 含子文件夹), 路径)，拖入/选择文件夹时清空
+        self._preview_source  = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self._request_preview)
+        self.preview_thread = QThread(self)
+        self.preview_worker = PreviewWorker()
+        self.preview_worker.moveToThread(self.preview_thread)
+        self.preview_requested.connect(self.preview_worker.render)
+        self.preview_worker.rendered.connect(self._on_preview_rendered)
+        self.preview_thread.start()
+
+    def _preview_pdf(self):
+        # 预览用的 PDF：拖入的单个文件，否则取文件夹里按处理顺序的第一个（扫到就停，不遍历整棵树）
+        # 扫描结果按文件夹缓存：大文件夹/网络盘上列目录很慢，拖动滑块时不再每次都扫
+        if self.dropped_file:
+            return self.dropped_file
+        key = (self.folder_path, self.chk_recursive.isChecked())
+        if self._preview_source is None or self._preview_source[0] != key:
+            path = ''
+            if self.folder_path and os.path.isdir(self.folder_path):
+                first = next(iter(PdfTree([self.folder_path], key[1])), None)
+                if first is not None:
+                    path = first[0]
+            self._preview_source = (key, path)
+        return self._preview_source[1]
+
+    def _reset_preview_page(self):
+        # 换了文件/文件夹：重新找预览文件，页码回到第一页
+        self._preview_source = None
+        self.spin_page.blockSignals(True)
+        self.spin_page.setRange(1, 1)
+        self.spin_page.blockSignals(False)
+        self.update_preview()
+
     def update_preview(self):
-        # A4 尺寸 pt 转像素
-        w_pt, h_pt = A4
-        scale = 0.4  # 初始缩放比例
-        w_px, h_px = int(w_pt * scale), int(h_pt * scale)
-        # 获取预览框的实际尺寸
+        # 各控件的 valueChanged/textChanged 都走这里：重新计时，停下来后才真正渲染
+        self.preview_timer.start()
+
+    def _request_preview(self):
+        # 获取预览框的实际尺寸；页面尺寸要等后台读到 PDF 才知道，缩放在后台线程里算
         w_1b1 = self.preview_label.width()
         h_1b1 = self.preview_label.height()
         # 预防不合理的尺寸
         if w_1b1 <= 0 or h_1b1 <= 0:
             return
-        # 计算缩放比例，保持宽高比例
-        scale = min(w_1b1 / w_px, h_1b1 / h_px)
-        # 根据缩放比例调整尺寸
-        w_px, h_px = int(w_px * scale), int(h_px * scale)
-        # 创建 Pixmap
-        pixmap = QPixmap(w_px, h_px)
-        pixmap.fill(Qt.white)
-        # 创建画笔对象
-        painter = QPainter(pixmap)
-        painter.setOpacity(self.slider_alpha.value() / 100)
-        painter.setPen(self.text_color)
+        pdf_path = self._preview_pdf()
+        self.lbl_preview_file.setText(os.path.basename(pdf_path) if pdf_path else "空白 A4")
 
-        # 加载字体
+        # 加载字体（QFontDatabase 只在界面线程里操作）
         font_key = self.combo_font.currentText()
-        _, font_path = FONT_OPTIONS[font_key]
         if font_key not in self.font_cache:
-            fid = QFontDatabase.addApplicationFont(font_path)
-            fam = QFontDatabase.applicationFontFamilies(fid)
+            try:
+                _, font_path = resolve_font(font_key)
+            except FileNotFoundError:
+                fam = []  # 找不到字体文件时用默认字体预览，开始处理时再提示
+            else:
+                fid = QFontDatabase.addApplicationFont(font_path)
+                fam = QFontDatabase.applicationFontFamilies(fid)
             self.font_cache[font_key] = fam[0] if fam else ''
-        # 动态字体大小：字体大小 = 预览画布宽度 * 比例
-        font_ratio = 0.05  # 5%，可以根据你界面自行调整
-        base_size = w_px * font_ratio
-        font_size = max(1, int(base_size * (self.slider_text_size.value() / 100.0)))
-        font = QFont(self.font_cache[font_key], font_size)
-        painter.setFont(font)
-
-        # … 计算好 w_px, h_px、设置好 font 之后 …
-        # 取字体度量
-        metrics = QFontMetrics(font)
-        text = self.edit_text.text()
-        text_width = metrics.horizontalAdvance(text)
-        text_height = metrics.height()
-        # —— 拉取用户设置 ——
-        h_count  = self.spin_h.value()
-        v_count  = self.spin_v.value()
-        angle    = self.spin_angle.value()
-        text_pos = self.combo_text_pos.currentText()
 
-        # —— 定义偏移量表 ——
-        offsets = {
-            '左上': (-w_px/4, -h_px/4),
-            '右上': ( w_px/4, -h_px/4),
-            '左下': (-w_px/4,  h_px/4),
-            '右下': ( w_px/4,  h_px/4),
-            '中心': (0, 0),
+        # —— 拉取用户设置：后台线程不能碰控件，这里拍一份快照 ——
+        params = {
+            'pdf_path': pdf_path,
+            'page_index': self.spin_page.value() - 1,
+            'label_size': QSize(w_1b1, h_1b1),
+            'alpha': self.slider_alpha.value() / 100,
+            'color': QColor(self.text_color),
+            'font_family': self.font_cache[font_key],
+            'text_size_pct': self.slider_text_size.value(),
+            'text': self.edit_text.text(),
+            'h_count': self.spin_h.value(),
+            'v_count': self.spin_v.value(),
+            'tile': self.chk_tile.isChecked(),
+            'pages': self.edit_pages.text().strip(),
+            'angle': self.spin_angle.value(),
+            'text_pos': self.combo_text_pos.currentText(),
+            'logo_path': self.logo_path,
+            'logo_size_pct': self.slider_logo_size.value(),
+            'logo_pos': self.combo_logo_pos.currentText(),
         }
-
-        # 绘制文本水印
-        for i in range(1, h_count + 1):
-            for j in range(1, v_count + 1):
-                x = i * w_px / (h_count + 1)
-                y = j * h_px / (v_count + 1)
-                ox, oy = offsets[text_pos]
-                painter.save()
-                painter.translate(int(x + ox), int(y + oy))
-                painter.rotate(angle)
-                # 以文字中心为原点，向左/向上偏移一半宽高
-                painter.drawText(
-                    int(-text_width / 2),
-                    int(text_height / 2),
-                    text
-                )
-                painter.restore()
-
-        # 绘制 Logo 水印
-        if self.logo_path:
-            logo = QPixmap(self.logo_path)
-            if not logo.isNull():
-                logo_size = int(100 * scale * (self.slider_logo_size.value() / 100.0))
-                logo = logo.scaled(logo_size, logo_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                pos = self.combo_logo_pos.currentText()
-                coords = {
-                    '左上': (0, 0), '右上': (w_px - logo.width(), 0),
-                    '左下': (0, h_px - logo.height()), '右下': (w_px - logo.width(), h_px - logo.height()),
-                    '中心': ((w_px - logo.width()) // 2, (h_px - logo.height()) // 2)
-                }
-                x_l, y_l = coords[pos]
-                painter.drawPixmap(x_l, y_l, logo)
-
-        painter.end()
-
-        # 更新预览标签
-        self.preview_label.setPixmap(pixmap.scaled(
-            self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
-        ))
+        self._preview_seq += 1
+        if self._preview_busy:
+            self._preview_pending = (self._preview_seq, params)
+        else:
+            self._preview_busy = True
+            self.preview_requested.emit(self._preview_seq, params)
+
+    def _on_preview_rendered(self, seq, image, pages):
+        self._preview_busy = False
+        if self._preview_pending is not None:
+            self._preview_busy = True
+            self.preview_requested.emit(*self._preview_pending)
+            self._preview_pending = None
+        # 设置已经变了的旧结果直接丢弃
+        if seq == self._preview_seq:
+            self.preview_label.setPixmap(QPixmap.fromImage(image))
+            self.spin_page.setMaximum(max(1, pages))
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -576,150 +838,143 @@ class PDFWatermarkerApp(QMainWindow):
             QMessageBox.warning(self, "错误", "请输入水印内容")
             return
 
-        # 注册字体（保持原有逻辑）
+        pages = self.edit_pages.text().strip()
+        if pages:
+            try:
+                PageSelection(pages)
+            except ValueError as e:
+                QMessageBox.warning(self, "错误", f"盖章页面: {e}")
+                return
+
+        # 注册字体：按字体搜索路径查找，找不到时提示
         key = self.combo_font.currentText()
-        font_name, font_path = FONT_OPTIONS[key]
-        if not os.path.exists(font_path):
-            QMessageBox.warning(self, "错误", f"找不到字体文件: {font_path}")
+        try:
+            font_name, font_path = resolve_font(key)
+        except FileNotFoundError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+        register_font(font_name, font_path)
+        if self.chk_flatten.isChecked() and _load_pymupdf() is None:
+            QMessageBox.warning(self, "错误", "栅格化需要安装 PyMuPDF: pip install pymupdf")
             return
-        pdfmetrics.registerFont(TTFont(font_name, font_path))
 
-        # 准备要处理的 PDF 列表
+        # 准备要处理的 PDF：文件夹边扫描边处理（含子文件夹时输出保持同样的目录结构）
         if hasattr(self, 'dropped_file') and self.dropped_file:
             pdfs = [self.dropped_file]
         else:
-            pdfs = [
-                os.path.join(self.folder_path, f)
-                for f in os.listdir(self.folder_path)
-                if f.lower().endswith('.pdf')
-            ]
+            pdfs = PdfTree([self.folder_path], recursive=self.chk_recursive.isChecked())
 
-        if not pdfs:
+        if next(iter(pdfs), None) is None:
             QMessageBox.warning(self, "错误", "没有找到可处理的 PDF")
             return
 
         # 禁用按钮，防止重复点击
-        self.btn_start.setEnabled(False)
-        self.btn_clear.setEnabled(False)
+        self._set_running(True)
 
         # 设置进度条
-        self.progress.setMaximum(len(pdfs))
         self.progress.setValue(0)
+        self.lbl_stats.clear()
 
         # 创建并启动后台线程
-        self.worker = WatermarkThread(
-            pdf_list=pdfs,
+        settings = WatermarkSettings(
             text=text,
             font_name=font_name,
+            font_path=font_path,
             logo_path=self.logo_path,
             alpha=self.slider_alpha.value() / 100,
             h_count=self.spin_h.value(),
             v_count=self.spin_v.value(),
+            tile=self.chk_tile.isChecked(),
+            pages=pages,
             text_pos=self.combo_text_pos.currentText(),
             logo_pos=self.combo_logo_pos.currentText(),
             angle=self.spin_angle.value(),
             text_size_pct=self.slider_text_size.value(),
             logo_size_pct=self.slider_logo_size.value(),
-            text_color=self.text_color,
+            text_color=self.text_color.getRgbF()[:3],
+            flatten=self.chk_flatten.isChecked(),
+            flatten_dpi=self.spin_flatten_dpi.value(),
+        )
+        self.worker = WatermarkThread(
+            pdf_list=pdfs,
+            settings=settings,
+            workers=self.spin_workers.value(),
+            force=not self.chk_skip_unchanged.isChecked(),
+            passwords=self.edit_password.text().split(),
+            allow_weaker=self.chk_allow_weaker.isChecked(),
             parent=self
         )
+        self._start_worker()
+
+    def resume_process(self):
+        job = pending_job(DEFAULT_OUTPUT_DIR)
+        if job is None:
+            QMessageBox.warning(self, "错误", "没有可继续的批处理")
+            self._set_running(False)
+            return
+        done, total = job
+        self._set_running(True)
+        self.progress.setValue(int(PROGRESS_STEPS * done / total) if total else 0)
+        self.lbl_stats.clear()
+        self.worker = WatermarkThread(resume=True, workers=self.spin_workers.value(),
+                                      passwords=self.edit_password.text().split(),
+                                      allow_weaker=self.chk_allow_weaker.isChecked(), parent=self)
+        self._start_worker()
+
+    def _start_worker(self):
         # 信号绑定
-        self.worker.progress.connect(self.progress.setValue)
+        self.worker.progress.connect(self._on_progress)
+        self.worker.failed.connect(self._on_failed)
         self.worker.finished.connect(self._on_finished)
         # 启动
         self.worker.start()
 
-    def _on_finished(self, out_dir):
-        QMessageBox.information(self, "完成", f"处理完成，输出目录: {out_dir}")
-        self.btn_start.setEnabled(True)
-        self.btn_clear.setEnabled(True)
-
-    def _create_watermark_page(self,
-                                   text, font_name, logo_path,
-                                   alpha, h_count, v_count,
-                                   text_pos, logo_pos, angle,
-                                   text_size_pct, logo_size_pct, text_color):
-        packet = BytesIO()
-        can = canvas.Canvas(packet, pagesize=A4)
-
-        # --- 文字：动态字号 & 颜色 ---
-        base_pt = 40
-        pt_size = base_pt * (text_size_pct / 100.0)
-        can.setFont(font_name, pt_size)
-        # reportlab 颜色需要 0–1 浮点
-        r, g, b, _ = text_color.getRgbF()
-        can.setFillColor(Color(r, g, b, alpha))
-        w, h = A4
-        # 文字宽度（pt 单位）
-        text_width = stringWidth(text, font_name, pt_size)
-        text_height = pt_size  # 近似行高就是字号
+    def cancel_process(self):
+        # 在文件之间或页面之间停下，已完成的文件记录在检查点里
+        if self.worker and self.worker.isRunning():
+            self.worker.cancel()
+            self.btn_cancel.setEnabled(False)
+            self.btn_cancel.setText("⏳ 正在取消…")
 
-        offsets = {
-            '左上': (-w / 4, h / 4),
-            '右上': (w / 4, h / 4),
-            '左下': (-w / 4, -h / 4),
-            '右下': (w / 4, -h / 4),
-            '中心': (0, 0)
-        }
+    def _set_running(self, running):
+        self.btn_start.setEnabled(not running)
+        self.btn_clear.setEnabled(not running)
+        self.btn_resume.setEnabled(not running and pending_job(DEFAULT_OUTPUT_DIR) is not None)
+        self.btn_cancel.setEnabled(running)
+        self.btn_cancel.setText("⏹️ 取消")
 
-        for i in range(1, h_count + 1):
-            for j in range(1, v_count + 1):
-                cx = i * w / (h_count + 1) + offsets[text_pos][0]
-                cy = j * h / (v_count + 1) + offsets[text_pos][1]
-                can.saveState()
-                can.translate(cx, cy)
-                can.rotate(-angle)
-                # 居中绘制：左移一半宽度，上移半行高
-                can.drawString(-text_width / 2, -text_height / 2, text)
-                can.restoreState()
-
-        if logo_path and os.path.exists(logo_path):
-            img = Image.open(logo_path)
-            scale_factor = 0.2 * (logo_size_pct / 100.0)
-            img_width, img_height = img.size
-            img_width *= scale_factor
-            img_height *= scale_factor
-
-            coords = {
-                '左上': (0, h - img_height),
-                '右上': (w - img_width, h - img_height),
-                '左下': (0, 0),
-                '右下': (w - img_width, 0),
-                '中心': ((w - img_width) / 2, (h - img_height) / 2),
-            }
-            x, y = coords[logo_pos]
-
-            can.drawImage(logo_path, x, y, width=img_width, height=img_height, preserveAspectRatio=True, mask='auto')
-
-        can.showPage()
-        can.save()
-        packet.seek(0)
-        return packet
-
-    def _add_watermark(self, inp_path, out_path,
-                           text, font_name, logo_path,
-                           alpha, h_count, v_count,
-                           text_pos, logo_pos, angle,
-                           text_size_pct, logo_size_pct, text_color):
-
-        output = PdfWriter()
-        reader = PdfReader(inp_path)
-
-        watermark = self._create_watermark_page(
-            text, font_name, logo_path,
-            alpha, h_count, v_count,
-            text_pos, logo_pos, angle,
-            text_size_pct, logo_size_pct, text_color
-        )
-        watermark_pdf = PdfReader(watermark)
-        watermark_page = watermark_pdf.pages[0]
+    def _on_progress(self, info):
+        self.progress.setValue(int(PROGRESS_STEPS * info.fraction))
+        self.lbl_stats.setText(format_progress(info))
 
-        for page in reader.pages:
-            page.merge_page(watermark_page)
-            output.add_page(page)
+    def _on_failed(self, message):
+        QMessageBox.warning(self, "错误", f"批处理出错: {message}")
 
-        with open(out_path, "wb") as f:
-            output.write(f)
+    def _on_finished(self, out_dir):
+        result = self.worker.result
+        self._set_running(False)
+        if result is None:
+            # 出错时已由 _on_failed 提示
+            return
+        if result.cancelled:
+            QMessageBox.information(self, "已取消", f"已取消，可点击“继续上次”接着处理。输出目录: {out_dir}")
+        else:
+            message = f"处理完成，输出目录: {out_dir}"
+            if result.quarantined:
+                message += (f"\n{result.quarantined} 个文件加密（缺少密码或重新加密会变弱）、损坏或超限，未处理，"
+                            f"已放进输出目录的 {QUARANTINE_DIR}/，原因见 {QUARANTINE_NAME}")
+            if result.warnings:
+                message += f"\n{len(result.warnings)} 个文件的重新加密比原文件弱，见 error_log.txt"
+            QMessageBox.information(self, "完成", message)
+
+    def closeEvent(self, event):
+        # 关闭窗口时先让后台任务在当前页处停下，进度留在检查点里，下次可继续
+        if self.worker and self.worker.isRunning():
+            self.worker.cancel()
+            self.worker.wait()
+        self.preview_thread.quit()
+        self.preview_thread.wait()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':